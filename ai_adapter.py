@@ -5,29 +5,701 @@ AI 回复适配器 - 解耦 BiliGo 和具体 LLM 实现
 
 import requests
 import json
-from typing import Optional
+import random
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+# 归一化时丢弃的 Unicode 类别：标点(P)、符号/emoji(S)、空白(Z)、控制与格式字符(C)、组合标记(M)
+_STRIPPED_CATEGORIES = ('P', 'S', 'Z', 'C', 'M')
+
+
+def normalize_message(message: str) -> str:
+    """
+    归一化消息文本，作为回复缓存的键
+
+    全角/半角折叠（NFKC）、大小写折叠，并去掉标点、emoji 和空白，
+    使 "怎么买"、"怎么买？"、"怎么买!!" 得到相同的键
+    """
+    folded = unicodedata.normalize('NFKC', message).casefold()
+    return ''.join(ch for ch in folded if unicodedata.category(ch)[0] not in _STRIPPED_CATEGORIES)
+
+
+class ReplyCache:
+    """带 TTL 和 LRU 容量上限的回复缓存"""
+
+    def __init__(self, ttl: float = 600.0, capacity: int = 1000, clock: Callable[[], float] = time.monotonic):
+        """
+        初始化回复缓存
+
+        Args:
+            ttl: 缓存有效期（秒）
+            capacity: 最多缓存的回复数，0 表示禁用缓存
+            clock: 时钟函数（便于测试注入）
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {key: (过期时间, 回复)}
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """读取缓存，未命中或已过期返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key: Hashable, reply: str):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['capacity'] = self.capacity
+            stats['ttl'] = self.ttl
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+            return stats
+
+
+class _TalkerRing:
+    """单个用户的定长环形对话缓冲区"""
+
+    __slots__ = ('turns', 'head', 'size')
+
+    def __init__(self, capacity: int):
+        self.turns = [None] * capacity  # [(角色, 内容, 时间戳)]
+        self.head = 0  # 下一条写入的位置
+        self.size = 0
+
+    def append(self, turn: tuple):
+        self.turns[self.head] = turn
+        self.head = (self.head + 1) % len(self.turns)
+        if self.size < len(self.turns):
+            self.size += 1
+
+    def ordered(self) -> List[tuple]:
+        """按时间从早到晚返回已保存的轮次"""
+        capacity = len(self.turns)
+        start = (self.head - self.size) % capacity
+        return [self.turns[(start + i) % capacity] for i in range(self.size)]
+
+
+class ConversationContext:
+    """按用户保存最近几轮对话，作为 RAG 请求的上下文
+
+    每个用户一个定长环形缓冲区，内容截断到 max_chars；用户按最近活跃时间排列在有序字典中，
+    超过 max_talkers 或空闲超过 idle_ttl 的用户从队头淘汰，总内存上限为 max_talkers × turns × max_chars
+    """
+
+    def __init__(
+        self,
+        turns: int = 6,
+        max_talkers: int = 5000,
+        max_chars: int = 200,
+        idle_ttl: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        初始化对话上下文存储
+
+        Args:
+            turns: 每个用户保留的最近轮次数
+            max_talkers: 最多保留的用户数，超出时淘汰最久未活跃的用户
+            max_chars: 每轮内容的最大字符数
+            idle_ttl: 用户空闲超过该时间（秒）后丢弃其上下文
+            clock: 时钟函数（便于测试注入）
+        """
+        self.turns = max(1, turns)
+        self.max_talkers = max_talkers
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()  # {talker_id: (最近活跃时间, _TalkerRing)}
+        self._stats = {'added': 0, 'evicted': 0, 'expired': 0}
+
+    def add(self, talker_id: Hashable, role: str, content: str, timestamp: Optional[float] = None):
+        """
+        记录一轮对话
+
+        Args:
+            talker_id: 用户 ID
+            role: 'user' 或 'assistant'
+            content: 消息内容
+            timestamp: 消息时间戳（默认当前时间）
+        """
+        if not content or not isinstance(content, str) or not content.strip():
+            return
+        key = str(talker_id)
+        with self._lock:
+            now = self._clock()
+            self._expire_locked(now)
+            entry = self._rings.pop(key, None)
+            ring = entry[1] if entry is not None else _TalkerRing(self.turns)
+            ring.append((role, content.strip()[:self.max_chars], timestamp if timestamp is not None else time.time()))
+            self._rings[key] = (now, ring)
+            self._stats['added'] += 1
+            while len(self._rings) > self.max_talkers:
+                self._rings.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def recent(self, talker_id: Hashable, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取用户最近的对话轮次
+
+        Returns:
+            按时间从早到晚排列的 [{'role', 'content', 'timestamp'}]，无记录返回空列表
+        """
+        key = str(talker_id)
+        with self._lock:
+            entry = self._rings.get(key)
+            if entry is None:
+                return []
+            if self.idle_ttl and entry[0] + self.idle_ttl <= self._clock():
+                del self._rings[key]
+                self._stats['expired'] += 1
+                return []
+            turns = entry[1].ordered()
+        if limit is not None:
+            turns = turns[-limit:] if limit > 0 else []
+        return [{'role': role, 'content': content, 'timestamp': ts} for role, content, ts in turns]
+
+    def forget(self, talker_id: Hashable):
+        """丢弃用户的上下文"""
+        with self._lock:
+            self._rings.pop(str(talker_id), None)
+
+    def _expire_locked(self, now: float):
+        if not self.idle_ttl:
+            return
+        rings = self._rings
+        while rings:
+            key, (last_active, _) = next(iter(rings.items()))
+            if last_active + self.idle_ttl > now:
+                break
+            del rings[key]
+            self._stats['expired'] += 1
+
+    def clear(self):
+        """清空所有上下文"""
+        with self._lock:
+            self._rings.clear()
+
+    def __len__(self):
+        return len(self._rings)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取上下文统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['talkers'] = len(self._rings)
+            stats['max_talkers'] = self.max_talkers
+            stats['turns'] = self.turns
+            return stats
+
+
+class _Flight:
+    """一次进行中的上游调用"""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """进行中请求合并：相同键的并发调用只执行一次，所有等待者共享结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # {key: _Flight}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """执行 fn，若相同键的调用正在进行则等待并返回它的结果（异常同样共享）"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self._stats['shared'] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self._stats['calls'] += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self) -> Dict[str, Any]:
+        """获取合并统计（shared 即省下的上游调用次数）"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+            return stats
+
+
+class CircuitBreaker:
+    """熔断器（closed / open / half_open）
+
+    在滚动时间窗口内统计调用的错误率与延迟：错误率超过阈值时打开熔断，期间的调用立即被拒绝；
+    打开后由后台线程定期执行 probe（如 /health），探测成功或打开时间届满后进入半开状态，
+    放行一次试探调用，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        error_rate: float = 0.5,
+        min_calls: int = 5,
+        window: float = 60.0,
+        open_seconds: float = 30.0,
+        slow_call_seconds: Optional[float] = None,
+        probe: Optional[Callable[[], bool]] = None,
+        probe_interval: float = 5.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        初始化熔断器
+
+        Args:
+            error_rate: 打开熔断的错误率阈值（0~1）
+            min_calls: 窗口内至少有多少次调用才计算错误率
+            window: 滚动统计窗口（秒）
+            open_seconds: 打开后多久允许试探调用（即使探测未成功）
+            slow_call_seconds: 超过该耗时的调用也计为失败，None 表示不按延迟判定
+            probe: 后台健康探测函数，返回是否健康
+            probe_interval: 打开状态下的探测间隔（秒）
+            clock: 时钟函数（便于测试注入）
+        """
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.probe_interval = probe_interval
+        self._probe = probe
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._calls = deque()  # [(时间, 是否成功, 耗时)]
+        self._probe_thread = None
+        self._stats = {'opened': 0, 'rejected': 0, 'probes': 0, 'probe_failures': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def allow(self) -> bool:
+        """是否放行一次调用（打开状态立即返回 False）"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def release(self):
+        """归还 allow() 放行后最终未发出的调用：不计入统计，半开状态下释放试探名额"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record(self, success: bool, latency: float):
+        """记录一次调用结果"""
+        if success and self.slow_call_seconds is not None and latency >= self.slow_call_seconds:
+            success = False
+        with self._lock:
+            now = self._clock()
+            if self._state == self.HALF_OPEN:
+                self._trial_in_flight = False
+                if success:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                    return
+            self._calls.append((now, success, latency))
+            self._trim(now)
+            if self._state == self.CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, ok, _ in self._calls if not ok)
+                if failures / len(self._calls) >= self.error_rate:
+                    self._open(now)
+
+    def _open(self, now: float):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._trial_in_flight = False
+        self._stats['opened'] += 1
+        if self._probe is not None and (self._probe_thread is None or not self._probe_thread.is_alive()):
+            self._probe_thread = threading.Thread(target=self._probe_loop, name='breaker-probe', daemon=True)
+            self._probe_thread.start()
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _probe_loop(self):
+        """打开期间定期探测，成功后进入半开状态"""
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if self._state != self.OPEN:
+                    return
+            try:
+                healthy = bool(self._probe())
+            except Exception:
+                healthy = False
+            with self._lock:
+                self._stats['probes'] += 1
+                if not healthy:
+                    self._stats['probe_failures'] += 1
+                    continue
+                if self._state == self.OPEN:
+                    self._state = self.HALF_OPEN
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        """获取熔断器状态与窗口统计"""
+        with self._lock:
+            self._maybe_half_open()
+            self._trim(self._clock())
+            stats = dict(self._stats)
+            stats['state'] = self._state
+            stats['window_calls'] = len(self._calls)
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            stats['error_rate'] = round(failures / len(self._calls), 3) if self._calls else 0.0
+            latencies = sorted(latency for _, _, latency in self._calls)
+            if latencies:
+                stats['latency_p50'] = round(latencies[len(latencies) // 2], 3)
+                stats['latency_p95'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+            return stats
+
+
+class RAGBackend:
+    """一个 RAG 服务副本及其负载与延迟统计"""
+
+    def __init__(self, url: str, alpha: float = 0.3, sample_size: int = 100):
+        """
+        初始化后端
+
+        Args:
+            url: 服务地址
+            alpha: 延迟 EWMA 平滑系数
+            sample_size: 用于计算 p95 的最近延迟样本数
+        """
+        self.url = url.rstrip('/')
+        self.alpha = alpha
+        self.ewma = None  # 秒，尚无样本时为 None（优先被探索）
+        self.in_flight = 0
+        self.consecutive_errors = 0
+        self.ejected_until = 0.0
+        self.supports_batch = None  # 是否提供 /chat/batch，None 表示尚未探测
+        self._latencies = deque(maxlen=sample_size)
+        self.stats_counters = {'requests': 0, 'errors': 0, 'hedged': 0, 'hedge_wins': 0, 'batches': 0}
+
+    def score(self) -> float:
+        """负载评分：EWMA 延迟 ×（进行中请求数 + 1），越小越优先"""
+        return (self.ewma or 0.0) * (self.in_flight + 1)
+
+    def observe(self, success: bool, latency: float, now: float, eject_after: int, eject_seconds: float):
+        """记录一次调用结果（需在 RAGPool 的锁内调用）"""
+        self.in_flight -= 1
+        self.stats_counters['requests'] += 1
+        if success:
+            self.consecutive_errors = 0
+            self.ewma = latency if self.ewma is None else self.ewma + self.alpha * (latency - self.ewma)
+            self._latencies.append(latency)
+            return
+        self.stats_counters['errors'] += 1
+        self.consecutive_errors += 1
+        if self.consecutive_errors >= eject_after:
+            # 连续失败的副本暂时摘除
+            self.ejected_until = now + eject_seconds
+
+    def p95(self, min_samples: int = 20) -> Optional[float]:
+        """最近成功调用延迟的 p95，样本不足时返回 None"""
+        if len(self._latencies) < min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        stats = dict(self.stats_counters)
+        stats['url'] = self.url
+        stats['ewma_ms'] = round(self.ewma * 1000, 1) if self.ewma is not None else None
+        p95 = self.p95(min_samples=1)
+        stats['p95_ms'] = round(p95 * 1000, 1) if p95 is not None else None
+        stats['in_flight'] = self.in_flight
+        stats['ejected'] = self.ejected_until > now
+        stats['supports_batch'] = self.supports_batch
+        return stats
+
+
+class RAGPool:
+    """多个 RAG 副本的负载均衡
+
+    按 power-of-two-choices 选择后端：随机取两个可用副本，选 EWMA 延迟 ×（进行中请求数 + 1）较小者；
+    连续失败的副本会被暂时摘除
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        eject_after: int = 3,
+        eject_seconds: float = 10.0,
+        rand: Optional[random.Random] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        if not urls:
+            raise ValueError("至少需要一个 RAG 服务地址")
+        self.backends = [RAGBackend(url) for url in urls]
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._rand = rand or random.Random()
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude: Tuple[RAGBackend, ...] = ()) -> Optional[RAGBackend]:
+        """选择一个后端并计入进行中请求，全部尝试过时返回 None"""
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                return None
+            now = self._clock()
+            available = [b for b in candidates if b.ejected_until <= now]
+            if not available:
+                # 全部被摘除时选最早恢复的副本
+                available = [min(candidates, key=lambda b: b.ejected_until)]
+            if len(available) == 1:
+                chosen = available[0]
+            else:
+                first, second = self._rand.sample(available, 2)
+                chosen = first if first.score() <= second.score() else second
+            chosen.in_flight += 1
+            return chosen
+
+    def release(self, backend: RAGBackend, success: bool, latency: float):
+        """归还后端并记录调用结果"""
+        with self._lock:
+            backend.observe(success, latency, self._clock(), self.eject_after, self.eject_seconds)
+
+    def cancel(self, backend: RAGBackend):
+        """归还未实际发出请求的后端（不计入统计）"""
+        with self._lock:
+            backend.in_flight -= 1
+
+    def record_hedge(self, backend: RAGBackend, won: bool):
+        with self._lock:
+            backend.stats_counters['hedge_wins' if won else 'hedged'] += 1
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各后端统计"""
+        with self._lock:
+            now = self._clock()
+            return [backend.stats(now) for backend in self.backends]
+
+
+class ReplyBatcher:
+    """微批聚合：把多个线程的单条请求攒成批次，达到批大小或等待时间到期时一起处理"""
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], List[Any]],
+        max_batch: int = 8,
+        linger: float = 0.02,
+        name: str = 'reply-batcher'
+    ):
+        """
+        初始化微批聚合器
+
+        Args:
+            handler: 批处理函数，输入请求列表，返回等长的结果列表
+            max_batch: 最大批大小
+            linger: 批次中第一条请求最多等待多久（秒）就发出
+            name: 线程名
+        """
+        self._handler = handler
+        self.max_batch = max_batch
+        self.linger = linger
+        self._name = name
+        self._cond = threading.Condition()
+        self._queue = []  # [(请求, Future, 入队时间)]
+        self._thread = None
+        self._stats = {'batches': 0, 'items': 0, 'max_batch_seen': 0}
+
+    def submit(self, item: Any) -> Future:
+        """提交一条请求，返回其结果的 Future"""
+        future = Future()
+        with self._cond:
+            self._queue.append((item, future, time.monotonic()))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    # 空闲一段时间后退出，有新请求时再启动
+                    if not self._cond.wait(timeout=30):
+                        if not self._queue:
+                            self._thread = None
+                            return
+                while len(self._queue) < self.max_batch:
+                    remaining = self._queue[0][2] + self.linger - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+                batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+                self._stats['batches'] += 1
+                self._stats['items'] += len(batch)
+                self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(batch))
+
+            try:
+                results = self._handler([item for item, _, _ in batch])
+            except BaseException as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取微批统计"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._queue)
+            stats['avg_batch'] = round(stats['items'] / stats['batches'], 2) if stats['batches'] else 0.0
+            return stats
 
 
 class AIReplyAdapter:
     """AI 回复中转适配器"""
 
-    def __init__(self, rag_service_url: str = "http://127.0.0.1:8000", timeout: int = 30):
+    def __init__(
+        self,
+        rag_service_url: Union[str, List[str]] = "http://127.0.0.1:8000",
+        timeout: int = 30,
+        cache_ttl: float = 600.0,
+        cache_size: int = 1000,
+        breaker: Optional[CircuitBreaker] = None,
+        health_ttl: float = 10.0,
+        hedge: bool = False,
+        hedge_after: Optional[float] = None,
+        batch_size: int = 8,
+        batch_linger: float = 0.0,
+        context_turns: int = 6,
+        context_talkers: int = 5000
+    ):
         """
         初始化 AI 适配器
 
         Args:
-            rag_service_url: RAG 服务地址（可从配置读取）
+            rag_service_url: RAG 服务地址（可从配置读取），多个副本可传列表或逗号分隔的字符串
             timeout: 请求超时时间（秒）
+            cache_ttl: 回复缓存有效期（秒）
+            cache_size: 回复缓存容量，0 表示禁用缓存
+            breaker: RAG 服务熔断器，默认按超时时间构建并用 /health 做后台探测
+            health_ttl: is_available 健康检查结果的缓存时间（秒）
+            hedge: 首个请求超过阈值仍未返回时，是否向另一个副本发送重复请求
+            hedge_after: 对冲阈值（秒），None 表示使用该副本最近延迟的 p95
+            batch_size: reply_many 每批最多发送的消息数
+            batch_linger: reply() 的微批等待时间（秒），大于 0 时并发的单条请求会被攒成批次发送，0 表示不攒批
+            context_turns: 随请求发送的最近对话轮次数，0 表示不发送上下文
+            context_talkers: 最多保留上下文的用户数
         """
-        self.rag_service_url = rag_service_url.rstrip('/')
+        urls = rag_service_url.split(',') if isinstance(rag_service_url, str) else list(rag_service_url)
+        urls = [url.strip() for url in urls if url and url.strip()]
+        self.pool = RAGPool(urls)
+        self.rag_service_url = self.pool.backends[0].url
         self.timeout = timeout
+        self.hedge = hedge and len(urls) > 1
+        self.hedge_after = hedge_after
+        self.batch_size = max(1, batch_size)
+        self._executor_lock = threading.Lock()
+        self._executor = None
+        self.batcher = ReplyBatcher(self._request_batch, max_batch=self.batch_size, linger=batch_linger) if batch_linger > 0 else None
         self.session = requests.Session()
+        self.cache = ReplyCache(ttl=cache_ttl, capacity=cache_size)
+        self.inflight = SingleFlight()
+        self.context = ConversationContext(turns=context_turns, max_talkers=context_talkers) if context_turns > 0 else None
+        self.breaker = breaker or CircuitBreaker(slow_call_seconds=timeout, probe=self._probe_health)
+        self.health_ttl = health_ttl
+        self._health_cache = None  # (过期时间, 是否可用)
 
     def reply(
         self,
         message: str,
         user_id: str,
         user_name: str,
+        use_cache: bool = True,
+        cache_scope: Optional[Hashable] = None,
+        coalesce: bool = True,
+        history: Optional[List[Dict[str, Any]]] = None,
         **kwargs
     ) -> Optional[str]:
         """
@@ -37,6 +709,10 @@ class AIReplyAdapter:
             message: 用户消息内容
             user_id: 用户 ID（用于维护对话历史）
             user_name: 用户名称
+            use_cache: 是否使用回复缓存（False 时强制请求 RAG 服务）
+            cache_scope: 缓存与合并作用域，默认所有用户共享；带有对话上下文时自动限定为该用户
+            coalesce: 是否与进行中的相同问题合并为一次上游调用
+            history: 随请求发送的最近对话轮次，默认从 self.context 读取该用户的记录
             **kwargs: 其他参数（保留扩展性）
 
         Returns:
@@ -46,70 +722,357 @@ class AIReplyAdapter:
         if not message or not isinstance(message, str) or not message.strip():
             return None
 
+        if history is None:
+            history = self.recent_turns(user_id, message)
+        if history and cache_scope is None:
+            # 回复依赖该用户的对话上下文，不能与其他用户共用缓存或合并请求
+            cache_scope = ('user', user_id)
+
+        # 同一问题的不同写法命中同一条缓存，减少 RAG 往返
+        normalized = normalize_message(message)
+        key = (cache_scope, normalized) if normalized else None
+        use_cache = use_cache and key is not None and self.cache.capacity > 0
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        def fetch():
+            if self.batcher is not None:
+                item = {'message': message, 'user_id': user_id, 'user_name': user_name, 'history': history}
+                reply = self.batcher.submit(item).result()
+            else:
+                reply = self._request_reply(message, user_id, user_name, history)
+            if reply is not None and use_cache:
+                self.cache.put(key, reply)
+            return reply
+
+        # 并发的相同问题只发起一次上游调用
+        if coalesce and key is not None:
+            return self.inflight.do(key, fetch)
+        return fetch()
+
+    def recent_turns(self, user_id: str, message: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        读取用户最近的对话轮次（不含与当前消息相同的最后一条用户消息，它已作为 message 发送）
+
+        Returns:
+            [{'role', 'content'}]，未启用上下文时返回空列表
+        """
+        if self.context is None:
+            return []
+        turns = [{'role': turn['role'], 'content': turn['content']} for turn in self.context.recent(user_id)]
+        if message and turns and turns[-1] == {'role': 'user', 'content': message.strip()[:self.context.max_chars]}:
+            turns.pop()
+        return turns
+
+    def remember(self, user_id: str, role: str, content: str, timestamp: Optional[float] = None):
+        """记录一轮对话到上下文（role 为 'user' 或 'assistant'）"""
+        if self.context is not None:
+            self.context.add(user_id, role, content, timestamp)
+
+    def reply_many(self, items: List[dict], use_cache: bool = True) -> List[Optional[str]]:
+        """
+        批量获取 AI 回复
+
+        Args:
+            items: 请求列表，每项包含 message、user_id、user_name，可选 history（默认从上下文读取）
+            use_cache: 是否使用回复缓存
+
+        Returns:
+            与 items 顺序一致的回复列表（失败的项为 None）
+        """
+        results = [None] * len(items)
+        todo = []
+        prepared = {}
+        keys = {}
+        use_cache = use_cache and self.cache.capacity > 0
+        for index, item in enumerate(items):
+            message = item.get('message')
+            if not message or not isinstance(message, str) or not message.strip():
+                continue
+            item = dict(item)
+            if item.get('history') is None:
+                item['history'] = self.recent_turns(item['user_id'], message)
+            prepared[index] = item
+            normalized = normalize_message(message)
+            if use_cache and normalized:
+                # 与 reply() 相同：带有对话上下文的回复只缓存给该用户
+                keys[index] = (('user', item['user_id']) if item['history'] else None, normalized)
+                cached = self.cache.get(keys[index])
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            todo.append(index)
+
+        for start in range(0, len(todo), self.batch_size):
+            chunk = todo[start:start + self.batch_size]
+            replies = self._request_batch([prepared[index] for index in chunk])
+            for index, reply in zip(chunk, replies):
+                results[index] = reply
+                if reply is not None and index in keys:
+                    self.cache.put(keys[index], reply)
+        return results
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """对冲请求与并行单条请求共用的线程池"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(8, self.batch_size), thread_name_prefix='rag-call')
+            return self._executor
+
+    def _request_batch(self, items: List[dict]) -> List[Optional[str]]:
+        """发送一批请求：副本提供 /chat/batch 时一次发送，否则并行发送单条请求"""
+        if len(items) > 1 and self.breaker.allow():
+            backend = self.pool.acquire()
+            if backend is not None and self._supports_batch(backend):
+                started = time.monotonic()
+                backend_ok, replies = self._call_batch(backend, items)
+                self.breaker.record(backend_ok, time.monotonic() - started)
+                if backend_ok:
+                    return replies
+            else:
+                if backend is not None:
+                    self.pool.cancel(backend)
+                # 未发出请求，归还放行许可，不计入熔断统计
+                self.breaker.release()
+
+        executor = self._get_executor()
+        futures = [
+            executor.submit(self._request_reply, item['message'], item['user_id'], item['user_name'], item.get('history'))
+            for item in items
+        ]
+        return [future.result() for future in futures]
+
+    def _supports_batch(self, backend: RAGBackend) -> bool:
+        """探测副本是否提供批量接口（/health 返回 batch: true 或 features 含 chat_batch）"""
+        if backend.supports_batch is None:
+            try:
+                response = self.session.get(f"{backend.url}/health", timeout=5)
+                data = response.json() if response.status_code == 200 else {}
+                features = data.get('features') or []
+                backend.supports_batch = bool(data.get('batch')) or 'chat_batch' in features
+            except Exception:
+                return False
+        return backend.supports_batch
+
+    def _call_batch(self, backend: RAGBackend, items: List[dict]) -> Tuple[bool, List[Optional[str]]]:
+        """
+        请求副本的 /chat/batch
+
+        请求体 {"platform": "bilibili", "requests": [...]}，响应 {"success": true, "results": [...]}，
+        results 与 requests 顺序一致，每项为回复文本或 {"success": bool, "reply": str}
+
+        Returns:
+            (后端是否正常, 与 items 顺序一致的回复列表)
+        """
+        started = time.monotonic()
+        backend_ok = False
+        try:
+            response = self.session.post(
+                f"{backend.url}/chat/batch",
+                json={
+                    "platform": "bilibili",
+                    "requests": [self._build_request(item['message'], item['user_id'], item['user_name'], item.get('history')) for item in items]
+                },
+                timeout=self.timeout
+            )
+            if response.status_code in (404, 405):
+                # 副本不再提供批量接口，回退到单条请求
+                backend.supports_batch = False
+                backend_ok = True
+                return False, []
+            if response.status_code != 200:
+                return False, []
+            result = response.json()
+            entries = result.get("results") or []
+            if not result.get("success") or len(entries) != len(items):
+                return False, []
+            backend_ok = True
+            replies = []
+            for entry in entries:
+                if isinstance(entry, dict):
+                    entry = entry.get("reply") if entry.get("success", True) else None
+                replies.append(entry if entry and isinstance(entry, str) else None)
+            backend.stats_counters['batches'] += 1
+            return True, replies
+        except Exception:
+            return False, []
+        finally:
+            self.pool.release(backend, backend_ok, time.monotonic() - started)
+
+    @staticmethod
+    def _build_request(message: str, user_id: str, user_name: str, history: Optional[List[dict]] = None) -> dict:
+        request_data = {
+            "platform": "bilibili",  # 标识来源平台
+            "user_id": str(user_id),
+            "user_name": user_name,
+            "message": message.strip()
+        }
+        if history:
+            # 最近几轮对话（从早到晚），RAG 服务无需再单独拉取历史
+            request_data["history"] = history
+        return request_data
+
+    def _request_reply(self, message: str, user_id: str, user_name: str, history: Optional[List[dict]] = None) -> Optional[str]:
+        """请求 RAG 服务生成回复，失败返回 None（熔断打开时立即返回）"""
+        if not self.breaker.allow():
+            return None
+
+        request_data = self._build_request(message, user_id, user_name, history)
+
+        started = time.monotonic()
+        backend_ok = False
         try:
-            # 调用 RAG 服务
-            request_data = {
-                "platform": "bilibili",  # 标识来源平台
-                "user_id": str(user_id),
-                "user_name": user_name,
-                "message": message.strip()
-            }
+            backend_ok, reply = self._dispatch(request_data)
+            return reply
+        finally:
+            self.breaker.record(backend_ok, time.monotonic() - started)
 
+    def _dispatch(self, request_data: dict) -> Tuple[bool, Optional[str]]:
+        """选择副本发送请求，失败时切换到其他副本，必要时对冲，返回 (后端是否正常, 回复)"""
+        tried = ()
+        while True:
+            primary = self.pool.acquire(exclude=tried)
+            if primary is None:
+                return False, None
+            tried += (primary,)
+
+            hedge_delay = self._hedge_delay(primary, tried)
+            if hedge_delay is None:
+                backend_ok, reply = self._call_backend(primary, request_data)
+            else:
+                backend_ok, reply, tried = self._call_hedged(primary, request_data, hedge_delay, tried)
+            if backend_ok:
+                return True, reply
+
+    def _hedge_delay(self, primary: RAGBackend, tried: tuple) -> Optional[float]:
+        if not self.hedge or len(tried) >= len(self.pool.backends):
+            return None
+        return self.hedge_after if self.hedge_after is not None else primary.p95()
+
+    def _call_hedged(self, primary: RAGBackend, request_data: dict, hedge_delay: float, tried: tuple):
+        """先请求 primary，超过 hedge_delay 未返回则再请求另一个副本，采用先成功的结果"""
+        executor = self._get_executor()
+        futures = {executor.submit(self._call_backend, primary, request_data): primary}
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done:
+            secondary = self.pool.acquire(exclude=tried)
+            if secondary is not None:
+                tried += (secondary,)
+                self.pool.record_hedge(secondary, won=False)
+                futures[executor.submit(self._call_backend, secondary, request_data)] = secondary
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                backend_ok, reply = future.result()
+                if backend_ok:
+                    if futures[future] is not primary:
+                        self.pool.record_hedge(futures[future], won=True)
+                    # 较慢的请求在后台完成，结果丢弃
+                    return True, reply, tried
+        return False, None, tried
+
+    def _call_backend(self, backend: RAGBackend, request_data: dict) -> Tuple[bool, Optional[str]]:
+        """
+        请求一个副本
+
+        网络异常、超时、5xx 和无法解析的响应计为后端故障；业务失败（success=False）不计
+
+        Returns:
+            (后端是否正常, 回复文本)
+        """
+        started = time.monotonic()
+        backend_ok = False
+        try:
+            # 调用 RAG 服务
             response = self.session.post(
-                f"{self.rag_service_url}/chat",
+                f"{backend.url}/chat",
                 json=request_data,
                 timeout=self.timeout
             )
 
             if response.status_code == 200:
                 result = response.json()
+                backend_ok = True
                 if result.get("success"):
                     reply = result.get("reply")
                     # 确保返回字符串，不返回 None 或空字符串
                     if reply and isinstance(reply, str):
-                        return reply
-                    return None
+                        return True, reply
+                    return True, None
                 else:
-                    return None
+                    return True, None
             else:
-                return None
+                backend_ok = response.status_code < 500
+                return backend_ok, None
 
         except requests.Timeout:
-            return None
+            return False, None
         except json.JSONDecodeError:
-            return None
+            return False, None
         except Exception as e:
             # 记录异常但不抛出
-            return None
+            return False, None
+        finally:
+            self.pool.release(backend, backend_ok, time.monotonic() - started)
+
+    def _probe_health(self) -> bool:
+        """请求 /health 检查 RAG 服务状态（任一副本健康即可用）"""
+        for backend in self.pool.backends:
+            try:
+                response = self.session.get(
+                    f"{backend.url}/health",
+                    timeout=5
+                )
+                if response.status_code == 200:
+                    return True
+            except:
+                continue
+        return False
 
     def is_available(self) -> bool:
-        """检查 AI 服务是否可用"""
-        try:
-            response = self.session.get(
-                f"{self.rag_service_url}/health",
-                timeout=5
-            )
-            return response.status_code == 200
-        except:
+        """检查 AI 服务是否可用（熔断打开时直接返回 False，检查结果缓存 health_ttl 秒）"""
+        if self.breaker.state == CircuitBreaker.OPEN:
             return False
+        now = time.monotonic()
+        if self._health_cache is not None and self._health_cache[0] > now:
+            return self._health_cache[1]
+        available = self._probe_health()
+        self._health_cache = (now + self.health_ttl, available)
+        return available
+
+    def stats(self) -> Dict[str, Any]:
+        """获取适配器统计"""
+        return {
+            'cache': self.cache.stats(),
+            'coalescing': self.inflight.stats(),
+            'breaker': self.breaker.stats(),
+            'backends': self.pool.stats(),
+            'batcher': self.batcher.stats() if self.batcher else None,
+            'context': self.context.stats() if self.context else None
+        }
 
 
 # 全局实例
 ai_adapter = None
 
 
-def init_ai_adapter(rag_service_url: str = "http://127.0.0.1:8000") -> bool:
+def init_ai_adapter(rag_service_url: str = "http://127.0.0.1:8000", **options) -> bool:
     """初始化 AI 适配器
 
     Args:
         rag_service_url: RAG 服务地址
+        **options: 传给 AIReplyAdapter 的其他参数（如 cache_ttl、cache_size）
 
     Returns:
         初始化成功返回 True，失败返回 False
     """
     global ai_adapter
     try:
-        ai_adapter = AIReplyAdapter(rag_service_url=rag_service_url)
+        ai_adapter = AIReplyAdapter(rag_service_url=rag_service_url, **options)
         if ai_adapter.is_available():
             return True
         else:
@@ -0,0 +1,166 @@
+"""
+AI 回复流水线 - 有界线程池 + Future
+职责：把 AI 回复生成放到独立的有界线程池中执行，检测线程提交后立即返回，不再被慢请求阻塞；
+     生成完成时通过回调送入发送路径，超过截止时间仍未完成的请求由调用方降级处理
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+class AIJob:
+    """一次 AI 回复请求"""
+
+    __slots__ = ('job_id', 'payload', 'submitted_at', 'deadline', 'future', 'settled')
+
+    def __init__(self, job_id: int, payload: Any, submitted_at: float, deadline: float):
+        self.job_id = job_id
+        self.payload = payload
+        self.submitted_at = submitted_at
+        self.deadline = deadline
+        self.future = None
+        self.settled = False  # 已被完成回调或超时处理认领
+
+
+class AIReplyPipeline:
+    """异步 AI 回复流水线
+
+    每个请求只会被认领一次：先完成则调用 on_result，先超过截止时间则由 expire() 返回给调用方降级；
+    超时后才完成的结果会被丢弃（计入 late）
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[Any], Optional[str]],
+        on_result: Callable[[Any, Optional[str], Optional[BaseException]], None],
+        workers: int = 4,
+        deadline: float = 20.0,
+        max_pending: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+        name: str = 'ai-reply'
+    ):
+        """
+        初始化 AI 回复流水线
+
+        Args:
+            generate: 生成回复的函数（在线程池中执行），参数为提交时的 payload
+            on_result: 生成完成回调 (payload, reply, error)，在线程池线程中调用
+            workers: 线程池大小
+            deadline: 每个请求的截止时间（秒）
+            max_pending: 最多同时等待的请求数，超出时 submit 返回 None
+            clock: 时钟函数（便于测试注入）
+            name: 线程名前缀
+        """
+        self._generate = generate
+        self._on_result = on_result
+        self.workers = workers
+        self.deadline = deadline
+        self.max_pending = max_pending
+        self._clock = clock
+        self._name = name
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = {}  # {job_id: AIJob}
+        self._ids = itertools.count(1)
+        self._latencies = []
+        self._stats = {'submitted': 0, 'completed': 0, 'errors': 0, 'timed_out': 0, 'late': 0, 'rejected': 0}
+
+    def start(self):
+        """启动线程池（已启动时直接返回）"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self._name)
+
+    def submit(self, payload: Any, deadline: Optional[float] = None) -> Optional[Future]:
+        """
+        提交一个回复生成请求
+
+        Args:
+            payload: 传给 generate 的请求数据
+            deadline: 本请求的截止时间（秒），默认使用流水线的 deadline
+
+        Returns:
+            请求的 Future，线程池未启动或等待数已满时返回 None
+        """
+        with self._lock:
+            if self._executor is None or len(self._pending) >= self.max_pending:
+                self._stats['rejected'] += 1
+                return None
+            now = self._clock()
+            job = AIJob(next(self._ids), payload, now, now + (self.deadline if deadline is None else deadline))
+            self._pending[job.job_id] = job
+            self._stats['submitted'] += 1
+            job.future = self._executor.submit(self._generate, payload)
+
+        job.future.add_done_callback(lambda future: self._on_done(job, future))
+        return job.future
+
+    def _on_done(self, job: AIJob, future: Future):
+        with self._lock:
+            self._pending.pop(job.job_id, None)
+            if job.settled:
+                if not future.cancelled():
+                    self._stats['late'] += 1
+                return
+            job.settled = True
+            self._latencies.append(self._clock() - job.submitted_at)
+            if len(self._latencies) > 200:
+                del self._latencies[:100]
+
+        if future.cancelled():
+            return
+        error = future.exception()
+        reply = None if error else future.result()
+        with self._lock:
+            self._stats['errors' if error else 'completed'] += 1
+        self._on_result(job.payload, reply, error)
+
+    def expire(self) -> List[Any]:
+        """认领已超过截止时间仍未完成的请求，返回它们的 payload（由调用方降级处理）"""
+        expired = []
+        with self._lock:
+            now = self._clock()
+            for job_id, job in list(self._pending.items()):
+                if job.deadline <= now and not job.settled:
+                    job.settled = True
+                    del self._pending[job_id]
+                    # 尚未开始执行的请求直接取消，不再占用线程池
+                    job.future.cancel()
+                    expired.append(job.payload)
+            self._stats['timed_out'] += len(expired)
+        return expired
+
+    def pending_count(self) -> int:
+        """等待中的请求数"""
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self, wait: bool = False) -> int:
+        """停止线程池并丢弃等待中的请求，返回丢弃数量"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            dropped = list(self._pending.values())
+            self._pending.clear()
+            for job in dropped:
+                job.settled = True
+        for job in dropped:
+            job.future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        return len(dropped)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取流水线统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+            stats['workers'] = self.workers
+            stats['deadline'] = self.deadline
+            latencies = sorted(self._latencies)
+            if latencies:
+                stats['latency_p50'] = round(latencies[len(latencies) // 2], 3)
+                stats['latency_max'] = round(latencies[-1], 3)
+            return stats
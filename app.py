@@ -13,6 +13,18 @@ import mimetypes
 from werkzeug.utils import secure_filename
 import sys
 
+from ai_pipeline import AIReplyPipeline
+from dedupe_store import DedupeStore
+from delivery_verifier import DeliveryVerifier
+from keyword_matcher import RuleMatcher, pattern_error
+from follower_store import FollowerReconciler
+from outbox import Outbox, RetryLater
+from poll_scheduler import PollScheduler
+from push_ingest import ANY_TALKER, PushIngestor, WebSocketTransport, WEBSOCKET_AVAILABLE
+from rate_limiter import SendScheduler, TokenBucket
+from state_store import StateStore
+from upload_cache import UploadCache
+
 # 导入 AI 适配器
 try:
     from ai_adapter import AIReplyAdapter, init_ai_adapter, ai_adapter as global_ai_adapter
@@ -38,7 +50,8 @@ try:
     from agents.bilibili_message_agent import BilibiliMessageAIAgent
     from agents.llm_client import get_llm_client
     AI_AGENT_AVAILABLE = True
-except ImportError as e:
+except (ImportError, OSError) as e:
+    # agents 目录不存在时 exec_module 抛出 FileNotFoundError
     AI_AGENT_AVAILABLE = False
 
 app = Flask(__name__)
@@ -62,9 +75,43 @@ config = {
     'unfollow_reply_type': 'text',  # 取消关注回复类型：'text' 或 'image'
     'unfollow_reply_image': '',  # 取消关注回复图片路径
     'only_reply_new_messages': False,  # 是否仅回复新消息（程序启动后的消息）
-    'follow_check_interval': 30,  # 检查关注者的间隔（秒）
-    'message_check_interval': 0.05,  # 消息监测间隔（秒）
+    'burst_mode_enabled': False,  # 是否处理会话中所有未处理的消息（而不只是最后一条），连发的多条消息合并回复
+    'burst_fetch_size': 20,  # 连发模式下单次拉取的最多消息数
+    'burst_max_replies': 1,  # 连发模式下同一批消息最多发送的回复条数（多个文字回复合并为一条）
+    'follow_check_interval': 30,  # 检查关注者的间隔（秒），由独立的关注者检测线程执行，不占用消息轮询
+    'follow_requests_per_minute': 6,  # 关注者检测每分钟最多请求数（与消息轮询分开计算）
+    'follow_snapshot_size': 20,  # 每次检查拉取的最近关注者数量（一次请求）
+    'follow_verify_size': 50,  # 取消关注批量核对时拉取的关注者数量（每次检查最多一次请求）
+    'follower_reconcile_enabled': False,  # 是否在后台逐页拉取完整关注者列表，发现快照窗口之外的取消关注
+    'follower_reconcile_rpm': 6,  # 全量对账每分钟最多请求数
+    'follower_reconcile_max_pages': 0,  # 全量对账每轮最多拉取的页数，0 表示不限制；截断的一轮只发现新增，不确认取消关注
+    'message_check_interval': 0.05,  # 消息监测间隔（秒），有新消息时的最短轮询间隔
+    'poll_interval_max': 3.0,  # 空闲时轮询间隔退避的上限（秒）
+    'poll_backoff_factor': 1.5,  # 空闲时每轮轮询间隔的放大倍数
+    'poll_idle_grace': 10.0,  # 最近一次新消息后保持最短轮询间隔的时间（秒）
+    'push_ingest_enabled': False,  # 是否通过私信通知长连接接收新消息（断线时自动回退到轮询）
+    'push_ingest_url': '',  # 私信通知中继地址（ws:// 或 wss://，推送 JSON 通知帧；B 站二进制广播通道需经中继转换）
+    'push_full_poll_interval': 30.0,  # 推送模式下完整轮询会话列表的兜底间隔（秒）
+    'push_reconnect_max': 30.0,  # 推送连接断开后重连等待时间上限（秒）
     'send_delay_interval': 1.0,  # 发送消息等待间隔（秒）
+    'send_burst': 1,  # 全局发送突发容量（连续发送的最大条数）
+    'send_receiver_interval': 3.0,  # 同一用户的最小平均发送间隔（秒）
+    'send_cooldown_base': 10.0,  # 触发 -412 后的初始冷却时间（秒），连续触发时翻倍
+    'send_cooldown_max': 300.0,  # 冷却时间上限（秒）
+    'send_workers': 2,  # 发送线程数量
+    'send_queue_size': 500,  # 发送队列容量
+    'send_drain_timeout': 10.0,  # 停止监控时等待发送队列排空的最长时间（秒）
+    'verify_deadline': 10.0,  # 发送后多少秒仍未在会话列表中确认送达，则定向拉取核对
+    'verify_sample_rate': 1.0,  # 送达验证抽样比例（0~1）
+    'dedupe_ttl': 900,  # 已处理消息去重记录保留时间（秒）
+    'dedupe_capacity': 2000,  # 已处理消息去重记录最大条数
+    'preserve_state_on_restart': True,  # 重启时保留会话水位、去重记录和关注者状态（持久化到 state.db）
+    'state_flush_interval': 1.0,  # 状态批量写入间隔（秒）
+    'identity_cache_ttl': 1800,  # 账号身份（UID）缓存有效期（秒）
+    'upload_cache_ttl': 604800,  # 已上传图片的缓存有效期（秒），同一图片在有效期内重复发送时不再上传
+    'upload_revalidate_after': 86400,  # 已上传图片超过该时间（秒）未复核时，使用前先确认图片地址仍可访问
+    'upload_warmup_enabled': True,  # 规则预编译时是否在后台预上传所有回复图片（首个触发的用户无需等待上传）
+    'upload_warmup_workers': 3,  # 预上传图片的最大并发数
     'auto_restart_interval': 300,  # 自动重启间隔（秒）
     # ===== AI Agent 配置 =====
     'ai_agent_enabled': False,  # 是否启用 AI Agent 回复
@@ -73,6 +120,16 @@ config = {
     'ai_agent_api_key': '',  # LLM API Key（从环境变量或配置读取，不硬编码）
     'ai_agent_model': 'glm-4-flash',  # 使用的模型名称
     'ai_use_fallback': True,  # 当AI失败时是否使用规则模式回退
+    'ai_workers': 4,  # AI 回复生成线程数（生成期间不阻塞消息检测）
+    'ai_reply_deadline': 20.0,  # 单条 AI 回复的截止时间（秒），超时使用默认回复
+    'ai_max_pending': 100,  # 最多同时等待生成的 AI 回复数
+    'ai_cache_ttl': 600,  # AI 回复缓存有效期（秒），相同问题的不同写法共用缓存
+    'ai_cache_size': 1000,  # AI 回复缓存容量，0 表示禁用
+    'ai_hedge_enabled': False,  # 多个 RAG 副本时，慢请求（超过该副本 p95 延迟）是否对冲到另一个副本
+    'ai_batch_size': 8,  # 副本支持 /chat/batch 时每批最多发送的消息数
+    'ai_batch_linger': 0,  # 并发 AI 请求攒批的等待时间（秒），0 表示不攒批（批量请求默认关闭，设为正数后开启）
+    'ai_context_turns': 6,  # 随 AI 请求发送的最近对话轮次数，0 表示不发送
+    'ai_context_talkers': 5000,  # 最多保留对话上下文的用户数（超出时淘汰最久未活跃的用户）
     # 注意：敏感信息（sessdata、bili_jct）应从环境变量读取，不要在此硬编码
 }
 
@@ -81,11 +138,34 @@ rules = []
 monitoring = False
 monitor_thread = None
 message_logs = []  # 私信日志
-message_cache = {}
+message_cache = DedupeStore()  # 已处理消息 ID 去重（TTL + 容量上限）
 last_message_times = defaultdict(int)
-rule_matcher_cache = {}
+last_message_seqnos = {}  # 会话已处理到的消息序号 {talker_id: msg_seqno}（连发模式按序号拉取后续消息）
+# 消息获取统计：直接使用会话列表 last_msg 的次数 / 回退调用 fetch_session_msgs 的次数 / 因会话指纹未变化而省去的处理次数
+message_fetch_stats = {'session_list_hits': 0, 'fetch_fallbacks': 0, 'fetches_avoided': 0}
+session_fingerprints = {}  # 会话指纹 {talker_id: (timestamp, msg_seqno, unread_count)}
+rule_matcher = RuleMatcher()  # 启用规则的匹配器（precompile_rules 构建，规则数据与匹配结构一起整体替换）
 ai_agent = None  # AI Agent 实例（全局单例）
-last_send_time = 0
+ai_pipeline = None  # AI 回复流水线（线程池异步生成，完成后投递到发送队列）
+# 发送调度器（全局 + 接收者令牌桶），消息回复、关注欢迎和经 /api/send-reply 投递的手动回复共用
+send_scheduler = SendScheduler()
+# 轮询调度器：有新消息时快速轮询，空闲时退避，会话列表触发 -412 时放宽间隔
+poll_scheduler = PollScheduler()
+push_ingestor = None  # 推送接入（启用后由通知唤醒监控循环）
+SEND_THROTTLED = 'throttled'  # 本地限速时 send_msg 返回的 code
+# 发送队列（检测线程投递，发送线程异步发送）
+outbox = None
+monitor_teardown_lock = threading.Lock()  # 串行化 /api/stop 与监控线程退出时的后台线程停止
+_sender_local = threading.local()
+delivery_stats = {'sent': 0, 'failed': 0, 'unverified': 0, 'last_sent_at': 0}
+delivery_stats_lock = threading.Lock()
+# 送达验证（通过会话列表快照批量确认 msg_key）
+delivery_verifier = DeliveryVerifier()
+# 运行状态持久化（会话水位、去重记录、关注者集合），首次使用时打开
+state_store = None
+upload_cache = None  # 图片上传结果缓存（按内容哈希，持久化到 uploads.json）
+upload_warmup_thread = None  # 回复图片预上传线程
+upload_warmup_signature = None  # 上次预上传的图片集合签名（路径与文件修改时间），未变化时不重复预热
 # 关注者监控相关变量
 followers_cache = set()  # 缓存已知关注者
 welcome_sent_cache = set()  # 缓存已发送欢迎消息的关注者
@@ -96,6 +176,17 @@ last_follow_check = 0  # 上次检查关注者的时间
 unfollowers_cache = set()  # 缓存已处理的取消关注者
 last_unfollow_check = 0  # 上次检查取消关注的时间
 follow_history = {}  # 关注历史记录 {uid: last_follow_time}
+# 保护以上关注者集合：检测线程、全量对账线程、发送线程与监控线程（保存/重置状态）并发访问
+follower_state_lock = threading.Lock()
+# 关注者检查统计：每次检查使用的请求数（关注者列表 + 身份查询）、批量核对次数、确认的取消关注数
+follower_reconciler = None  # 关注者全量对账（后台线程逐页拉取）
+follower_check_stats = {'checks': 0, 'requests': 0, 'last_requests': 0, 'max_requests': 0, 'verifications': 0, 'confirmed_unfollows': 0, 'aged_out': 0, 'budget_waits': 0, 'enqueued': 0}
+follower_sync_thread = None  # 关注者检测线程（独立于消息轮询）
+follower_sync_stop = threading.Event()
+follower_sync_budget = None  # 关注者检测的请求预算（令牌桶）
+
+# 发送任务优先级（数值越小越先发送）：关注欢迎/告别不与私信回复抢占发送额度
+SEND_PRIORITIES = {'reply': 0, 'verify': 1, 'welcome': 2, 'goodbye': 2}
 
 # 程序启动时间戳（用于仅回复新消息功能）
 program_start_time = int(time.time())
@@ -103,6 +194,9 @@ program_start_time = int(time.time())
 # 配置文件路径 - 私信系统使用独立配置
 CONFIG_FILE = None  # 私信配置文件路径
 RULES_FILE = None   # 私信规则文件路径
+STATE_FILE = None   # 运行状态数据库路径
+FOLLOWER_FILE = None  # 完整关注者集合与对账进度
+UPLOAD_CACHE_FILE = None  # 图片上传结果缓存
 
 
 def get_config_file_path(filename):
@@ -112,17 +206,30 @@ def get_config_file_path(filename):
 
 def init_config_paths():
     """初始化私信系统配置文件路径"""
-    global CONFIG_FILE, RULES_FILE
+    global CONFIG_FILE, RULES_FILE, STATE_FILE, FOLLOWER_FILE, UPLOAD_CACHE_FILE
     if CONFIG_FILE is None:
         CONFIG_FILE = get_config_file_path('config.json')  # 私信配置
     if RULES_FILE is None:
         RULES_FILE = get_config_file_path('keywords.json')  # 私信规则
+    if STATE_FILE is None:
+        STATE_FILE = get_config_file_path('state.db')  # 运行状态
+    if FOLLOWER_FILE is None:
+        FOLLOWER_FILE = get_config_file_path('followers.bin')  # 完整关注者集合
+    if UPLOAD_CACHE_FILE is None:
+        UPLOAD_CACHE_FILE = get_config_file_path('uploads.json')  # 图片上传结果缓存
 
 
 class BilibiliAPI:
+    # 账号身份缓存，按凭证共享，避免每次发送/验证/拉取关注者都请求 nav 接口
+    # {凭证指纹: (uid, 过期时间)}
+    _identity_cache = {}
+    _identity_cache_lock = threading.Lock()
+    _identity_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
     def __init__(self, sessdata, bili_jct):
         self.sessdata = sessdata
         self.bili_jct = bili_jct
+        self.credential_key = hashlib.sha256(f'{sessdata}:{bili_jct}'.encode('utf-8')).hexdigest()
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -144,14 +251,17 @@ class BilibiliAPI:
         
         try:
             response = self.session.get(url, params=params, timeout=1.5)
+            if response.status_code == 412:
+                # 风控拦截时返回错误码，由轮询调度器放宽间隔
+                return {'code': -412, 'message': '请求过于频繁'}
             response.raise_for_status()
-            return response.json()
+            return self._check_auth_result(response.json())
         except Exception as e:
             logger.error(f"获取会话列表失败: {e}")
             return None
     
-    def get_session_msgs(self, talker_id, session_type=1, size=3):
-        """获取指定会话的消息（极速版）"""
+    def get_session_msgs(self, talker_id, session_type=1, size=3, begin_seqno=None):
+        """获取指定会话的消息（极速版），指定 begin_seqno 时只返回该序号之后的消息"""
         url = 'https://api.vc.bilibili.com/svr_sync/v1/svr_sync/fetch_session_msgs'
         params = {
             'sender_device_id': 1,
@@ -161,11 +271,13 @@ class BilibiliAPI:
             'build': 0,
             'mobi_app': 'web'
         }
+        if begin_seqno:
+            params['begin_seqno'] = begin_seqno
         
         try:
             response = self.session.get(url, params=params, timeout=0.8)
             response.raise_for_status()
-            return response.json()
+            return self._check_auth_result(response.json())
         except:
             return None
     
@@ -180,18 +292,26 @@ class BilibiliAPI:
         except:
             return None
     
+    def get_messages_after(self, talker_id, begin_seqno=None, size=20):
+        """获取序号在 begin_seqno 之后的消息（一次请求），按序号从早到晚排列，失败返回 None"""
+        try:
+            msgs_data = self.get_session_msgs(talker_id, size=size, begin_seqno=begin_seqno)
+            if msgs_data and msgs_data.get('code') == 0:
+                messages = (msgs_data.get('data') or {}).get('messages') or []
+                return sorted(messages, key=lambda msg: (msg.get('msg_seqno', 0), msg.get('timestamp', 0)))
+            return None
+        except:
+            return None
+    
     def send_msg(self, receiver_id, msg_type=1, content=""):
-        """发送私信（可配置间隔版）"""
-        global last_send_time
-        
-        current_time = time.time()
-        
-        # 使用配置中的发送间隔
-        send_interval = config.get('send_delay_interval', 1.0)
-        if current_time - last_send_time < send_interval:
-            wait_time = send_interval - (current_time - last_send_time)
-            add_log(f"发送间隔控制，等待 {wait_time:.1f} 秒", 'info')
-            time.sleep(wait_time)
+        """发送私信（令牌桶限速版）
+
+        未取得发送许可时不阻塞，直接返回 code 为 SEND_THROTTLED 的结果，
+        其中 retry_after 为建议的等待秒数，由调用方决定何时重试
+        """
+        reservation = send_scheduler.reserve(receiver_id)
+        if not reservation:
+            return throttled_result(reservation.eta, reservation.reason)
         
         url = 'https://api.vc.bilibili.com/web_im/v1/web_im/send_msg'
         data = {
@@ -212,14 +332,14 @@ class BilibiliAPI:
         try:
             response = self.session.post(url, data=data, timeout=3.0)
             response.raise_for_status()
-            result = response.json()
-            
-            # 更新最后发送时间
-            last_send_time = time.time()
+            result = self._check_auth_result(response.json())
             
             # 简单的结果处理
-            if result.get('code') == -412:
-                add_log(f"触发频率限制，但保持发送间隔继续运行", 'warning')
+            if result.get('code') == 0:
+                send_scheduler.on_success()
+            elif result.get('code') == -412:
+                cooldown = send_scheduler.on_rate_limited()
+                add_log(f"触发频率限制，暂停发送 {cooldown:.0f} 秒", 'warning')
             elif result.get('code') == -101:
                 add_log("登录状态失效，请重新配置登录信息", 'error')
             elif result.get('code') != 0:
@@ -229,7 +349,6 @@ class BilibiliAPI:
             
         except Exception as e:
             logger.error(f"发送消息失败: {e}")
-            last_send_time = time.time()  # 即使失败也更新时间，避免卡住
             return None
     
     def upload_image(self, image_path):
@@ -411,8 +530,14 @@ class BilibiliAPI:
     def send_image_msg(self, receiver_id, image_path):
         """发送图片消息"""
         try:
-            # 先上传图片
-            image_info = self.upload_image(image_path)
+            # 当前无法发送时不上传图片，避免浪费上传请求
+            eta = send_scheduler.peek(receiver_id)
+            if eta > 0:
+                return throttled_result(eta)
+            
+            # 先上传图片（同一图片已上传过时直接使用缓存的地址）
+            cache = get_upload_cache()
+            image_info = cache.get_or_upload(image_path, self.upload_image)
             if not image_info:
                 return None
             
@@ -427,56 +552,62 @@ class BilibiliAPI:
             }
             
             # 发送图片消息（msg_type=2表示图片消息）
-            return self.send_msg(receiver_id, msg_type=2, content=json.dumps(image_content))
+            result = self.send_msg(receiver_id, msg_type=2, content=json.dumps(image_content))
+            if result and result.get('code') not in (0, SEND_THROTTLED, -412, -101):
+                # 服务端拒绝时不再信任缓存的地址，下次重新上传
+                cache.invalidate(image_path)
+            return result
             
         except Exception as e:
             add_log(f"发送图片消息失败: {e}", 'error')
             return None
     
     def get_my_uid(self):
-        """获取当前用户UID"""
+        """获取当前用户UID（按凭证缓存，TTL 由 identity_cache_ttl 配置）"""
+        now = time.time()
+        cls = BilibiliAPI
+        with cls._identity_cache_lock:
+            cached = cls._identity_cache.get(self.credential_key)
+            if cached and cached[1] > now:
+                cls._identity_cache_stats['hits'] += 1
+                return cached[0]
+            cls._identity_cache_stats['misses'] += 1
+
         url = 'https://api.bilibili.com/x/web-interface/nav'
         try:
             response = self.session.get(url, timeout=2)
             response.raise_for_status()
-            data = response.json()
+            data = self._check_auth_result(response.json())
             if data['code'] == 0:
-                return data['data']['mid']
+                uid = data['data']['mid']
+                ttl = config.get('identity_cache_ttl', 1800)
+                with cls._identity_cache_lock:
+                    cls._identity_cache[self.credential_key] = (uid, time.time() + ttl)
+                return uid
         except Exception as e:
             logger.error(f"获取用户信息失败: {e}")
         return None
-    
-    def verify_message_sent(self, talker_id, expected_content):
-        """验证消息是否真正发送成功"""
-        try:
-            # 获取最新消息验证是否发送成功
-            msgs_data = self.get_session_msgs(talker_id, size=3)
-            if not msgs_data or msgs_data.get('code') != 0:
-                return False
-            
-            messages = msgs_data.get('data', {}).get('messages', [])
-            if not messages:
-                return False
-            
-            # 检查最新的几条消息中是否有我们刚发送的内容
-            my_uid = self.get_my_uid()
-            for msg in messages[-3:]:  # 检查最新3条消息
-                if msg.get('sender_uid') == my_uid:
-                    content_str = msg.get('content', '{}')
-                    try:
-                        content_obj = json.loads(content_str)
-                        message_text = content_obj.get('content', '').strip()
-                        if expected_content in message_text or message_text in expected_content:
-                            return True
-                    except:
-                        if expected_content in content_str:
-                            return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"验证消息发送失败: {e}")
-            return False
+
+    def invalidate_identity(self):
+        """使当前凭证的身份缓存失效"""
+        cls = BilibiliAPI
+        with cls._identity_cache_lock:
+            if cls._identity_cache.pop(self.credential_key, None) is not None:
+                cls._identity_cache_stats['invalidations'] += 1
+
+    def _check_auth_result(self, result):
+        """检查接口返回的登录状态错误码（-101 未登录 / -111 csrf 校验失败），失效时清除身份缓存"""
+        if isinstance(result, dict) and result.get('code') in (-101, -111):
+            self.invalidate_identity()
+        return result
+
+    @classmethod
+    def get_identity_cache_stats(cls):
+        """获取身份缓存命中统计"""
+        with cls._identity_cache_lock:
+            stats = dict(cls._identity_cache_stats)
+            stats['size'] = len(cls._identity_cache)
+        return stats
     
     def get_followers(self, page=1, page_size=50):
         """获取关注者列表"""
@@ -496,7 +627,7 @@ class BilibiliAPI:
             
             response = self.session.get(url, params=params, timeout=5.0)
             response.raise_for_status()
-            result = response.json()
+            result = self._check_auth_result(response.json())
             
             if result.get('code') == 0:
                 return result.get('data', {})
@@ -533,6 +664,65 @@ class BilibiliAPI:
             add_log(f"获取最近关注者异常: {e}", 'error')
             return []
 
+def check_image_url(url):
+    """复核已上传图片的地址：可访问返回 True，已失效返回 False，无法判断返回 None"""
+    try:
+        response = requests.head(url, timeout=3.0, allow_redirects=True)
+    except Exception:
+        return None
+    if response.status_code == 200:
+        return True
+    if response.status_code in (403, 404, 410):
+        return False
+    return None
+
+def get_upload_cache():
+    """获取图片上传结果缓存（首次调用时从磁盘恢复）"""
+    global upload_cache
+    if upload_cache is None:
+        init_config_paths()
+        cache = UploadCache(UPLOAD_CACHE_FILE, validate=check_image_url)
+        try:
+            restored = cache.load()
+            if restored:
+                add_log(f"已恢复 {restored} 条图片上传缓存", 'info')
+        except Exception as e:
+            add_log(f"读取图片上传缓存失败，重新上传: {e}", 'warning')
+        upload_cache = cache
+    upload_cache.configure(
+        ttl=float(config.get('upload_cache_ttl', 604800)),
+        revalidate_after=float(config.get('upload_revalidate_after', 86400))
+    )
+    return upload_cache
+
+def throttled_result(eta, reason=''):
+    """构造本地限速时的发送结果"""
+    return {
+        'code': SEND_THROTTLED,
+        'message': f"本地发送限速，{eta:.1f} 秒后可发送",
+        'retry_after': eta,
+        'reason': reason
+    }
+
+def configure_send_scheduler():
+    """根据配置更新发送调度器参数"""
+    send_scheduler.cooldown_base = float(config.get('send_cooldown_base', 10.0))
+    send_scheduler.cooldown_max = float(config.get('send_cooldown_max', 300.0))
+    send_scheduler.configure(
+        global_interval=float(config.get('send_delay_interval', 1.0)),
+        global_burst=int(config.get('send_burst', 1)),
+        receiver_interval=float(config.get('send_receiver_interval', 3.0))
+    )
+
+def configure_poll_scheduler():
+    """根据配置更新轮询调度器参数"""
+    poll_scheduler.configure(
+        min_interval=float(config.get('message_check_interval', 0.05)),
+        max_interval=float(config.get('poll_interval_max', 3.0)),
+        backoff=float(config.get('poll_backoff_factor', 1.5)),
+        idle_grace=float(config.get('poll_idle_grace', 10.0))
+    )
+
 def init_ai_agent():
     """初始化 AI 适配器（优先使用 RAG 服务）"""
     global ai_agent
@@ -545,7 +735,16 @@ def init_ai_agent():
         # 优先使用 AI 适配器（连接到 RAG 服务）
         if AI_ADAPTER_AVAILABLE:
             rag_service_url = config.get('rag_service_url', 'http://127.0.0.1:8000')
-            if init_ai_adapter(rag_service_url=rag_service_url):
+            if init_ai_adapter(
+                rag_service_url=rag_service_url,
+                cache_ttl=float(config.get('ai_cache_ttl', 600)),
+                cache_size=int(config.get('ai_cache_size', 1000)),
+                hedge=bool(config.get('ai_hedge_enabled', False)),
+                batch_size=int(config.get('ai_batch_size', 8)),
+                batch_linger=float(config.get('ai_batch_linger', 0)),
+                context_turns=int(config.get('ai_context_turns', 6)),
+                context_talkers=int(config.get('ai_context_talkers', 5000))
+            ):
                 add_log(f"✅ AI 适配器已初始化 (RAG服务: {rag_service_url})", 'success')
                 # 将全局适配器实例赋值给 ai_agent，保持兼容性
                 from ai_adapter import ai_adapter as _adapter
@@ -728,6 +927,13 @@ def load_rules_from_file(file_path):
             if 'keyword' not in rule or 'name' not in rule:
                 continue
             
+            # 正则规则在加载时校验，避免每条消息匹配时才出错
+            if rule.get('use_regex', False):
+                error = pattern_error(rule.get('keyword', '').strip())
+                if error:
+                    add_log(f"规则'{rule.get('name')}'的正则表达式无效，已跳过: {error}", 'warning')
+                    continue
+            
             # 标准化规则格式
             standardized_rule = {
                 'id': rule.get('id', i + 1),
@@ -750,47 +956,127 @@ def load_rules_from_file(file_path):
         return None, f"读取文件失败: {str(e)}"
 
 def precompile_rules():
-    """预编译规则，提高匹配速度"""
-    global rule_matcher_cache
-    rule_matcher_cache = {}
+    """预编译规则，提高匹配速度（字面量关键词编译为多模式自动机，正则规则合并为一个模式）"""
+    global rule_matcher
+    new_matcher = RuleMatcher()
     
     for i, rule in enumerate(rules):
         if rule.get('enabled', True):
-            # keywords.json 使用 'keyword' 字段，用逗号分隔多个关键词
+            rule_data = {
+                'reply': rule.get('reply', ''),
+                'reply_type': rule.get('reply_type', 'text'),  # 'text' 或 'image'
+                'reply_image': rule.get('reply_image', ''),  # 图片路径
+                'title': rule.get('name', f'规则{i+1}')  # keywords.json 使用 'name' 字段
+            }
             keyword_str = rule.get('keyword', '')
+
+            if rule.get('use_regex', False):
+                # 正则规则整个 keyword 字段就是一个模式（模式里可能本身含逗号）
+                error = new_matcher.add_regex(i, keyword_str.strip(), rule_data)
+                if error:
+                    add_log(f"规则'{rule_data['title']}'的正则表达式无效，已跳过: {error}", 'warning')
+                continue
+
+            # keywords.json 使用 'keyword' 字段，用逗号分隔多个关键词
             keywords = [kw.lower().strip() for kw in keyword_str.split('，') if kw.strip()]
             # 也支持英文逗号分隔
             if not keywords:
                 keywords = [kw.lower().strip() for kw in keyword_str.split(',') if kw.strip()]
             
-            rule_matcher_cache[i] = {
-                'keywords': keywords,
-                'reply': rule.get('reply', ''),
-                'reply_type': rule.get('reply_type', 'text'),  # 'text' 或 'image'
-                'reply_image': rule.get('reply_image', ''),  # 图片路径
-                'title': rule.get('name', f'规则{i+1}')  # keywords.json 使用 'name' 字段
-            }
+            rule_data['keywords'] = sorted(keywords, key=len, reverse=True)
+            new_matcher.add_literal(i, rule_data['keywords'], rule_data)
+    
+    # 先构建好匹配器再整体替换，匹配线程不会看到半成品
+    rule_matcher = new_matcher.build()
+    matcher_stats = rule_matcher.stats()
+    logger.info(
+        f"规则预编译完成: 关键词规则 {matcher_stats['literal']['rules']} 条 ({matcher_stats['literal']['compile_ms']}ms), "
+        f"正则规则 {matcher_stats['regex']['rules']} 条 ({matcher_stats['regex']['compile_ms']}ms), "
+        f"无效正则 {matcher_stats['invalid_patterns']} 条"
+    )
+    start_upload_warmup()
+
+def collect_reply_images():
+    """收集规则与默认/关注/取消关注回复中引用的图片路径"""
+    images = [
+        rule.get('reply_image', '') for rule in rules
+        if rule.get('enabled', True) and rule.get('reply_type', 'text') == 'image'
+    ]
+    for prefix in ('default_reply', 'follow_reply', 'unfollow_reply'):
+        if config.get(f'{prefix}_type', 'text') == 'image':
+            images.append(config.get(f'{prefix}_image', ''))
+    return [path for path in images if path]
+
+def reply_images_signature(images):
+    """图片集合签名：路径、文件大小与修改时间（不读取文件内容），任一图片增删或修改时变化"""
+    digest = hashlib.md5()
+    for path in sorted(set(images)):
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+        except OSError:
+            digest.update(f"{path}|missing\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def start_upload_warmup():
+    """
+    在后台并发预上传所有回复图片，填充上传缓存
+
+    规则每次预编译都会调用，只有图片集合或图片文件变化时才重新预热，上次失败的图片也等到变化后再重试。
+    未启用、未配置登录信息、图片集合未变化或已在预热时返回 None
+    """
+    global upload_warmup_thread, upload_warmup_signature
+    if not config.get('upload_warmup_enabled', True) or not config.get('sessdata') or not config.get('bili_jct'):
+        return None
+    if upload_warmup_thread is not None and upload_warmup_thread.is_alive():
+        return None
+    images = collect_reply_images()
+    if not images:
+        return None
+    signature = reply_images_signature(images)
+    if signature == upload_warmup_signature:
+        return None
+    upload_warmup_signature = signature
+
+    def run():
+        # 每个上传线程使用独立的 API 会话（备用上传接口会临时修改会话请求头）
+        local = threading.local()
+
+        def upload(image_path):
+            if getattr(local, 'api', None) is None:
+                local.api = BilibiliAPI(config['sessdata'], config['bili_jct'])
+            return local.api.upload_image(image_path)
+
+        try:
+            result = get_upload_cache().warm(images, upload, workers=int(config.get('upload_warmup_workers', 3)))
+        except Exception as e:
+            add_log(f"回复图片预上传异常: {e}", 'warning')
+            return
+        if result is None or not (result['uploaded'] or result['failed']):
+            return
+        level = 'warning' if result['failed'] else 'info'
+        add_log(f"回复图片预上传完成: 共 {result['total']} 张, 新上传 {result['uploaded']} 张, "
+                f"已缓存 {result['cached']} 张, 失败 {result['failed']} 张, 耗时 {result['seconds']}s", level)
+
+    upload_warmup_thread = threading.Thread(target=run, name='upload-warmup', daemon=True)
+    upload_warmup_thread.start()
+    return upload_warmup_thread
 
 def check_keywords_fast(message):
     """极速关键词匹配（优化版）"""
-    if not message or not rule_matcher_cache:
+    matcher = rule_matcher
+    if not message or not len(matcher):
         return None
     
     message_lower = message.lower().strip()
     if not message_lower:
         return None
     
-    # 使用更高效的匹配算法
-    for rule_id, rule_data in rule_matcher_cache.items():
-        keywords = rule_data['keywords']
-        if not keywords:
-            continue
-            
-        # 优先匹配较长的关键词，提高准确性
-        for keyword in sorted(keywords, key=len, reverse=True):
-            if keyword and keyword in message_lower:
-                return rule_data
-    return None
+    # 一次扫描找出命中，按规则顺序第一条命中的规则胜出
+    hit = matcher.match(message_lower)
+    if hit is None:
+        return None
+    return matcher.get(hit[0])
 
 def get_random_image_from_folder(folder_path):
     """从指定文件夹随机获取一张图片"""
@@ -835,47 +1121,138 @@ def generate_message_id(talker_id, timestamp, content):
     content_hash = hashlib.md5(content.encode('utf-8')).hexdigest()[:8]
     return f"{talker_id}_{timestamp}_{content_hash}"
 
+def configure_message_cache():
+    """根据配置更新消息去重存储参数"""
+    message_cache.configure(
+        ttl=float(config.get('dedupe_ttl', 900)),
+        capacity=int(config.get('dedupe_capacity', 2000))
+    )
+
 def cleanup_cache():
-    """清理过期缓存（修复多轮对话版）"""
-    global message_cache, last_message_times
-    current_time = int(time.time())
-    
-    # 更激进的缓存清理策略 - 只保留15分钟内的消息缓存，提高内存效率
-    old_cache = {}
-    cleaned_count = 0
-    for msg_id in list(message_cache.keys()):
-        try:
-            # 从消息ID中提取时间戳
-            parts = msg_id.split('_')
-            if len(parts) >= 2:
-                msg_time = int(parts[1])
-                if current_time - msg_time < 900:  # 只保留15分钟内的，减少内存占用
-                    old_cache[msg_id] = message_cache[msg_id]
-                else:
-                    cleaned_count += 1
-        except:
-            # 无法解析的ID直接删除
-            cleaned_count += 1
-    
-    message_cache = old_cache
-    
-    # 不清理时间记录，保持会话连续性
-    # 但限制缓存大小，防止内存泄漏
-    if len(message_cache) > 300:
-        # 进一步减少消息缓存大小，只保留最新的200条，大幅提高内存效率
-        sorted_items = sorted(message_cache.items(), key=lambda x: x[0])
-        message_cache = dict(sorted_items[-200:])
-        add_log("缓存过大，已清理到最新200条", 'warning')
-    
-    # 强制垃圾回收
-    import gc
-    gc.collect()
-    
+    """清理过期缓存（去重存储按插入顺序过期，只需弹出队头，无需重建或强制 GC）"""
+    cleaned_count = message_cache.expire()
     add_log(f"缓存清理完成: 清理消息 {cleaned_count} 条，当前缓存 {len(message_cache)} 条，活跃会话 {len(last_message_times)} 个", 'info')
 
+def open_state_store():
+    """打开运行状态存储（首次调用时创建），失败时返回 None，仅保留内存状态"""
+    global state_store
+    if state_store is None:
+        init_config_paths()
+        try:
+            store = StateStore(STATE_FILE)
+            store.open()
+            state_store = store
+        except Exception as e:
+            add_log(f"打开状态存储失败，本次运行状态不会持久化: {e}", 'warning')
+            return None
+    state_store.flush_interval = float(config.get('state_flush_interval', 1.0))
+    state_store.dedupe_ttl = float(config.get('dedupe_ttl', 900))
+    return state_store
+
+def reset_state(preserve=None):
+    """
+    重置运行状态
+
+    Args:
+        preserve: 是否从状态存储恢复（None 时读取 preserve_state_on_restart 配置）；
+                  为 False 时同时清空持久化状态
+    """
+    global last_follow_check
+    if preserve is None:
+        preserve = config.get('preserve_state_on_restart', True)
+
+    message_cache.clear()
+    last_message_times.clear()
+    last_message_seqnos.clear()
+    session_fingerprints.clear()
+    with follower_state_lock:
+        followers_cache.clear()
+        unfollowers_cache.clear()
+        follow_history.clear()
+    last_follow_check = 0
+
+    store = open_state_store()
+    if store is None:
+        return
+    try:
+        if not preserve:
+            store.clear()
+            return
+        store.flush()
+        state = store.load()
+        last_message_times.update(state['watermarks'])
+        for key, age in state['dedupe']:
+            message_cache.restore(key, age)
+        members = state['members']
+        with follower_state_lock:
+            followers_cache.update(members.get('followers', {}))
+            welcome_sent_cache.update(members.get('welcome_sent', {}))
+            unfollowers_cache.update(members.get('unfollowers', {}))
+            follow_history.update({mid: int(ts) for mid, ts in members.get('follow_history', {}).items()})
+        last_message_seqnos.update({talker_id: int(seqno) for talker_id, seqno in members.get('seqnos', {}).items()})
+        add_log(f"已恢复运行状态: {len(last_message_times)} 个会话水位, {len(message_cache)} 条去重记录, {len(followers_cache)} 个关注者 (耗时 {store.stats()['load_ms']}ms)", 'info')
+    except Exception as e:
+        add_log(f"恢复运行状态失败，从空状态开始: {e}", 'warning')
+
+def record_watermark(talker_id, timestamp, seqno=None):
+    """更新会话已处理到的消息时间与序号（时间同时写入状态存储，序号随快照定期写入）"""
+    last_message_times[talker_id] = timestamp
+    if seqno and seqno > last_message_seqnos.get(talker_id, 0):
+        last_message_seqnos[talker_id] = seqno
+    if state_store is not None:
+        state_store.set_watermark(talker_id, timestamp)
+
+def mark_message_seen(msg_id):
+    """记录已处理的消息 ID，返回是否首次出现"""
+    if not message_cache.add(msg_id):
+        return False
+    if state_store is not None:
+        state_store.add_dedupe(msg_id)
+    return True
+
+def flush_state(force=False):
+    """按间隔把关注者集合快照与待写修改批量写入状态存储"""
+    if state_store is None:
+        return
+    if not force and not state_store.flush_due():
+        return
+    try:
+        # 关注者集合由检测线程、全量对账线程与发送线程并发修改，先在锁内复制
+        with follower_state_lock:
+            followers, welcome_sent = set(followers_cache), set(welcome_sent_cache)
+            unfollowers, history = set(unfollowers_cache), dict(follow_history)
+        state_store.replace_members('followers', followers)
+        state_store.replace_members('welcome_sent', welcome_sent)
+        state_store.replace_members('unfollowers', unfollowers)
+        state_store.replace_members('follow_history', history)
+        state_store.replace_members('seqnos', last_message_seqnos)
+        state_store.flush()
+    except Exception as e:
+        add_log(f"状态写入失败，稍后重试: {e}", 'warning')
+
+def fetch_follower_snapshot(api, limit, counter):
+    """拉取最近关注者快照 {mid: 关注时间}（counter 记录请求数），失败返回 None"""
+    identity_misses = BilibiliAPI.get_identity_cache_stats()['misses']
+    followers = api.get_recent_followers(limit=limit)
+    counter['requests'] += 1 + BilibiliAPI.get_identity_cache_stats()['misses'] - identity_misses
+    if not followers:
+        return None, []
+    return {f['mid']: f.get('mtime', 0) for f in followers if f.get('mid')}, followers
+
+def window_bottom(snapshot, limit):
+    """快照窗口最早的关注时间；快照未填满（已包含全部关注者）时返回 None"""
+    if len(snapshot) < limit:
+        return None
+    return min(snapshot.values())
+
 def check_followers_changes(api):
-    """检测关注者变化（新关注和取消关注）- 完全重构版"""
-    global followers_cache, last_follow_check, unfollowers_cache, follow_history
+    """检测关注者变化（新关注和取消关注）
+
+    每次检查只拉取一次最近关注者快照；快照按关注时间倒序，是完整关注列表的前缀。
+    上次快照中的用户本次缺失时：已知关注时间晚于本次窗口最早时间的，必然是取消关注；
+    其余可能只是被新关注者挤出窗口，统一用一次更大的快照批量核对
+    """
+    global last_follow_check
     
     try:
         current_time = int(time.time())
@@ -891,108 +1268,245 @@ def check_followers_changes(api):
         if not config.get('follow_reply_enabled', False) and not config.get('unfollow_reply_enabled', False):
             return {'new_followers': [], 'unfollowers': []}
         
-        # 获取最近的关注者（进一步优化数量，减少API负担，提高响应速度）
-        recent_followers = api.get_recent_followers(limit=15)
-        if not recent_followers:
-            return {'new_followers': [], 'unfollowers': []}
-        
-        # 使用线程锁确保原子操作
-        lock = threading.Lock()
-        with lock:
-            new_followers = []
-            unfollowers = []
-            current_followers = set()
-            
-            # 1. 构建当前关注者集合
-            for follower in recent_followers:
-                follower_mid = follower.get('mid')
-                if follower_mid:
-                    current_followers.add(follower_mid)
-            
-            # 2. 检测新关注者（支持重复关注）
-            if config.get('follow_reply_enabled', False):
-                for follower in recent_followers:
-                    follower_mid = follower.get('mid')
-                    if not follower_mid:
-                        continue
-                    
-                    follow_time = follower.get('mtime', 0)
-                    
-                    # 检查是否是最近90秒内的新关注
-                    if current_time - follow_time <= 90:
-                        # 检查是否需要发送欢迎消息
-                        should_send_welcome = False
-                        
-                        # 检查是否是新关注者
-                        is_new_follower = follower_mid not in followers_cache
-                        # 检查是否是重复关注（之前取消过关注）
-                        is_re_follow = follower_mid in followers_cache and follow_time > follow_history.get(follower_mid, 0)
-                        
-                        if (is_new_follower or is_re_follow) and follower_mid not in welcome_sent_cache:
-                            should_send_welcome = True
-                            log_type = "新关注者" if is_new_follower else "重复关注者"
-                            add_log(f"⚡ 检测到{log_type}: {follower.get('uname', 'Unknown')} (UID: {follower_mid})", 'success')
-                        
-                        if should_send_welcome:
-                            new_followers.append(follower)
-                            # 更新关注历史
-                            follow_history[follower_mid] = follow_time
-            
-            # 3. 检测取消关注者（更可靠的验证）
-            if config.get('unfollow_reply_enabled', False):
-                # 获取所有新关注者的mid集合
-                new_follower_mids = {f['mid'] for f in new_followers if f.get('mid')}
-                
-                # 找出之前在缓存中但现在不在当前关注者列表中的用户
-                lost_followers = followers_cache - current_followers
-                for unfollower_mid in lost_followers:
-                    # 确保不是新关注者（避免误判）
-                    if unfollower_mid not in new_follower_mids and unfollower_mid not in unfollowers_cache:
-                        # 双重验证：检查该用户是否在最近获取的关注者列表中
-                        # 通过重新获取关注者列表进行验证
-                        try:
-                            # 获取最新的关注者列表（限制为50个）
-                            recent_followers = api.get_recent_followers(limit=50)
-                            current_follower_mids = {f['mid'] for f in recent_followers if f.get('mid')}
-                            
-                            if unfollower_mid in current_follower_mids:
-                                # 用户仍在关注列表中，跳过处理
-                                continue
-                                
-                            # 确认用户确实取消关注
-                            unfollowers.append({'mid': unfollower_mid})
-                            unfollowers_cache.add(unfollower_mid)
-                            add_log(f"💔 确认取消关注: UID {unfollower_mid}", 'warning')
-                            # 从欢迎消息缓存中移除
-                            if unfollower_mid in welcome_sent_cache:
-                                welcome_sent_cache.remove(unfollower_mid)
-                        except Exception as e:
-                            add_log(f"验证取消关注状态失败: {e}", 'warning')
-                            continue
-            
-            # 4. 更新关注者缓存（在所有检测完成后）
-            followers_cache = current_followers.copy()
-            
-            # 优化缓存管理，减少内存占用并提高性能
-            if len(followers_cache) > 200:
-                # 只保留最新的150个关注者，减少内存占用
-                followers_cache = set(list(followers_cache)[-150:])
-            
-            if len(unfollowers_cache) > 300:
-                # 减少取消关注缓存大小
-                unfollowers_cache = set(list(unfollowers_cache)[-200:])
-            
-            if len(follow_history) > 500:
-                # 按时间排序，只保留最新的300条记录，减少内存占用
-                sorted_history = sorted(follow_history.items(), key=lambda x: x[1], reverse=True)
-                follow_history = dict(sorted_history[:300])
-            
-            return {'new_followers': new_followers, 'unfollowers': unfollowers}
+        counter = {'requests': 0}
+        try:
+            snapshot_size = int(config.get('follow_snapshot_size', 20))
+            current, recent_followers = fetch_follower_snapshot(api, snapshot_size, counter)
+            if current is None:
+                return {'new_followers': [], 'unfollowers': []}
+            return diff_follower_snapshot(api, current, recent_followers, snapshot_size, current_time, counter)
+        finally:
+            follower_check_stats['checks'] += 1
+            follower_check_stats['requests'] += counter['requests']
+            follower_check_stats['last_requests'] = counter['requests']
+            follower_check_stats['max_requests'] = max(follower_check_stats['max_requests'], counter['requests'])
         
     except Exception as e:
         add_log(f"检测关注者变化异常: {e}", 'error')
         return {'new_followers': [], 'unfollowers': []}
 
+def diff_follower_snapshot(api, current, recent_followers, snapshot_size, current_time, counter):
+    """比较本次快照与已知关注者，返回新关注者与确认的取消关注者"""
+    new_followers = []
+    unfollowers = []
+    confirmed, ambiguous = [], []
+    
+    with follower_state_lock:
+        # 1. 检测新关注者（支持重复关注）
+        if config.get('follow_reply_enabled', False):
+            for follower in recent_followers:
+                follower_mid = follower.get('mid')
+                if not follower_mid:
+                    continue
+                
+                follow_time = follower.get('mtime', 0)
+                
+                # 检查是否是最近90秒内的新关注
+                if current_time - follow_time <= 90:
+                    # 检查是否是新关注者
+                    is_new_follower = not is_known_follower(follower_mid)
+                    # 检查是否是重复关注（之前取消过关注）
+                    is_re_follow = not is_new_follower and follow_time > follow_history.get(follower_mid, 0)
+                    
+                    if (is_new_follower or is_re_follow) and follower_mid not in welcome_sent_cache:
+                        log_type = "新关注者" if is_new_follower else "重复关注者"
+                        add_log(f"⚡ 检测到{log_type}: {follower.get('uname', 'Unknown')} (UID: {follower_mid})", 'success')
+                        new_followers.append(follower)
+                        # 更新关注历史
+                        follow_history[follower_mid] = follow_time
+        
+        # 2. 检测取消关注者的候选
+        if config.get('unfollow_reply_enabled', False):
+            new_follower_mids = {f['mid'] for f in new_followers if f.get('mid')}
+            candidates = [
+                mid for mid in followers_cache
+                if mid not in current and mid not in new_follower_mids and mid not in unfollowers_cache
+            ]
+            bottom = window_bottom(current, snapshot_size)
+            confirmed = [mid for mid in candidates if bottom is None or follow_history.get(mid, 0) > bottom]
+            ambiguous = [mid for mid in candidates if mid not in confirmed]
+    
+    keep = set()  # 核对请求失败、下次继续检查的用户
+    if ambiguous:
+        # 可能只是被挤出窗口的用户：一次更大的快照批量核对（请求期间不持有状态锁）
+        verify_size = max(int(config.get('follow_verify_size', 50)), snapshot_size)
+        follower_check_stats['verifications'] += 1
+        verified, _ = fetch_follower_snapshot(api, verify_size, counter)
+        if verified is None:
+            add_log(f"核对取消关注状态失败，{len(ambiguous)} 个用户下次继续检查", 'warning')
+            keep.update(ambiguous)
+        else:
+            verify_bottom = window_bottom(verified, verify_size)
+            for mid in ambiguous:
+                if mid in verified:
+                    continue  # 仍在关注，只是被挤出快照窗口，此后不再跟踪
+                elif verify_bottom is None or follow_history.get(mid, 0) > verify_bottom:
+                    confirmed.append(mid)
+                else:
+                    # 关注时间早于核对窗口，无法确认，不再跟踪
+                    follower_check_stats['aged_out'] += 1
+    
+    with follower_state_lock:
+        for unfollower_mid in confirmed:
+            if unfollower_mid in unfollowers_cache:
+                continue  # 核对期间已由全量对账确认并投递告别消息
+            unfollowers.append({'mid': unfollower_mid})
+            unfollowers_cache.add(unfollower_mid)
+            follower_check_stats['confirmed_unfollows'] += 1
+            add_log(f"💔 确认取消关注: UID {unfollower_mid}", 'warning')
+            # 从欢迎消息缓存中移除
+            welcome_sent_cache.discard(unfollower_mid)
+        
+        # 3. 更新关注者缓存与关注时间（在所有检测完成后，原地修改，不丢弃其他线程的更新）
+        followers_cache.clear()
+        followers_cache.update(current)
+        followers_cache.update(keep)
+        for mid, follow_time in current.items():
+            if follow_time and follow_time > follow_history.get(mid, 0):
+                follow_history[mid] = follow_time
+        
+        # 优化缓存管理，减少内存占用并提高性能（启用全量对账时以对账集合为准，快照缓存不再截断）
+        if len(followers_cache) > 200 and follower_reconciler is None:
+            # 只保留最新的150个关注者，减少内存占用
+            latest = sorted(followers_cache, key=lambda mid: follow_history.get(mid, 0))[-150:]
+            followers_cache.clear()
+            followers_cache.update(latest)
+        
+        if len(unfollowers_cache) > 300:
+            # 减少取消关注缓存大小
+            latest = list(unfollowers_cache)[-200:]
+            unfollowers_cache.clear()
+            unfollowers_cache.update(latest)
+        
+        if len(follow_history) > 500:
+            # 按时间排序，只保留最新的300条记录，减少内存占用
+            sorted_history = sorted(follow_history.items(), key=lambda x: x[1], reverse=True)
+            follow_history.clear()
+            follow_history.update(sorted_history[:300])
+    
+    if counter['requests'] > 1:
+        add_log(f"关注者检查使用 {counter['requests']} 次请求", 'debug')
+    
+    return {'new_followers': new_followers, 'unfollowers': unfollowers}
+
+def is_known_follower(mid):
+    """是否为已知关注者：快照窗口缓存之外，启用全量对账时以对账得到的完整集合为准"""
+    if mid in followers_cache:
+        return True
+    reconciler = follower_reconciler
+    snapshot = reconciler.snapshot if reconciler is not None else None
+    return snapshot is not None and mid in snapshot
+
+def start_follower_reconciler():
+    """启动关注者全量对账（未启用或未配置登录信息时返回 None）"""
+    global follower_reconciler
+    if not config.get('follower_reconcile_enabled', False) or not config.get('sessdata'):
+        return None
+    init_config_paths()
+    if follower_reconciler is None:
+        api = BilibiliAPI(config['sessdata'], config['bili_jct'])
+
+        def fetch_page(page, page_size):
+            data = api.get_followers(page=page, page_size=page_size)
+            if data is None:
+                return None
+            return [follower.get('mid') for follower in data.get('list') or [] if follower.get('mid')]
+
+        reconciler = FollowerReconciler(fetch_page, path=FOLLOWER_FILE)
+        try:
+            if reconciler.load():
+                add_log(f"已恢复完整关注者集合: {len(reconciler.snapshot or [])} 人", 'info')
+        except Exception as e:
+            add_log(f"读取关注者集合失败，重新拉取: {e}", 'warning')
+        follower_reconciler = reconciler
+    follower_reconciler.configure(
+        requests_per_minute=float(config.get('follower_reconcile_rpm', 6)),
+        max_pages=int(config.get('follower_reconcile_max_pages', 0))
+    )
+    follower_reconciler.start(handle_reconciled_followers)
+    return follower_reconciler
+
+def stop_follower_reconciler():
+    """停止关注者全量对账并保存进度"""
+    global follower_reconciler
+    if follower_reconciler is not None:
+        try:
+            follower_reconciler.stop()
+        except Exception as e:
+            add_log(f"保存关注者集合失败: {e}", 'warning')
+        follower_reconciler = None
+
+def handle_reconciled_followers(added, removed):
+    """全量对账完成一轮：确认的取消关注者投递告别消息（新增关注由快照窗口检测负责欢迎）"""
+    add_log(f"关注者全量对账完成: 新增 {len(added)} 人, 取消关注 {len(removed)} 人", 'info')
+    goodbyes = []
+    with follower_state_lock:
+        for mid in removed:
+            followers_cache.discard(mid)
+            welcome_sent_cache.discard(mid)
+            if mid in unfollowers_cache:
+                continue
+            unfollowers_cache.add(mid)
+            goodbyes.append(mid)
+    if config.get('unfollow_reply_enabled', False):
+        for mid in goodbyes:
+            add_log(f"💔 全量对账确认取消关注: UID {mid}", 'warning')
+            enqueue_send('goodbye', {'mid': mid})
+
+def start_follower_sync():
+    """启动关注者检测线程：按 follow_check_interval 独立检测关注变化，欢迎/告别消息以低优先级投递到发送队列"""
+    global follower_sync_thread, follower_sync_budget
+    rpm = float(config.get('follow_requests_per_minute', 6))
+    if follower_sync_budget is None:
+        # 容量 3：一次检查最多一次快照、一次核对和一次身份查询
+        follower_sync_budget = TokenBucket(rpm / 60.0, 3, time.monotonic())
+    else:
+        follower_sync_budget.rate = rpm / 60.0
+    if follower_sync_thread is not None and follower_sync_thread.is_alive():
+        return follower_sync_thread
+    follower_sync_stop.clear()
+    follower_sync_thread = threading.Thread(target=run_follower_sync, name='follower-sync', daemon=True)
+    follower_sync_thread.start()
+    return follower_sync_thread
+
+def stop_follower_sync(timeout=3.0):
+    """停止关注者检测线程"""
+    global follower_sync_thread
+    follower_sync_stop.set()
+    if follower_sync_thread is not None:
+        follower_sync_thread.join(timeout)
+        follower_sync_thread = None
+
+def run_follower_sync():
+    """关注者检测线程主循环"""
+    api = None
+    while monitoring and not follower_sync_stop.is_set():
+        wait = max(1.0, float(config.get('follow_check_interval', 30)))
+        if config.get('follow_reply_enabled', False) or config.get('unfollow_reply_enabled', False):
+            try:
+                budget_wait = follower_sync_budget.time_until_available(time.monotonic())
+                if budget_wait > 0:
+                    follower_check_stats['budget_waits'] += 1
+                    wait = budget_wait
+                else:
+                    if api is None:
+                        api = BilibiliAPI(config['sessdata'], config['bili_jct'])
+                    checks = follower_check_stats['checks']
+                    changes = check_followers_changes(api)
+                    if follower_check_stats['checks'] > checks:
+                        # 按本次检查实际使用的请求数扣减预算（可透支，下次相应推迟）
+                        follower_sync_budget.consume(time.monotonic(), follower_check_stats['last_requests'])
+                    for follower in changes['new_followers']:
+                        if enqueue_send('welcome', follower):
+                            follower_check_stats['enqueued'] += 1
+                    for unfollower in changes['unfollowers']:
+                        if enqueue_send('goodbye', unfollower):
+                            follower_check_stats['enqueued'] += 1
+            except Exception as e:
+                add_log(f"关注者检测线程异常: {e}", 'warning')
+                api = None
+        follower_sync_stop.wait(wait)
+
 # 保持向后兼容性
 def check_new_followers(api):
     """检测新关注者（向后兼容函数）"""
@@ -1000,7 +1514,7 @@ def check_new_followers(api):
     return result['new_followers']
 
 def send_follow_welcome_message(api, follower):
-    """向新关注者发送欢迎消息"""
+    """向新关注者发送欢迎消息（成功返回 True，失败返回 False，被限速返回 None）"""
     try:
         follower_mid = follower.get('mid')
         follower_name = follower.get('uname', 'Unknown')
@@ -1008,6 +1522,10 @@ def send_follow_welcome_message(api, follower):
         if not follower_mid:
             return False
         
+        # 当前被限速时不发送，返回 None 由调用方稍后重试
+        if send_scheduler.peek(follower_mid) > 0:
+            return None
+        
         # 获取回复配置
         reply_type = config.get('follow_reply_type', 'text')
         reply_message = config.get('follow_reply_message', '感谢您的关注！')
@@ -1037,6 +1555,9 @@ def send_follow_welcome_message(api, follower):
                 success = True
                 add_log(f"✅ 成功向新关注者 {follower_name} 发送欢迎消息", 'success')
         
+        if not success and result and result.get('code') == SEND_THROTTLED:
+            return None
+        
         if not success:
             error_msg = result.get('message', '未知错误') if result else '网络错误'
             add_log(f"❌ 向新关注者 {follower_name} 发送欢迎消息失败: {error_msg}", 'warning')
@@ -1048,13 +1569,17 @@ def send_follow_welcome_message(api, follower):
         return False
 
 def send_unfollow_goodbye_message(api, unfollower):
-    """向取消关注者发送告别消息"""
+    """向取消关注者发送告别消息（成功返回 True，失败返回 False，被限速返回 None）"""
     try:
         unfollower_mid = unfollower.get('mid')
         
         if not unfollower_mid:
             return False
         
+        # 当前被限速时不发送，返回 None 由调用方稍后重试
+        if send_scheduler.peek(unfollower_mid) > 0:
+            return None
+        
         # 获取回复配置
         reply_type = config.get('unfollow_reply_type', 'text')
         reply_message = config.get('unfollow_reply_message', '很遗憾看到您取消了关注，希望我们还有机会再见！')
@@ -1084,6 +1609,9 @@ def send_unfollow_goodbye_message(api, unfollower):
                 success = True
                 add_log(f"✅ 成功向取消关注者 UID:{unfollower_mid} 发送告别消息", 'success')
         
+        if not success and result and result.get('code') == SEND_THROTTLED:
+            return None
+        
         if not success:
             error_msg = result.get('message', '未知错误') if result else '网络错误'
             add_log(f"❌ 向取消关注者 UID:{unfollower_mid} 发送告别消息失败: {error_msg}", 'warning')
@@ -1094,18 +1622,89 @@ def send_unfollow_goodbye_message(api, unfollower):
         add_log(f"发送取消关注告别消息异常: {e}", 'error')
         return False
 
+def extract_session_last_msg(session):
+    """从会话列表数据中提取可直接使用的最后一条消息
+
+    会话列表已内嵌 last_msg，只有在内容被截断、非文字消息或序号出现缺口时
+    才需要额外调用 fetch_session_msgs，此时返回 None
+    """
+    last_msg = session.get('last_msg')
+    if not isinstance(last_msg, dict) or not last_msg:
+        return None
+
+    # 非文字消息（图片、分享卡片等）需要完整数据
+    if last_msg.get('msg_type') != 1:
+        return None
+
+    # 内容无法解析为 JSON 说明被截断或格式异常
+    content_str = last_msg.get('content')
+    if not content_str or not isinstance(content_str, str):
+        return None
+    try:
+        content_obj = json.loads(content_str)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(content_obj, dict) or not isinstance(content_obj.get('content'), str):
+        return None
+
+    # last_msg 的序号落后于会话最大序号，说明列表中的消息不是最新一条
+    msg_seqno = last_msg.get('msg_seqno', 0)
+    max_seqno = session.get('max_seqno', 0)
+    if max_seqno and msg_seqno and msg_seqno < max_seqno:
+        return None
+
+    return last_msg
+
+def session_fingerprint(session):
+    """计算会话指纹，用于判断会话自上次轮询以来是否发生变化"""
+    last_msg = session.get('last_msg') or {}
+    return (last_msg.get('timestamp', 0), last_msg.get('msg_seqno', 0), session.get('unread_count', 0))
+
+def resolve_latest_message(api, session):
+    """获取会话最新消息：优先使用会话列表内嵌数据，必要时回退到 fetch_session_msgs"""
+    latest_msg = extract_session_last_msg(session)
+    if latest_msg is not None:
+        message_fetch_stats['session_list_hits'] += 1
+        return latest_msg
+
+    message_fetch_stats['fetch_fallbacks'] += 1
+    return api.get_latest_message(session.get('talker_id'))
+
+def extract_message_text(msg):
+    """提取文字消息内容（content 为 JSON 字符串，解析失败时按原文处理）"""
+    content_str = msg.get('content', '{}')
+    try:
+        content_obj = json.loads(content_str)
+        return content_obj.get('content', '').strip()
+    except:
+        return content_str.strip()
+
 def process_single_session(api, my_uid, session):
-    """处理单个会话的消息（只检测最后一条消息）"""
-    global message_cache, last_message_times, program_start_time
-    
+    """处理单个会话的消息（默认只检测最后一条消息，连发模式下处理所有未处理的消息）"""
+    global last_message_times, program_start_time
+
     try:
         talker_id = session.get('talker_id')
         if not talker_id:
             return []
-        
-        # 获取最新的一条消息
-        latest_msg = api.get_latest_message(talker_id)
+
+        listed_msg = session.get('last_msg') or {}
+        if config.get('burst_mode_enabled', False):
+            # 连发模式按消息序号判断（同一秒内的多条消息时间戳相同）
+            if listed_msg and not is_unseen_message(talker_id, listed_msg):
+                return []
+            return process_session_burst(api, my_uid, session)
+
+        # 会话列表中的时间戳未超过已处理时间，无需获取消息
+        listed_timestamp = listed_msg.get('timestamp', 0)
+        if listed_timestamp and listed_timestamp <= last_message_times.get(talker_id, 0):
+            return []
+
+        # 获取最新的一条消息（优先使用会话列表内嵌的 last_msg）
+        latest_msg = resolve_latest_message(api, session)
         if not latest_msg:
+            # 获取失败时清除指纹，下一轮重新处理该会话
+            session_fingerprints.pop(talker_id, None)
             return []
         
         msg_timestamp = latest_msg.get('timestamp', 0)
@@ -1117,7 +1716,7 @@ def process_single_session(api, my_uid, session):
             if msg_timestamp < program_start_time:
                 add_log(f"用户{talker_id} 消息时间早于程序启动时间，跳过回复（仅回复新消息模式）", 'debug')
                 # 仍然更新最后处理时间，避免重复检查
-                last_message_times[talker_id] = msg_timestamp
+                record_watermark(talker_id, msg_timestamp, latest_msg.get('msg_seqno'))
                 return []
         
         # 检查是否是新消息
@@ -1126,7 +1725,7 @@ def process_single_session(api, my_uid, session):
             return []
         
         # 更新最后处理时间
-        last_message_times[talker_id] = msg_timestamp
+        record_watermark(talker_id, msg_timestamp, latest_msg.get('msg_seqno'))
         
         # 如果最后一条消息是我发的，不回复
         if sender_uid == my_uid:
@@ -1134,23 +1733,16 @@ def process_single_session(api, my_uid, session):
             return []
         
         # 获取消息内容
-        content_str = latest_msg.get('content', '{}')
-        try:
-            content_obj = json.loads(content_str)
-            message_text = content_obj.get('content', '').strip()
-        except:
-            message_text = content_str.strip()
+        message_text = extract_message_text(latest_msg)
         
         if not message_text:
             return []
         
         # 生成消息ID并检查缓存
         msg_id = generate_message_id(talker_id, msg_timestamp, message_text)
-        if msg_id in message_cache:
+        if not mark_message_seen(msg_id):
             return []
-        
-        # 更新缓存
-        message_cache[msg_id] = True
+        remember_turn(talker_id, 'user', message_text, msg_timestamp)
         
         # 极速关键词匹配
         matched_rule = check_keywords_fast(message_text)
@@ -1163,95 +1755,519 @@ def process_single_session(api, my_uid, session):
                 'message': message_text,
                 'timestamp': msg_timestamp
             }]
-        else:
-            # 关键词匹配失败 - 检查是否启用 AI 系统进行智能回复
-            if config.get('ai_agent_enabled', False) and ai_agent:
-                try:
-                    # 获取用户名（用于上下文）
-                    sender_name = f"用户{talker_id}"
-
-                    # 调用 AI 系统生成回复
-                    # 支持两种调用方式：AI 适配器 (reply方法) 和原有 AI Agent (reply方法)
-                    ai_reply = None
-
-                    if hasattr(ai_agent, 'reply'):
-                        # 尝试使用 reply() 方法（同时适配 AI 适配器和 AI Agent）
-                        try:
-                            ai_reply = ai_agent.reply(
-                                message=message_text,
-                                user_id=talker_id,
-                                user_name=sender_name
-                            )
-                        except TypeError:
-                            # 如果是原有的 AI Agent，使用其特定的参数
-                            ai_reply = ai_agent.reply(
-                                message=message_text,
-                                sender_id=talker_id,
-                                sender_name=sender_name,
-                                use_ai=config.get('ai_agent_mode', 'rule') == 'ai'
-                            )
-
-                    if ai_reply and ai_reply.strip():
-                        add_log(f"🤖 AI 系统为用户{talker_id} 生成回复: {ai_reply[:50]}...", 'info')
-                        return [{
-                            'talker_id': talker_id,
-                            'rule': {
-                                'title': 'AI 回复',
-                                'reply': ai_reply,
-                                'reply_type': 'text'
-                            },
-                            'message': message_text,
-                            'timestamp': msg_timestamp
-                        }]
-                    else:
-                        add_log(f"❌ AI 系统生成回复失败或返回空内容，降级处理", 'warning')
-
-                except Exception as e:
-                    add_log(f"❌ AI 系统处理异常: {e}", 'error')
-                    # 如果启用了降级策略，继续尝试默认回复
-                    if not config.get('ai_use_fallback', True):
-                        return []
-
-            # AI Agent 失败或未启用 - 检查默认回复
-            if config.get('default_reply_enabled', False):
-                default_type = config.get('default_reply_type', 'text')
-
-                if default_type == 'text' and config.get('default_reply_message'):
-                    add_log(f"⚠️ 用户{talker_id} 消息'{message_text}' 未匹配关键词，使用默认文字回复", 'info')
-                    return [{
-                        'talker_id': talker_id,
-                        'rule': {
-                            'title': '默认回复',
-                            'reply': config.get('default_reply_message'),
-                            'reply_type': 'text'
-                        },
-                        'message': message_text,
-                        'timestamp': msg_timestamp
-                    }]
-                elif default_type == 'image' and config.get('default_reply_image'):
-                    add_log(f"⚠️ 用户{talker_id} 消息'{message_text}' 未匹配关键词，使用默认图片回复", 'info')
-                    return [{
-                        'talker_id': talker_id,
-                        'rule': {
-                            'title': '默认回复',
-                            'reply': '[图片回复]',
-                            'reply_type': 'image',
-                            'reply_image': config.get('default_reply_image')
-                        },
-                        'message': message_text,
-                        'timestamp': msg_timestamp
-                    }]
-            else:
-                add_log(f"❌ 用户{talker_id} 消息'{message_text}' 未匹配任何关键词且无默认回复", 'debug')
-                return []
+        # 关键词匹配失败 - 交给 AI 或默认回复
+        return build_unmatched_reply(talker_id, message_text, msg_timestamp)
         
     except Exception as e:
         logger.error(f"处理会话 {session.get('talker_id')} 时出错: {e}")
+        session_fingerprints.pop(session.get('talker_id'), None)
+        return []
+
+def is_unseen_message(talker_id, msg):
+    """连发模式下判断消息是否未处理：有序号水位时只比较 msg_seqno；
+    未记录序号时（首次处理或旧版本状态）按时间水位判断，同一秒的消息交给去重记录过滤"""
+    seqno_watermark = last_message_seqnos.get(talker_id)
+    seqno = msg.get('msg_seqno')
+    if seqno_watermark and seqno:
+        return seqno > seqno_watermark
+    timestamp = msg.get('timestamp', 0)
+    return not timestamp or timestamp >= last_message_times.get(talker_id, 0)
+
+def fetch_unseen_messages(api, session):
+    """
+    获取会话中水位之后的所有消息（按序号从早到晚）
+
+    会话列表显示只有一条未读且内嵌的 last_msg 可直接使用时不发起请求；
+    否则用一次 fetch_session_msgs 拉取已处理序号之后的消息，失败返回 None
+    """
+    talker_id = session.get('talker_id')
+    if session.get('unread_count', 0) <= 1:
+        last_msg = extract_session_last_msg(session)
+        if last_msg is not None:
+            message_fetch_stats['session_list_hits'] += 1
+            return [last_msg]
+
+    message_fetch_stats['fetch_fallbacks'] += 1
+    begin_seqno = last_message_seqnos.get(talker_id)
+    messages = api.get_messages_after(talker_id, begin_seqno, size=int(config.get('burst_fetch_size', 20)))
+    if messages is None:
+        return None
+    return [msg for msg in messages if is_unseen_message(talker_id, msg)]
+
+def process_session_burst(api, my_uid, session):
+    """连发模式：处理会话中所有未处理的消息，跨消息匹配规则并合并回复"""
+    talker_id = session.get('talker_id')
+    messages = fetch_unseen_messages(api, session)
+    if messages is None:
+        # 获取失败时清除指纹，下一轮重新处理该会话
+        session_fingerprints.pop(talker_id, None)
+        return []
+    if not messages:
+        return []
+
+    last_msg = messages[-1]
+    msg_timestamp = last_msg.get('timestamp', 0)
+    record_watermark(talker_id, msg_timestamp, last_msg.get('msg_seqno'))
+
+    # 只处理我最后一次发言之后的消息，之前的已经回复过
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get('sender_uid') == my_uid:
+            messages = messages[index + 1:]
+            break
+
+    texts = []
+    for msg in messages:
+        if msg.get('msg_type', 1) != 1:
+            continue
+        if config.get('only_reply_new_messages', False) and msg.get('timestamp', 0) < program_start_time:
+            continue
+        message_text = extract_message_text(msg)
+        if not message_text:
+            continue
+        if not mark_message_seen(generate_message_id(talker_id, msg.get('timestamp', 0), message_text)):
+            continue
+        remember_turn(talker_id, 'user', message_text, msg.get('timestamp'))
+        texts.append(message_text)
+
+    if not texts:
         return []
+    if len(texts) > 1:
+        add_log(f"📨 用户{talker_id} 连发 {len(texts)} 条消息，合并处理", 'info')
+
+    # 每条消息分别匹配，同一规则只回复一次
+    matched_rules = []
+    unmatched = []
+    for message_text in texts:
+        matched_rule = check_keywords_fast(message_text)
+        if matched_rule is None:
+            unmatched.append(message_text)
+        elif all(rule is not matched_rule for rule in matched_rules):
+            matched_rules.append(matched_rule)
+
+    combined_message = '\n'.join(texts)
+    if not matched_rules:
+        return build_unmatched_reply(talker_id, '\n'.join(unmatched), msg_timestamp)
+
+    add_log(f"✅ 检测到关键词匹配: 用户{talker_id} {len(texts)} 条消息匹配规则 {', '.join(rule['title'] for rule in matched_rules)}", 'info')
+    return coalesce_rule_replies(talker_id, matched_rules, combined_message, msg_timestamp)
+
+def coalesce_rule_replies(talker_id, matched_rules, message_text, msg_timestamp):
+    """把多条命中规则的回复合并：文字回复拼成一条，图片回复各自发送，总数不超过 burst_max_replies"""
+    max_replies = max(1, int(config.get('burst_max_replies', 1)))
+    text_rules = [rule for rule in matched_rules if rule.get('reply_type', 'text') != 'image']
+    results = []
+    if text_rules:
+        if len(text_rules) == 1:
+            rule = text_rules[0]
+        else:
+            rule = {
+                'title': ' + '.join(rule['title'] for rule in text_rules),
+                'reply': '\n'.join(rule['reply'] for rule in text_rules),
+                'reply_type': 'text'
+            }
+        results.append(rule)
+    results.extend(rule for rule in matched_rules if rule.get('reply_type', 'text') == 'image')
+    return [
+        {'talker_id': talker_id, 'rule': rule, 'message': message_text, 'timestamp': msg_timestamp}
+        for rule in results[:max_replies]
+    ]
+
+def build_unmatched_reply(talker_id, message_text, msg_timestamp):
+    """未命中关键词的消息：提交 AI 流水线异步生成（返回空列表），未启用或降级时返回默认回复"""
+    breaker = getattr(ai_agent, 'breaker', None)
+    if breaker is not None and breaker.state == 'open':
+        # RAG 服务熔断中，不再提交 AI 请求，直接降级
+        add_log(f"⚡ AI 服务熔断中，用户{talker_id} 的消息直接使用默认回复", 'debug')
+    elif config.get('ai_agent_enabled', False) and ai_agent:
+        # 提交到 AI 流水线异步生成，完成后直接进入发送队列，不阻塞其他会话的检测
+        request = {'talker_id': talker_id, 'message': message_text, 'timestamp': msg_timestamp}
+        pipeline = ai_pipeline or start_ai_pipeline()
+        if pipeline.submit(request, deadline=float(config.get('ai_reply_deadline', 20.0))) is not None:
+            return []
+        add_log(f"⚠️ AI 回复等待数已满，用户{talker_id} 的消息降级处理", 'warning')
+
+    # AI Agent 失败或未启用 - 检查默认回复
+    result = build_default_reply(talker_id, message_text, msg_timestamp)
+    return [result] if result else []
+
+def remember_turn(talker_id, role, content, timestamp=None):
+    """把已获取的消息或已发送的回复记入 AI 对话上下文（AI 适配器未启用上下文时忽略）"""
+    remember = getattr(ai_agent, 'remember', None)
+    if callable(remember):
+        try:
+            remember(talker_id, role, content, timestamp)
+        except Exception as e:
+            logger.debug(f"记录对话上下文失败: {e}")
+
+def build_default_reply(talker_id, message_text, msg_timestamp):
+    """构建默认回复（未启用默认回复或未配置内容时返回 None）"""
+    if not config.get('default_reply_enabled', False):
+        add_log(f"❌ 用户{talker_id} 消息'{message_text}' 未匹配任何关键词且无默认回复", 'debug')
+        return None
+
+    default_type = config.get('default_reply_type', 'text')
+    if default_type == 'text' and config.get('default_reply_message'):
+        add_log(f"⚠️ 用户{talker_id} 消息'{message_text}' 未匹配关键词，使用默认文字回复", 'info')
+        return {
+            'talker_id': talker_id,
+            'rule': {
+                'title': '默认回复',
+                'reply': config.get('default_reply_message'),
+                'reply_type': 'text'
+            },
+            'message': message_text,
+            'timestamp': msg_timestamp
+        }
+    if default_type == 'image' and config.get('default_reply_image'):
+        add_log(f"⚠️ 用户{talker_id} 消息'{message_text}' 未匹配关键词，使用默认图片回复", 'info')
+        return {
+            'talker_id': talker_id,
+            'rule': {
+                'title': '默认回复',
+                'reply': '[图片回复]',
+                'reply_type': 'image',
+                'reply_image': config.get('default_reply_image')
+            },
+            'message': message_text,
+            'timestamp': msg_timestamp
+        }
+    return None
+
+def generate_ai_reply(request):
+    """调用 AI 系统生成回复（在 AI 流水线线程中执行）"""
+    agent = ai_agent
+    if agent is None or not hasattr(agent, 'reply'):
+        return None
+
+    talker_id = request['talker_id']
+    # 获取用户名（用于上下文）
+    sender_name = f"用户{talker_id}"
+
+    # 支持两种调用方式：AI 适配器 (reply方法) 和原有 AI Agent (reply方法)
+    try:
+        return agent.reply(
+            message=request['message'],
+            user_id=talker_id,
+            user_name=sender_name
+        )
+    except TypeError:
+        # 如果是原有的 AI Agent，使用其特定的参数
+        return agent.reply(
+            message=request['message'],
+            sender_id=talker_id,
+            sender_name=sender_name,
+            use_ai=config.get('ai_agent_mode', 'rule') == 'ai'
+        )
+
+def handle_ai_result(request, ai_reply, error):
+    """AI 回复生成完成：投递到发送队列，失败时按配置降级为默认回复"""
+    talker_id = request['talker_id']
+    if error is not None:
+        add_log(f"❌ AI 系统处理异常: {error}", 'error')
+        # 如果未启用降级策略，不再尝试默认回复
+        if not config.get('ai_use_fallback', True):
+            return
+        result = build_default_reply(talker_id, request['message'], request['timestamp'])
+    elif ai_reply and ai_reply.strip():
+        add_log(f"🤖 AI 系统为用户{talker_id} 生成回复: {ai_reply[:50]}...", 'info')
+        result = {
+            'talker_id': talker_id,
+            'rule': {
+                'title': 'AI 回复',
+                'reply': ai_reply,
+                'reply_type': 'text'
+            },
+            'message': request['message'],
+            'timestamp': request['timestamp']
+        }
+    else:
+        add_log(f"❌ AI 系统生成回复失败或返回空内容，降级处理", 'warning')
+        result = build_default_reply(talker_id, request['message'], request['timestamp'])
+
+    if result:
+        enqueue_send('reply', result)
+
+def handle_ai_timeouts():
+    """超过截止时间的 AI 请求降级为默认回复，返回投递的回复数"""
+    if ai_pipeline is None:
+        return 0
+    delivered = 0
+    for request in ai_pipeline.expire():
+        add_log(f"⏱️ 用户{request['talker_id']} 的 AI 回复超过截止时间，使用默认回复", 'warning')
+        result = build_default_reply(request['talker_id'], request['message'], request['timestamp'])
+        if result and enqueue_send('reply', result):
+            delivered += 1
+    return delivered
+
+def start_ai_pipeline():
+    """启动 AI 回复流水线（已在运行时直接返回）"""
+    global ai_pipeline
+    if ai_pipeline is not None:
+        return ai_pipeline
+    pipeline = AIReplyPipeline(
+        generate_ai_reply,
+        handle_ai_result,
+        workers=int(config.get('ai_workers', 4)),
+        deadline=float(config.get('ai_reply_deadline', 20.0)),
+        max_pending=int(config.get('ai_max_pending', 100))
+    )
+    pipeline.start()
+    ai_pipeline = pipeline
+    return pipeline
+
+def stop_ai_pipeline():
+    """停止 AI 回复流水线，丢弃仍在等待的请求"""
+    global ai_pipeline
+    if ai_pipeline is None:
+        return
+    dropped = ai_pipeline.shutdown(wait=False)
+    if dropped:
+        add_log(f"AI 回复流水线停止，丢弃 {dropped} 条等待中的请求", 'warning')
+    ai_pipeline = None
+
+def deliver_reply(api, result):
+    """发送一条回复并登记送达验证
+
+    Returns:
+        (status, retry_after)，status 取值：
+        'sent' 已发送（送达由 delivery_verifier 延迟确认） / 'throttled' 本地限速（retry_after 秒后重试） /
+        'rate_limited' 触发 -412 / 'auth_failed' 登录失效 / 'failed' 其他失败 / 'skipped' 跳过
+    """
+    reply_result = None
+    reply_content = result['rule']['reply']
+    talker_id = result['talker_id']
+    
+    # 检查回复类型
+    reply_type = result['rule'].get('reply_type', 'text')
+    
+    if reply_type == 'image':
+        # 发送图片回复
+        image_path = result['rule'].get('reply_image', '')
+        if image_path and os.path.exists(image_path):
+            add_log(f"发送图片回复给用户 {talker_id}: {os.path.basename(image_path)}", 'info')
+            reply_result = api.send_image_msg(talker_id, image_path)
+            
+            # 如果图片发送失败，尝试发送备用文字回复
+            if not reply_result:
+                # 使用默认文字回复或通用回复
+                fallback_message = config.get('default_reply_message', '您好，感谢您的消息！')
+                add_log(f"图片发送失败，发送备用文字回复给用户 {talker_id}: {fallback_message}", 'warning')
+                reply_result = api.send_msg(talker_id, content=fallback_message)
+            reply_content = f"[图片] {os.path.basename(image_path)}"
+        else:
+            add_log(f"图片文件不存在，跳过回复用户 {talker_id}", 'warning')
+            return 'skipped', 0
+    else:
+        # 发送文字回复
+        reply_result = api.send_msg(talker_id, content=result['rule']['reply'])
+    
+    if reply_result and reply_result.get('code') == 0:
+        # 登记 msg_key，由后续会话列表快照批量确认送达，超时未确认再定向核对
+        msg_key = (reply_result.get('data') or {}).get('msg_key')
+        delivery_verifier.track(msg_key, talker_id, reply_content)
+        remember_turn(talker_id, 'assistant', reply_content)
+        add_log(f"✅ 已成功回复用户 {talker_id} (规则: {result['rule']['title']}) 内容: {reply_content[:20]}...", 'success')
+        return 'sent', 0
+    
+    if reply_result and reply_result.get('code') == SEND_THROTTLED:
+        return 'throttled', reply_result.get('retry_after', 0)
+    
+    if reply_result and reply_result.get('code') == -412:
+        add_log(f"🚫 用户 {talker_id} 触发频率限制: {reply_result.get('message', '')}", 'warning')
+        return 'rate_limited', 0
+    
+    if reply_result and reply_result.get('code') == -101:
+        add_log("🔐 登录状态失效，请重新配置登录信息", 'error')
+        return 'auth_failed', 0
+    
+    error_msg = reply_result.get('message', '未知错误') if reply_result else '网络错误'
+    error_code = reply_result.get('code', 'N/A') if reply_result else 'N/A'
+    add_log(f"❌ 回复用户 {talker_id} 失败 [错误码:{error_code}]: {error_msg}", 'warning')
+    return 'failed', 0
+
+def get_sender_api():
+    """获取发送线程专用的 API 对象（每个发送线程独立的连接，凭证变化时重建）"""
+    api = getattr(_sender_local, 'api', None)
+    if api is None or api.sessdata != config.get('sessdata') or api.bili_jct != config.get('bili_jct'):
+        api = BilibiliAPI(config['sessdata'], config['bili_jct'])
+        _sender_local.api = api
+    return api
+
+def record_delivery(success):
+    """记录一次发送结果"""
+    with delivery_stats_lock:
+        if success:
+            delivery_stats['sent'] += 1
+            delivery_stats['last_sent_at'] = time.time()
+        else:
+            delivery_stats['failed'] += 1
+
+def configure_delivery_verifier():
+    """根据配置更新送达验证参数"""
+    delivery_verifier.deadline = float(config.get('verify_deadline', 10.0))
+    delivery_verifier.sample_rate = float(config.get('verify_sample_rate', 1.0))
+
+def verify_pending_deliveries(api, talker_id, msg_keys):
+    """定向拉取会话消息，核对超时仍未确认的已发送消息"""
+    msgs_data = api.get_session_msgs(talker_id, size=10)
+    messages = None
+    if msgs_data and msgs_data.get('code') == 0:
+        messages = (msgs_data.get('data') or {}).get('messages') or []
+    if messages is None:
+        add_log(f"拉取用户 {talker_id} 的会话消息失败，{len(msg_keys)} 条消息下次继续核对", 'debug')
+    confirmed, failed = delivery_verifier.confirm_from_messages(talker_id, msg_keys, messages)
+    for pending in failed:
+        add_log(f"⚠️ 用户 {talker_id} 发送验证失败，消息可能未送达: {pending.content[:20]}", 'warning')
+    if failed:
+        with delivery_stats_lock:
+            delivery_stats['unverified'] += len(failed)
+
+def handle_outbox_job(kind, payload):
+    """处理发送队列中的任务（在发送线程中执行）
+
+    被本地限速时返回推迟秒数（由调度器错开各任务的重试时间，不计入重试次数）；
+    触发 -412 时抛出 RetryLater，冷却结束后重试，计入重试次数
+    """
+    global monitoring
+    api = get_sender_api()
+    
+    if kind == 'reply':
+        status, retry_after = deliver_reply(api, payload)
+        if status == 'throttled':
+            return max(send_scheduler.defer(payload['talker_id']), 0.01)
+        if status == 'auth_failed':
+            monitoring = False
+        if status != 'skipped':
+            record_delivery(status == 'sent')
+        if status == 'rate_limited':
+            raise RetryLater(max(send_scheduler.defer(payload['talker_id']), 0.01), "触发频率限制")
+        return None
+    
+    if kind == 'verify':
+        verify_pending_deliveries(api, payload['talker_id'], payload['msg_keys'])
+        return None
+    
+    if kind == 'welcome':
+        sent = send_follow_welcome_message(api, payload)
+        if sent:
+            with follower_state_lock:
+                welcome_sent_cache.add(payload['mid'])
+    else:
+        sent = send_unfollow_goodbye_message(api, payload)
+    
+    if sent is None:
+        return max(send_scheduler.defer(payload.get('mid')), 0.01)
+    record_delivery(sent)
+    return None
+
+def start_outbox():
+    """启动发送队列（已在运行时直接返回）"""
+    global outbox
+    if outbox is not None and outbox.is_running():
+        return outbox
+    outbox = Outbox(
+        handle_outbox_job,
+        workers=int(config.get('send_workers', 2)),
+        maxsize=int(config.get('send_queue_size', 500)),
+        name='send-outbox'
+    )
+    outbox.start()
+    return outbox
+
+def stop_outbox(drain=True):
+    """停止发送队列，drain 为 True 时先发送完队列中的任务"""
+    global outbox
+    if outbox is None:
+        return
+    discarded = outbox.stop(drain=drain, timeout=float(config.get('send_drain_timeout', 10.0)))
+    if discarded:
+        add_log(f"发送队列停止，丢弃 {discarded} 条未发送任务", 'warning')
+    outbox = None
+
+def start_push_ingest():
+    """启动推送接入（未启用、未配置地址或缺少依赖时返回 None，监控循环保持轮询）"""
+    global push_ingestor
+    if not config.get('push_ingest_enabled', False):
+        return None
+    url = config.get('push_ingest_url', '')
+    if not url:
+        add_log("已启用推送接入但未配置 push_ingest_url，继续使用轮询", 'warning')
+        return None
+    if not WEBSOCKET_AVAILABLE:
+        add_log("推送接入需要安装 websocket-client，继续使用轮询", 'warning')
+        return None
+    if push_ingestor is None:
+        headers = {
+            'Cookie': f"SESSDATA={config.get('sessdata', '')}; bili_jct={config.get('bili_jct', '')}",
+            'Origin': 'https://message.bilibili.com'
+        }
+        push_ingestor = PushIngestor(
+            lambda: WebSocketTransport(url, headers=headers),
+            reconnect_max=float(config.get('push_reconnect_max', 30.0))
+        )
+    push_ingestor.start()
+    add_log(f"推送接入已启动: {url}", 'info')
+    return push_ingestor
+
+def stop_push_ingest():
+    """停止推送接入"""
+    global push_ingestor
+    if push_ingestor is not None:
+        push_ingestor.stop()
+        push_ingestor = None
+
+def push_connected():
+    """推送通道是否可用"""
+    return push_ingestor is not None and push_ingestor.connected
+
+def poll_wait(loop_start):
+    """轮询模式按调度器间隔等待；推送通道可用时由通知唤醒，无需等待"""
+    if not push_connected():
+        time.sleep(poll_scheduler.delay(time.time() - loop_start))
+
+def process_push_notices(api, my_uid, talker_ids):
+    """只拉取有新消息通知的会话并投递回复，返回投递的回复数"""
+    reply_count = 0
+    for talker_id in talker_ids:
+        if not monitoring:
+            break
+        # 没有会话列表数据时，process_single_session 直接定向拉取该会话的消息
+        for result in process_single_session(api, my_uid, {'talker_id': talker_id}):
+            if enqueue_send('reply', result):
+                reply_count += 1
+    return reply_count
+
+def enqueue_send(kind, payload):
+    """
+    投递发送任务（'reply' / 'welcome' / 'goodbye'），按 SEND_PRIORITIES 排队
+
+    发送队列只在监控启动时创建；监控停止后仍在收尾的线程（监控、关注者检测、全量对账）
+    投递的任务直接丢弃，不会重新启动发送线程。队列未运行、已停止接收或已满时返回 False
+    """
+    queue = outbox
+    target = payload.get('talker_id') or payload.get('mid')
+    if queue is None or not queue.is_running():
+        add_log(f"⚠️ 发送队列未运行，丢弃{kind}任务 (用户: {target})", 'warning')
+        return False
+    if queue.submit(kind, payload, SEND_PRIORITIES.get(kind, 0)):
+        return True
+    add_log(f"⚠️ 发送队列已满或已停止接收，丢弃{kind}任务 (用户: {target})", 'warning')
+    return False
+
+def stop_monitor_workers():
+    """停止监控启动的后台线程（推送接入、关注者检测与对账、AI 流水线、发送队列）并保存状态，可重复调用"""
+    with monitor_teardown_lock:
+        # 发送完队列中已检测到的回复后再停止发送线程
+        stop_push_ingest()
+        stop_follower_sync()
+        stop_follower_reconciler()
+        stop_ai_pipeline()
+        stop_outbox(drain=True)
+        flush_state(force=True)
 
 def monitor_messages():
     """监控消息的主循环（增强稳定性版本）"""
-    global monitoring, message_cache, last_message_times, last_send_time, monitor_thread
+    global monitoring, last_message_times, monitor_thread
     
     if not config.get('sessdata') or not config.get('bili_jct'):
         add_log("未配置登录信息，无法启动监控", 'error')
@@ -1285,16 +2301,24 @@ def monitor_messages():
 
             # 初始化 AI Agent（如果启用）
             init_ai_agent()
+            if ai_agent:
+                start_ai_pipeline()
 
             # 预编译规则
             precompile_rules()
             
-            # 初始化全局变量
-            message_cache = {}
-            last_message_times = defaultdict(int)
-            last_send_time = 0
-            followers_cache = set()
-            last_follow_check = 0
+            # 初始化全局变量（默认从状态存储恢复，重启后不会重放收件箱）
+            configure_message_cache()
+            reset_state()
+            configure_send_scheduler()
+            configure_poll_scheduler()
+            poll_scheduler.reset()
+            configure_delivery_verifier()
+            start_outbox()
+            start_push_ingest()
+            start_follower_sync()
+            start_follower_reconciler()
+            last_full_poll = 0.0
             
             last_cleanup = int(time.time())
             last_api_reset = int(time.time())
@@ -1311,7 +2335,7 @@ def monitor_messages():
                     
                     # 心跳检测 - 每60秒输出一次状态
                     if current_time - last_heartbeat >= 60:
-                        add_log(f"💓 系统运行正常: 处理{processed_count}条消息, 错误{error_count}次, 活跃会话{len(last_message_times)}个", 'info')
+                        add_log(f"💓 系统运行正常: 处理{processed_count}条消息, 送达{delivery_stats['sent']}条, 错误{error_count + delivery_stats['failed']}次, 活跃会话{len(last_message_times)}个, 已省去{message_fetch_stats['fetches_avoided']}次会话拉取", 'info')
                         last_heartbeat = current_time
                     
                     # 每5分钟强制清理缓存（更频繁清理）
@@ -1341,6 +2365,23 @@ def monitor_messages():
                         except Exception as e:
                             add_log(f"API重新初始化异常: {e}", 'warning')
                     
+                    # 推送通道可用时等待通知：有明确会话的通知只拉取这些会话，
+                    # 收到无法识别的通知或超过兜底间隔时才完整轮询会话列表
+                    if push_connected():
+                        notices = push_ingestor.wait(timeout=1.0)
+                        targeted = notices - {ANY_TALKER}
+                        if targeted:
+                            reply_count = process_push_notices(api, my_uid, targeted)
+                            processed_count += reply_count
+                            if reply_count > 0:
+                                add_log(f"📊 推送通知投递了 {reply_count} 条回复，总计处理 {processed_count} 条", 'info')
+                        full_poll_due = time.time() - last_full_poll >= float(config.get('push_full_poll_interval', 30.0))
+                        if ANY_TALKER not in notices and not full_poll_due and push_connected():
+                            handle_ai_timeouts()
+                            flush_state()
+                            continue
+                    last_full_poll = time.time()
+                    
                     # 获取会话列表 - 增加重试机制
                     sessions_data = None
                     for attempt in range(3):
@@ -1365,6 +2406,13 @@ def monitor_messages():
                         time.sleep(2)
                         continue
                     
+                    if sessions_data.get('code') == -412:
+                        # 会话列表被风控拦截，放宽轮询间隔
+                        poll_scheduler.on_rate_limited()
+                        add_log(f"🚫 获取会话列表触发频率限制，轮询间隔放宽到 {poll_scheduler.interval}秒", 'warning')
+                        time.sleep(poll_scheduler.delay())
+                        continue
+                    
                     if sessions_data.get('code') != 0:
                         error_msg = sessions_data.get('message', '未知错误')
                         add_log(f"API返回错误: {error_msg}", 'warning')
@@ -1383,59 +2431,20 @@ def monitor_messages():
                     
                     consecutive_errors = 0  # 重置连续错误计数
                     
-                    # 定期缓存清理，避免长时间运行内存负荷过大
-                    if current_time % 300 == 0:  # 每5分钟清理一次
-                        try:
-                            cleanup_cache()
-                            # 强制垃圾回收
-                            import gc
-                            gc.collect()
-                            add_log("定期缓存清理完成，内存优化", 'info')
-                        except Exception as e:
-                            add_log(f"定期缓存清理异常: {e}", 'warning')
-                    
                     # 初始化本轮回复计数
                     reply_count = 0
                     
-                    # 🎯 实时检测关注者变化（新关注和取消关注）
-                    if config.get('follow_reply_enabled', False) or config.get('unfollow_reply_enabled', False):
-                        try:
-                            followers_changes = check_followers_changes(api)
-                            
-                            # 处理新关注者
-                            for follower in followers_changes['new_followers']:
-                                if not monitoring:  # 检查是否仍在监控中
-                                    break
-                                try:
-                                    # 发送欢迎消息（会自动应用发送间隔控制）
-                                    if send_follow_welcome_message(api, follower):
-                                        welcome_sent_cache.add(follower['mid'])
-                                    reply_count += 1  # 计入回复统计
-                                    processed_count += 1
-                                except Exception as e:
-                                    add_log(f"处理新关注者异常: {e}", 'error')
-                                    error_count += 1
-                            
-                            # 处理取消关注者
-                            for unfollower in followers_changes['unfollowers']:
-                                if not monitoring:  # 检查是否仍在监控中
-                                    break
-                                try:
-                                    # 发送告别消息（会自动应用发送间隔控制）
-                                    send_unfollow_goodbye_message(api, unfollower)
-                                    reply_count += 1  # 计入回复统计
-                                    processed_count += 1
-                                except Exception as e:
-                                    add_log(f"处理取消关注者异常: {e}", 'error')
-                                    error_count += 1
-                                    
-                        except Exception as e:
-                            add_log(f"实时检测关注者变化异常: {e}", 'warning')
-                            error_count += 1
-                    
                     sessions = sessions_data.get('data', {}).get('session_list', [])
+                    
+                    # 用本轮会话列表快照批量确认已发送消息，超时未确认的投递定向核对任务
+                    if sessions:
+                        delivery_verifier.confirm_from_sessions(sessions)
+                    for verify_talker_id, msg_keys in delivery_verifier.collect_expired().items():
+                        enqueue_send('verify', {'talker_id': verify_talker_id, 'msg_keys': msg_keys})
+                    
                     if not sessions:
-                        time.sleep(0.2)
+                        poll_scheduler.on_idle()
+                        poll_wait(loop_start)
                         continue
                     
                     # 按最后消息时间排序
@@ -1453,14 +2462,22 @@ def monitor_messages():
                         last_msg_time = session.get('last_msg', {}).get('timestamp', 0)
                         recorded_time = last_message_times.get(talker_id, 0)
                         
+                        # 会话指纹未变化说明没有新动态，跳过处理
+                        fingerprint = session_fingerprint(session)
+                        fingerprint_changed = session_fingerprints.get(talker_id) != fingerprint
+                        session_fingerprints[talker_id] = fingerprint
+                        
                         # 检查有新消息的会话
-                        if last_msg_time > recorded_time:
+                        if last_msg_time > recorded_time and fingerprint_changed:
                             check_sessions.append(session)
                             debug_info.append(f"用户{talker_id}: 新消息 {last_msg_time} > {recorded_time}")
-                        # 或者最近5分钟内活跃的会话
-                        elif current_time - last_msg_time < 300:
+                        # 或者最近5分钟内活跃且有变化的会话
+                        elif current_time - last_msg_time < 300 and fingerprint_changed:
                             check_sessions.append(session)
                             debug_info.append(f"用户{talker_id}: 活跃会话 {current_time - last_msg_time}s前")
+                        elif current_time - last_msg_time < 300 or last_msg_time > recorded_time:
+                            message_fetch_stats['fetches_avoided'] += 1
+                            debug_info.append(f"用户{talker_id}: 指纹未变化，跳过")
                         else:
                             debug_info.append(f"用户{talker_id}: 跳过 {last_msg_time} <= {recorded_time}")
                     
@@ -1469,10 +2486,17 @@ def monitor_messages():
                         add_log(f"会话检查: {len(check_sessions)}/{len(sessions)} 个会话需要处理", 'debug')
                     
                     if not check_sessions:
-                        time.sleep(0.2)
+                        # 没有新动态：仍处理 AI 超时和状态写入，然后按退避后的间隔等待
+                        handle_ai_timeouts()
+                        flush_state()
+                        poll_scheduler.on_idle()
+                        poll_wait(loop_start)
                         continue
                     
-                    # 单线程顺序处理所有会话
+                    # 有新动态，回到最短轮询间隔
+                    poll_scheduler.on_activity()
+                    
+                    # 顺序检测所有会话，回复投递到发送队列，由发送线程异步发送
                     # reply_count 已在循环开始时初始化
                     
                     for session in check_sessions:
@@ -1483,88 +2507,27 @@ def monitor_messages():
                             results = process_single_session(api, my_uid, session)
                             
                             for result in results:
-                                # 发送回复（带发送成功验证）
-                                try:
-                                    reply_result = None
-                                    reply_content = result['rule']['reply']
-                                    
-                                    # 检查回复类型
-                                    reply_type = result['rule'].get('reply_type', 'text')
-                                    
-                                    if reply_type == 'image':
-                                        # 发送图片回复
-                                        image_path = result['rule'].get('reply_image', '')
-                                        if image_path and os.path.exists(image_path):
-                                            add_log(f"发送图片回复给用户 {result['talker_id']}: {os.path.basename(image_path)}", 'info')
-                                            reply_result = api.send_image_msg(result['talker_id'], image_path)
-                                            
-                                            # 如果图片发送失败，尝试发送备用文字回复
-                                            if not reply_result:
-                                                # 使用默认文字回复或通用回复
-                                                fallback_message = config.get('default_reply_message', '您好，感谢您的消息！')
-                                                add_log(f"图片发送失败，发送备用文字回复给用户 {result['talker_id']}: {fallback_message}", 'warning')
-                                                reply_result = api.send_msg(result['talker_id'], fallback_message)
-                                            reply_content = f"[图片] {os.path.basename(image_path)}"
-                                        else:
-                                            add_log(f"图片文件不存在，跳过回复用户 {result['talker_id']}", 'warning')
-                                            continue
-                                    else:
-                                        # 发送文字回复
-                                        reply_result = api.send_msg(result['talker_id'], content=result['rule']['reply'])
-                                    
-                                    if reply_result and reply_result.get('code') == 0:
-                                        # 验证发送是否真正成功（优化等待时间）
-                                        verification_wait = config.get('message_check_interval', 0.05) * 0.5
-                                        time.sleep(max(0.01, verification_wait))  # 动态调整验证等待时间
-                                        try:
-                                            verification_success = api.verify_message_sent(result['talker_id'], reply_content)
-                                        except Exception as e:
-                                            add_log(f"验证消息发送状态异常: {e}", 'warning')
-                                            verification_success = True  # 假设发送成功，避免卡住
-                                        
-                                        if verification_success:
-                                            add_log(f"✅ 已成功回复用户 {result['talker_id']} (规则: {result['rule']['title']}) 内容: {reply_content[:20]}...", 'success')
-                                            reply_count += 1
-                                            processed_count += 1
-                                        else:
-                                            add_log(f"⚠️ 用户 {result['talker_id']} 发送验证失败，消息可能未送达", 'warning')
-                                            error_count += 1
-                                        
-                                    elif reply_result and reply_result.get('code') == -412:
-                                        add_log(f"🚫 用户 {result['talker_id']} 触发频率限制: {reply_result.get('message', '')}", 'warning')
-                                        error_count += 1
-                                        
-                                    elif reply_result and reply_result.get('code') == -101:
-                                        add_log("🔐 登录状态失效，请重新配置登录信息", 'error')
-                                        monitoring = False
-                                        break
-                                        
-                                    else:
-                                        error_msg = reply_result.get('message', '未知错误') if reply_result else '网络错误'
-                                        error_code = reply_result.get('code', 'N/A') if reply_result else 'N/A'
-                                        add_log(f"❌ 回复用户 {result['talker_id']} 失败 [错误码:{error_code}]: {error_msg}", 'warning')
-                                        error_count += 1
-                                        
-                                except Exception as e:
-                                    add_log(f"💥 发送回复异常: {e}", 'error')
+                                # 投递回复到发送队列（发送与验证在发送线程中完成）
+                                if enqueue_send('reply', result):
+                                    reply_count += 1
+                                    processed_count += 1
+                                else:
                                     error_count += 1
                         
                         except Exception as e:
                             add_log(f"处理会话异常: {e}", 'error')
                             error_count += 1
                     
-                    # 每处理10轮后，强制清理一次缓存
-                    if processed_count > 0 and processed_count % 10 == 0:
-                        try:
-                            add_log(f"🔄 已处理{processed_count}条消息，执行缓存清理", 'info')
-                            cleanup_cache()
-                        except Exception as e:
-                            add_log(f"缓存清理异常: {e}", 'warning')
+                    # 超过截止时间的 AI 回复降级为默认回复
+                    reply_count += handle_ai_timeouts()
                     
                     # 记录处理结果和更新最后回复时间
                     if reply_count > 0:
-                        last_reply_time = int(time.time())  # 更新最后回复时间
-                        add_log(f"📊 本轮回复了 {reply_count} 条消息，总计处理 {processed_count} 条", 'info')
+                        add_log(f"📊 本轮投递了 {reply_count} 条回复，总计处理 {processed_count} 条", 'info')
+                    last_reply_time = max(last_reply_time, int(delivery_stats['last_sent_at']))
+                    
+                    # 批量持久化本轮的会话水位和去重记录
+                    flush_state()
                     
                     # 检查是否需要自动重启（可配置间隔）
                     current_time_check = int(time.time())
@@ -1582,18 +2545,9 @@ def monitor_messages():
                             try:
                                 add_log(f"尝试重启 ({restart_attempts}/{max_restart_attempts})", 'info')
                                 
-                                # 清理所有缓存和状态
-                                message_cache.clear()
-                                last_message_times.clear()
-                                last_send_time = 0
-                                followers_cache.clear()
-                                last_follow_check = 0
-                                unfollowers_cache.clear()
-                                follow_history.clear()
-                                
-                                # 强制垃圾回收
-                                import gc
-                                gc.collect()
+                                # 重置缓存和状态（默认保留持久化的会话水位与去重记录）
+                                flush_state(force=True)
+                                reset_state()
                                 
                                 # 等待一下让系统稳定
                                 time.sleep(1)
@@ -1659,11 +2613,8 @@ def monitor_messages():
                             monitoring = False
                             break
                     
-                    # 可配置循环间隔 - 实现快速响应
-                    elapsed = time.time() - loop_start
-                    check_interval = config.get('message_check_interval', 0.05)
-                    sleep_time = max(0.01, check_interval - elapsed)
-                    time.sleep(sleep_time)
+                    # 自适应循环间隔 - 有新消息时快速响应，空闲时退避（推送通道可用时由通知唤醒）
+                    poll_wait(loop_start)
                     
                 except KeyboardInterrupt:
                     add_log("收到停止信号", 'warning')
@@ -1696,8 +2647,10 @@ def monitor_messages():
             else:
                 break
     
-    # 确保监控状态正确设置
+    # 确保监控状态正确设置；认证失效、重启失败等非 /api/stop 的退出同样停止后台线程
     monitoring = False
+    if monitor_thread is None or monitor_thread is threading.current_thread():
+        stop_monitor_workers()
 
 # 获取应用根目录
 def get_app_root():
@@ -1810,7 +2763,11 @@ def handle_rules():
         save_rules()
         precompile_rules()
         add_log("私信关键词规则已更新并预编译完成", 'success')
-        return jsonify({'success': True})
+        invalid_patterns = [
+            {'rule': rules[rule_id].get('name', f'规则{rule_id+1}'), 'error': error}
+            for rule_id, _, error in rule_matcher.errors
+        ]
+        return jsonify({'success': True, 'invalid_patterns': invalid_patterns})
     else:
         return jsonify({'rules': rules})
 
@@ -1834,15 +2791,8 @@ def start_monitoring():
     monitoring = False  # 先设为False，避免竞态条件
     monitor_thread = None
     
-    # 清理全局状态
-    global message_cache, last_message_times, last_send_time, followers_cache, last_follow_check, unfollowers_cache, follow_history
-    message_cache = {}
-    last_message_times = defaultdict(int)
-    last_send_time = 0
-    followers_cache = set()
-    last_follow_check = 0
-    unfollowers_cache = set()
-    follow_history = {}
+    # 清理全局状态（状态恢复在监控线程启动时进行）
+    session_fingerprints.clear()
     
     # 重置程序启动时间（用于仅回复新消息功能）
     program_start_time = int(time.time())
@@ -1878,6 +2828,8 @@ def stop_monitoring():
     # 清理线程引用
     monitor_thread = None
     
+    stop_monitor_workers()
+    
     return jsonify({'success': True})
 
 @app.route('/api/status')
@@ -1897,9 +2849,43 @@ def get_status():
     return jsonify({
         'monitoring': actual_monitoring,
         'rules_count': len(rules),
-        'config_set': bool(config.get('sessdata') and config.get('bili_jct'))
+        'config_set': bool(config.get('sessdata') and config.get('bili_jct')),
+        'message_fetch_stats': dict(message_fetch_stats),
+        'identity_cache_stats': BilibiliAPI.get_identity_cache_stats(),
+        'rule_matcher': rule_matcher.stats(),
+        'message_dedupe': message_cache.stats(),
+        'state_store': state_store.stats() if state_store else None,
+        'upload_cache': upload_cache.stats() if upload_cache else None,
+        'ai_pipeline': ai_pipeline.stats() if ai_pipeline else None,
+        'ai_adapter': ai_agent.stats() if hasattr(ai_agent, 'stats') else None,
+        'send_scheduler': send_scheduler.stats(),
+        'polling': poll_scheduler.stats(),
+        'push_ingest': push_ingestor.stats() if push_ingestor else None,
+        'follower_checks': dict(follower_check_stats, thread_alive=bool(follower_sync_thread and follower_sync_thread.is_alive())),
+        'follower_reconciler': follower_reconciler.stats() if follower_reconciler else None,
+        'outbox': outbox.stats() if outbox else None,
+        'delivery_stats': dict(delivery_stats),
+        'delivery_verifier': delivery_verifier.stats()
     })
 
+@app.route('/api/send-reply', methods=['POST'])
+def send_manual_reply():
+    """手动发送一条文字回复：投递到运行中的发送队列，与监控共用发送限速（send_ai_reply.py 使用）"""
+    data = request.get_json(silent=True) or {}
+    message = str(data.get('message') or '').strip()
+    try:
+        talker_id = int(data.get('talker_id'))
+    except (TypeError, ValueError):
+        talker_id = 0
+    if talker_id <= 0 or not message:
+        return jsonify({'success': False, 'error': '缺少 talker_id 或 message'})
+    if outbox is None or not outbox.is_running():
+        return jsonify({'success': False, 'error': '监控未运行', 'monitoring': False})
+    result = {'talker_id': talker_id, 'rule': {'title': '手动发送', 'reply': message, 'reply_type': 'text'}}
+    if not enqueue_send('reply', result):
+        return jsonify({'success': False, 'error': '发送队列已满', 'monitoring': True})
+    return jsonify({'success': True, 'queued': True})
+
 @app.route('/api/logs', methods=['GET', 'DELETE'])
 def handle_logs():
     """处理日志接口"""
@@ -2321,6 +3307,8 @@ def handle_timing_config():
                 return jsonify({'success': False, 'error': '自动重启间隔必须是有效的数字'})
         
         save_config()
+        configure_send_scheduler()
+        configure_poll_scheduler()
         add_log("时间间隔配置已更新", 'success')
         return jsonify({'success': True})
     else:
@@ -2480,6 +3468,10 @@ def import_config():
                     invalid_count += 1
                     continue
                 
+                if rule.get('use_regex', False) and pattern_error(rule.get('keyword', '').strip()):
+                    invalid_count += 1
+                    continue
+                
                 # 标准化规则格式
                 standardized_rule = {
                     'id': rule.get('id', int(time.time() * 1000) + i),
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+关键词匹配性能对比：原逐条规则匹配 vs Aho-Corasick 自动机
+用法: python bench_keyword_matcher.py [消息条数]
+"""
+
+import random
+import sys
+import time
+
+from keyword_matcher import build_keyword_automaton
+
+KEYWORDS_PER_RULE = 10
+MESSAGE_LENGTH = 40
+CHARSET = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可也你'
+
+
+def legacy_match(rule_keywords, message):
+    """原 check_keywords_fast 的逐条规则匹配逻辑（每次调用都重新排序）"""
+    for rule_id, keywords in rule_keywords.items():
+        for keyword in sorted(keywords, key=len, reverse=True):
+            if keyword and keyword in message:
+                return rule_id
+    return None
+
+
+def make_rules(rng, keyword_count):
+    rule_keywords = {}
+    for i in range(keyword_count):
+        rule_id = i // KEYWORDS_PER_RULE
+        keyword = ''.join(rng.choice(CHARSET) for _ in range(rng.randint(3, 6)))
+        rule_keywords.setdefault(rule_id, []).append(keyword)
+    return rule_keywords
+
+
+def make_messages(rng, rule_keywords, count):
+    all_keywords = [kw for keywords in rule_keywords.values() for kw in keywords]
+    messages = []
+    for i in range(count):
+        text = ''.join(rng.choice(CHARSET) for _ in range(MESSAGE_LENGTH))
+        # 一半消息嵌入一个随机关键词，另一半大概率不命中
+        if i % 2 == 0:
+            pos = rng.randint(0, MESSAGE_LENGTH)
+            text = text[:pos] + rng.choice(all_keywords) + text[pos:]
+        messages.append(text)
+    return messages
+
+
+def timed(func, messages):
+    started = time.perf_counter()
+    results = [func(message) for message in messages]
+    return (time.perf_counter() - started) / len(messages), results
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rng = random.Random(2024)
+
+    print(f"{'关键词数':>8} {'编译(ms)':>10} {'原匹配(us/条)':>14} {'自动机(us/条)':>14} {'加速比':>8}")
+    for keyword_count in (100, 1000, 10000):
+        rule_keywords = make_rules(rng, keyword_count)
+        messages = make_messages(rng, rule_keywords, message_count)
+
+        started = time.perf_counter()
+        automaton = build_keyword_automaton(rule_keywords)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        legacy_time, legacy_results = timed(lambda m: legacy_match(rule_keywords, m), messages)
+        new_time, new_results = timed(lambda m: (automaton.search(m) or (None,))[0], messages)
+        assert legacy_results == new_results, "匹配结果不一致"
+
+        print(f"{keyword_count:>8} {compile_ms:>10.1f} {legacy_time * 1e6:>14.1f} {new_time * 1e6:>14.1f} {legacy_time / new_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
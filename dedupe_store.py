@@ -0,0 +1,133 @@
+"""
+消息去重存储 - 带 TTL 与容量上限的有序字典
+职责：记录已处理过的消息 ID，O(1) 插入与查询；
+     条目按插入顺序排列，过期清理只需从队头弹出，均摊 O(1)，无需全量重建或强制 GC
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+
+class DedupeStore:
+    """有界 TTL/FIFO 去重集合
+
+    所有条目使用相同的 TTL，因此插入顺序即过期顺序：有序字典的队头永远是最早过期的条目，
+    它本身就是一个单槽位的时间轮。超出容量时按先进先出淘汰最早插入的条目；
+    重复命中不会延长 TTL，也不会调整条目位置，以保持插入顺序与过期顺序一致
+    """
+
+    def __init__(self, ttl: float = 900.0, capacity: int = 2000, clock: Callable[[], float] = time.monotonic):
+        """
+        初始化去重存储
+
+        Args:
+            ttl: 条目保留时间（秒）
+            capacity: 最多保留的条目数
+            clock: 时钟函数（便于测试注入）
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {key: 过期时间}
+        self._stats = {'inserts': 0, 'duplicates': 0, 'expired': 0, 'evicted': 0, 'restored': 0}
+
+    def add(self, key: Hashable) -> bool:
+        """
+        记录一个键
+
+        Returns:
+            True 表示首次出现（已记录），False 表示重复
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire_locked(now)
+            expires_at = self._entries.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._stats['duplicates'] += 1
+                    return False
+                # TTL 调小后可能残留在队列中部的过期条目
+                del self._entries[key]
+                self._stats['expired'] += 1
+
+            self._entries[key] = now + self.ttl
+            self._stats['inserts'] += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+            return True
+
+    def restore(self, key: Hashable, age: float) -> bool:
+        """
+        恢复一条已持久化的记录（应按记录时间从早到晚调用，保持过期顺序）
+
+        Args:
+            key: 记录的键
+            age: 记录至今已过去的秒数
+
+        Returns:
+            是否恢复（已过期的记录会被忽略）
+        """
+        if age >= self.ttl:
+            return False
+        with self._lock:
+            self._entries[key] = self._clock() + self.ttl - max(age, 0.0)
+            self._entries.move_to_end(key)
+            self._stats['restored'] += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+            return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            expires_at = self._entries.get(key)
+            return expires_at is not None and expires_at > self._clock()
+
+    def expire(self) -> int:
+        """清理已过期的条目，返回清理数量"""
+        with self._lock:
+            return self._expire_locked(self._clock())
+
+    def _expire_locked(self, now: float) -> int:
+        entries = self._entries
+        removed = 0
+        while entries:
+            key, expires_at = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            del entries[key]
+            removed += 1
+        self._stats['expired'] += removed
+        return removed
+
+    def configure(self, ttl: float = None, capacity: int = None):
+        """更新 TTL 与容量（已有条目的过期时间不变，超出新容量的部分立即淘汰）"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if capacity is not None:
+                self.capacity = capacity
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+                    self._stats['evicted'] += 1
+
+    def clear(self):
+        """清空所有条目"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """获取去重统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['capacity'] = self.capacity
+            stats['ttl'] = self.ttl
+            return stats
@@ -0,0 +1,192 @@
+"""
+送达验证 - 延迟批量确认
+职责：记录已发送消息的 msg_key，优先通过后续的会话列表快照批量确认送达
+     （会话最后一条消息是已发送的消息，或晚于发送时间，即对方已回复或我们又连发了一条）；
+     超过期限仍未确认的消息才按会话定向拉取一次进行核对，避免每条回复都额外请求
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class PendingDelivery:
+    """待确认的已发送消息"""
+
+    __slots__ = ('msg_key', 'talker_id', 'content', 'sent_at', 'sent_ts', 'deadline', 'fetching')
+
+    def __init__(self, msg_key: Hashable, talker_id: Hashable, content: str, sent_at: float, deadline: float,
+                 sent_ts: int = 0):
+        self.msg_key = msg_key
+        self.talker_id = talker_id
+        self.content = content
+        self.sent_at = sent_at
+        self.sent_ts = sent_ts  # 发送时的墙钟时间（秒），与会话消息的 timestamp 比较
+        self.deadline = deadline
+        self.fetching = False
+
+
+class DeliveryVerifier:
+    """已发送消息的延迟批量验证"""
+
+    def __init__(
+        self,
+        deadline: float = 10.0,
+        sample_rate: float = 1.0,
+        max_pending: int = 1000,
+        clock: Callable[[], float] = time.monotonic,
+        rand: Callable[[], float] = random.random,
+        wall_clock: Callable[[], float] = time.time
+    ):
+        """
+        初始化送达验证器
+
+        Args:
+            deadline: 发送后多少秒仍未在会话快照中确认则定向拉取核对
+            sample_rate: 验证抽样比例（0~1），1 表示验证全部消息
+            max_pending: 最多同时等待确认的消息数，超出时丢弃最早的记录
+            clock: 时钟函数（便于测试注入）
+            rand: 随机数函数（便于测试注入）
+            wall_clock: 墙钟函数，记录发送时间用于与会话消息时间比较（便于测试注入）
+        """
+        self.deadline = deadline
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self._clock = clock
+        self._rand = rand
+        self._wall_clock = wall_clock
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # {msg_key: PendingDelivery}
+        self._stats = {
+            'tracked': 0, 'sampled_out': 0, 'untracked': 0,
+            'confirmed_snapshot': 0, 'confirmed_fetch': 0, 'failed': 0, 'evicted': 0, 'fetches': 0,
+            'fetch_errors': 0, 'unverifiable': 0
+        }
+
+    def track(self, msg_key: Optional[Hashable], talker_id: Hashable, content: str = '') -> bool:
+        """登记一条已发送消息，返回是否纳入验证"""
+        with self._lock:
+            if not msg_key:
+                self._stats['untracked'] += 1
+                return False
+            if self.sample_rate < 1.0 and self._rand() >= self.sample_rate:
+                self._stats['sampled_out'] += 1
+                return False
+
+            now = self._clock()
+            self._pending[msg_key] = PendingDelivery(msg_key, talker_id, content, now, now + self.deadline,
+                                                     int(self._wall_clock()))
+            self._stats['tracked'] += 1
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self._stats['evicted'] += 1
+            return True
+
+    def confirm_from_sessions(self, sessions: Iterable[dict]) -> int:
+        """
+        用会话列表快照确认送达，返回确认数量
+
+        会话 last_msg 的 msg_key 是某条待确认消息时，该消息及同一会话更早发送的消息全部确认（连发文字和图片时
+        只有最后一条会出现在快照中）；last_msg 的时间不早于发送时间（对方已回复）时，该会话的待确认消息全部确认
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+            last_msgs = {}
+            matched = {}  # {talker_id: 快照中出现的最后一条已发送消息的发送时间}
+            for session in sessions:
+                last_msg = session.get('last_msg') or {}
+                last_msgs[session.get('talker_id')] = last_msg
+                pending = self._pending.get(last_msg.get('msg_key')) if last_msg.get('msg_key') else None
+                if pending is not None:
+                    matched[pending.talker_id] = pending.sent_at
+
+            confirmed = 0
+            for msg_key, pending in list(self._pending.items()):
+                last_msg = last_msgs.get(pending.talker_id)
+                if last_msg is None:
+                    continue
+                timestamp = last_msg.get('timestamp') or 0
+                if (pending.sent_at <= matched.get(pending.talker_id, float('-inf'))
+                        or (timestamp and pending.sent_ts and timestamp >= pending.sent_ts)):
+                    del self._pending[msg_key]
+                    confirmed += 1
+            self._stats['confirmed_snapshot'] += confirmed
+            return confirmed
+
+    def collect_expired(self) -> Dict[Hashable, List[Hashable]]:
+        """取出已超过期限、需要定向拉取核对的消息，按会话分组 {talker_id: [msg_key, ...]}"""
+        with self._lock:
+            now = self._clock()
+            expired = {}
+            for msg_key, pending in list(self._pending.items()):
+                if pending.fetching:
+                    # 定向核对任务丢失时，超过三倍期限直接判定失败
+                    if now - pending.sent_at > self.deadline * 3:
+                        del self._pending[msg_key]
+                        self._stats['failed'] += 1
+                    continue
+                if pending.deadline <= now:
+                    pending.fetching = True
+                    expired.setdefault(pending.talker_id, []).append(msg_key)
+            return expired
+
+    def confirm_from_messages(self, talker_id: Hashable, msg_keys: Iterable[Hashable], messages: Optional[List[dict]]) -> Tuple[List[PendingDelivery], List[PendingDelivery]]:
+        """
+        用定向拉取到的会话消息核对送达
+
+        Args:
+            talker_id: 会话对象 ID
+            msg_keys: 需要核对的 msg_key
+            messages: 拉取到的消息列表，拉取失败时为 None（消息重新等待下次核对，不判定未送达；
+                      距发送超过三倍期限仍无法核对的消息不再跟踪，计入 unverifiable）
+
+        Returns:
+            (已确认列表, 未送达列表)
+        """
+        if messages is None:
+            with self._lock:
+                self._stats['fetch_errors'] += 1
+                now = self._clock()
+                for msg_key in msg_keys:
+                    pending = self._pending.get(msg_key)
+                    if pending is None:
+                        continue
+                    if now - pending.sent_at > self.deadline * 3:
+                        del self._pending[msg_key]
+                        self._stats['unverifiable'] += 1
+                    else:
+                        pending.fetching = False
+                        pending.deadline = now + self.deadline
+            return [], []
+
+        seen_keys = {msg.get('msg_key') for msg in messages}
+        confirmed, failed = [], []
+        with self._lock:
+            self._stats['fetches'] += 1
+            for msg_key in msg_keys:
+                pending = self._pending.pop(msg_key, None)
+                if pending is None:
+                    continue
+                if msg_key in seen_keys:
+                    confirmed.append(pending)
+                else:
+                    failed.append(pending)
+            self._stats['confirmed_fetch'] += len(confirmed)
+            self._stats['failed'] += len(failed)
+        return confirmed, failed
+
+    def clear(self):
+        """清空待确认记录"""
+        with self._lock:
+            self._pending.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """获取验证统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+            stats['sample_rate'] = self.sample_rate
+            return stats
@@ -0,0 +1,369 @@
+"""
+关注者存储 - 紧凑有序整数集合与全量对账
+职责：用有序 uint64 数组（每个关注者 8 字节）保存完整关注者集合并持久化到磁盘；
+     后台按请求预算逐页拉取关注者列表（游标可续传），每轮拉取完成后与上一轮集合做向量化差集，
+     得到新增与取消关注的用户。安装 numpy 时使用 numpy 计算，否则使用有序数组归并
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from rate_limiter import TokenBucket
+
+try:
+    import numpy as np  # 可选依赖，用于向量化去重与差集
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+_MAGIC = b'BGFS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHI')  # 魔数、版本、元数据长度
+
+
+def sorted_unique(values: Iterable[int]) -> array:
+    """排序去重，返回 uint64 数组"""
+    if NUMPY_AVAILABLE:
+        data = values if isinstance(values, array) else array('Q', values)
+        if not data:
+            return array('Q')
+        return array('Q', np.unique(np.frombuffer(data, dtype=np.uint64)).tobytes())
+    return array('Q', sorted(set(values)))
+
+
+def diff_sorted(old: array, new: array) -> Tuple[array, array]:
+    """
+    比较两个有序去重的 uint64 数组
+
+    Returns:
+        (new 中新增的元素, old 中被移除的元素)
+    """
+    if NUMPY_AVAILABLE:
+        old_np = np.frombuffer(old, dtype=np.uint64) if old else np.empty(0, dtype=np.uint64)
+        new_np = np.frombuffer(new, dtype=np.uint64) if new else np.empty(0, dtype=np.uint64)
+        added = np.setdiff1d(new_np, old_np, assume_unique=True)
+        removed = np.setdiff1d(old_np, new_np, assume_unique=True)
+        return array('Q', added.tobytes()), array('Q', removed.tobytes())
+
+    # 有序数组归并，一次线性扫描
+    added, removed = array('Q'), array('Q')
+    i = j = 0
+    while i < len(old) and j < len(new):
+        if old[i] == new[j]:
+            i += 1
+            j += 1
+        elif old[i] < new[j]:
+            removed.append(old[i])
+            i += 1
+        else:
+            added.append(new[j])
+            j += 1
+    removed.extend(old[i:])
+    added.extend(new[j:])
+    return added, removed
+
+
+def union_sorted(a: array, b: array) -> array:
+    """合并两个有序去重的 uint64 数组"""
+    if not b:
+        return array('Q', a)
+    if not a:
+        return array('Q', b)
+    return sorted_unique(a + b)
+
+
+class FollowerSet:
+    """有序 uint64 数组表示的不可变用户集合（成员查询为二分查找）"""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data: Optional[array] = None):
+        self._data = data if data is not None else array('Q')
+
+    @classmethod
+    def from_iterable(cls, values: Iterable[int]) -> 'FollowerSet':
+        return cls(sorted_unique(values))
+
+    @property
+    def data(self) -> array:
+        return self._data
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) * self._data.itemsize
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __contains__(self, mid: int) -> bool:
+        if not isinstance(mid, int) or mid < 0:
+            return False
+        index = bisect_left(self._data, mid)
+        return index < len(self._data) and self._data[index] == mid
+
+    def diff(self, other: 'FollowerSet') -> Tuple[array, array]:
+        """与更新的集合比较，返回 (新增, 移除)"""
+        return diff_sorted(self._data, other._data)
+
+
+class FollowerReconciler:
+    """关注者全量对账
+
+    按关注时间倒序逐页拉取关注者列表，拉取到不足一页时本轮结束。
+    拉取过程中有人取消关注会让后续页前移，可能漏掉页边界上的用户，
+    因此 confirm_removals 为 True 时，用户需连续两轮缺失才确认取消关注。
+    达到 max_pages 而截断的一轮不是完整集合，只报告新增用户，不计算取消关注
+    """
+
+    def __init__(
+        self,
+        fetch_page: Callable[[int, int], Optional[List[int]]],
+        path: Optional[str] = None,
+        page_size: int = 50,
+        requests_per_minute: float = 6.0,
+        max_pages: int = 0,
+        confirm_removals: bool = True,
+        persist_every: int = 10,
+        max_errors: int = 3,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        初始化全量对账器
+
+        Args:
+            fetch_page: 拉取一页关注者 fetch_page(page, page_size)，返回用户 ID 列表，失败返回 None
+            path: 持久化文件路径，None 表示不持久化
+            page_size: 每页数量
+            requests_per_minute: 每分钟最多请求数（请求预算）
+            max_pages: 每轮最多拉取的页数，0 表示不限制（截断的一轮只报告新增）
+            confirm_removals: 是否要求连续两轮缺失才确认取消关注
+            persist_every: 每拉取多少页持久化一次进度（重启后从该进度续传）
+            max_errors: 同一页连续失败多少次后放弃本轮（从第一页重新开始）
+            clock: 时钟函数（便于测试注入）
+        """
+        self._fetch_page = fetch_page
+        self.path = path
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.confirm_removals = confirm_removals
+        self.persist_every = max(1, persist_every)
+        self.max_errors = max_errors
+        self._clock = clock
+        self._budget = TokenBucket(requests_per_minute / 60.0, 1, clock())
+        self._lock = threading.Lock()
+        self._snapshot = None  # 上一轮完成的 FollowerSet，None 表示尚未完成过
+        self._pending = array('Q')  # 上一轮缺失、待确认取消关注的用户
+        self._crawl = array('Q')  # 本轮已拉取的用户（未排序）
+        self._cursor = 1  # 下一次拉取的页码
+        self._errors = 0
+        self._crawl_started = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'pages': 0, 'crawls': 0, 'errors': 0, 'aborted': 0, 'capped': 0, 'added': 0, 'removed': 0, 'last_crawl_seconds': 0.0}
+
+    @property
+    def snapshot(self) -> Optional[FollowerSet]:
+        """最近一轮完成的关注者集合"""
+        return self._snapshot
+
+    def configure(self, requests_per_minute: float = None, page_size: int = None, max_pages: int = None):
+        """更新请求预算与拉取参数"""
+        with self._lock:
+            if requests_per_minute is not None:
+                self._budget.rate = requests_per_minute / 60.0
+            if page_size is not None:
+                self.page_size = page_size
+            if max_pages is not None:
+                self.max_pages = max_pages
+
+    def time_until_next(self) -> float:
+        """距离下一次允许请求还需等待的秒数"""
+        with self._lock:
+            return self._budget.time_until_available(self._clock())
+
+    def step(self) -> Optional[Dict[str, List[int]]]:
+        """
+        在请求预算内拉取一页
+
+        Returns:
+            本轮拉取完成时返回 {'added': [...], 'removed': [...]}（首轮只建立基线，两者均为空），
+            否则返回 None
+        """
+        with self._lock:
+            now = self._clock()
+            if self._budget.time_until_available(now) > 0:
+                return None
+            self._budget.consume(now)
+            page = self._cursor
+            if self._crawl_started is None:
+                self._crawl_started = now
+
+        mids = self._fetch_page(page, self.page_size)
+
+        with self._lock:
+            if mids is None:
+                self._stats['errors'] += 1
+                self._errors += 1
+                if self._errors >= self.max_errors:
+                    # 放弃本轮，避免用残缺结果计算出大量误判的取消关注
+                    self._stats['aborted'] += 1
+                    self._reset_crawl_locked()
+                return None
+
+            self._errors = 0
+            self._stats['pages'] += 1
+            self._crawl.extend(mid for mid in mids if mid and mid > 0)
+            self._cursor += 1
+            complete = len(mids) < self.page_size
+            capped = not complete and bool(self.max_pages) and page >= self.max_pages
+            if not (complete or capped):
+                if self._stats['pages'] % self.persist_every == 0:
+                    self._save_locked()
+                return None
+            result = self._finish_crawl_locked(complete)
+            self._save_locked()
+            return result
+
+    def _finish_crawl_locked(self, complete: bool) -> Dict[str, List[int]]:
+        current = FollowerSet(sorted_unique(self._crawl))
+        self._stats['crawls'] += 1
+        if not complete:
+            self._stats['capped'] += 1
+        self._stats['last_crawl_seconds'] = round(self._clock() - self._crawl_started, 1)
+        previous = self._snapshot
+        self._reset_crawl_locked()
+
+        if previous is None:
+            # 首轮只建立基线
+            self._snapshot = current
+            return {'added': [], 'removed': []}
+
+        added, removed = previous.diff(current)
+        if not complete:
+            # 截断的一轮没拉到的用户不代表已取消关注，只合并新增，待确认列表保持不变
+            self._snapshot = FollowerSet(union_sorted(previous.data, current.data))
+            self._stats['added'] += len(added)
+            return {'added': added.tolist(), 'removed': []}
+
+        if self.confirm_removals:
+            # 连续两轮缺失才确认；本轮首次缺失的用户暂时保留在集合中
+            newly_missing, _ = diff_sorted(self._pending, removed)
+            confirmed, _ = diff_sorted(newly_missing, removed)
+            self._pending = newly_missing
+            self._snapshot = FollowerSet(union_sorted(current.data, self._pending))
+        else:
+            confirmed = removed
+            self._snapshot = current
+
+        self._stats['added'] += len(added)
+        self._stats['removed'] += len(confirmed)
+        return {'added': added.tolist(), 'removed': confirmed.tolist()}
+
+    def _reset_crawl_locked(self):
+        self._crawl = array('Q')
+        self._cursor = 1
+        self._errors = 0
+        self._crawl_started = None
+
+    def save(self):
+        """立即持久化集合与拉取进度"""
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        if not self.path:
+            return
+        snapshot = self._snapshot.data if self._snapshot is not None else array('Q')
+        meta = json.dumps({
+            'has_snapshot': self._snapshot is not None,
+            'cursor': self._cursor,
+            'sizes': [len(snapshot), len(self._pending), len(self._crawl)]
+        }).encode('utf-8')
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(meta)))
+            f.write(meta)
+            for data in (snapshot, self._pending, self._crawl):
+                data.tofile(f)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        """从持久化文件恢复集合与拉取进度（文件不存在或格式不符时返回 False）"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return False
+            magic, version, meta_size = _HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION:
+                return False
+            meta = json.loads(f.read(meta_size).decode('utf-8'))
+            arrays = []
+            for size in meta['sizes']:
+                data = array('Q')
+                data.fromfile(f, size)
+                arrays.append(data)
+        with self._lock:
+            snapshot, self._pending, self._crawl = arrays
+            self._snapshot = FollowerSet(snapshot) if meta['has_snapshot'] else None
+            self._cursor = meta['cursor']
+            self._crawl_started = self._clock() if self._crawl else None
+        return True
+
+    def start(self, on_diff: Callable[[List[int], List[int]], None], name: str = 'follower-reconciler'):
+        """
+        启动后台对账线程
+
+        Args:
+            on_diff: 每轮拉取完成后的回调 (新增用户, 确认取消关注的用户)
+            name: 线程名
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    result = self.step()
+                    if result and (result['added'] or result['removed']):
+                        on_diff(result['added'], result['removed'])
+                except Exception:
+                    with self._lock:
+                        self._stats['errors'] += 1
+                self._stop.wait(max(0.05, self.time_until_next()))
+
+        self._thread = threading.Thread(target=run, name=name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 3.0):
+        """停止后台线程并保存进度"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取对账统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['followers'] = len(self._snapshot) if self._snapshot is not None else 0
+            stats['memory_kb'] = round(((self._snapshot.nbytes if self._snapshot is not None else 0)
+                                        + (len(self._pending) + len(self._crawl)) * 8) / 1024, 1)
+            stats['pending_removals'] = len(self._pending)
+            stats['crawl_page'] = self._cursor
+            stats['crawl_collected'] = len(self._crawl)
+            stats['numpy'] = NUMPY_AVAILABLE
+            return stats
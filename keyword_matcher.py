@@ -0,0 +1,281 @@
+"""
+关键词匹配器 - Aho-Corasick 多模式自动机 + 合并正则
+职责：把所有规则的关键词编译成一个自动机，一次扫描消息即可找出命中的规则；
+     正则规则（use_regex）在预编译时合并为一个模式，一次匹配即可知道哪条规则命中；
+     保持原有语义：按规则顺序第一条命中的规则胜出，同一规则内优先报告最长的关键词
+"""
+
+import re
+import time
+from collections import deque
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+# 数字反向引用在合并后组号会偏移，含有它的模式不能直接合并
+_NUMERIC_BACKREF = re.compile(r'\\[1-9]')
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 多模式匹配自动机
+
+    每个关键词关联一个规则 ID 和优先级（越小越优先），search 返回一次扫描中
+    优先级最高的规则；同一规则命中多个关键词时报告最长的那个
+    """
+
+    def __init__(self):
+        self._goto = [{}]  # 状态转移表 [{字符: 状态}]
+        self._fail = [0]
+        # 每个状态（含失败链）上的最佳命中：(优先级, -关键词长度, 规则ID, 关键词)
+        self._best = [None]
+        self._top_hit = None
+        self._built = False
+        self.keyword_count = 0
+
+    def add(self, keyword: str, rule_id: Hashable, priority: int):
+        """添加关键词（需在 build 之前调用）"""
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            state = next_state
+
+        candidate = (priority, -len(keyword), rule_id, keyword)
+        if self._best[state] is None or candidate < self._best[state]:
+            self._best[state] = candidate
+        self.keyword_count += 1
+        self._built = False
+
+    def build(self):
+        """计算失败链接，并把失败链上的最佳命中合并到每个状态"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail_state = self._goto[fallback].get(char, 0)
+                if fail_state == next_state:
+                    fail_state = 0
+                self._fail[next_state] = fail_state
+
+                inherited = self._best[fail_state]
+                if inherited is not None and (self._best[next_state] is None or inherited < self._best[next_state]):
+                    self._best[next_state] = inherited
+
+        hits = [hit[:2] for hit in self._best if hit is not None]
+        self._top_hit = min(hits) if hits else None
+        self._built = True
+
+    def search(self, text: str) -> Optional[Tuple[Hashable, str]]:
+        """
+        扫描文本
+
+        Returns:
+            (规则ID, 命中的关键词)，未命中返回 None
+        """
+        if not self._built:
+            self.build()
+
+        goto = self._goto
+        fail = self._fail
+        best_table = self._best
+        best = None
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            hit = best_table[state]
+            if hit is not None and (best is None or hit < best):
+                best = hit
+                # 已命中可能的最佳结果（最高优先级规则的最长关键词）时无需继续扫描
+                if hit[:2] == self._top_hit:
+                    break
+        if best is None:
+            return None
+        return best[2], best[3]
+
+    def __len__(self):
+        return self.keyword_count
+
+
+def build_keyword_automaton(rule_keywords: Dict[Hashable, List[str]]) -> KeywordAutomaton:
+    """按规则顺序（字典插入顺序）构建关键词自动机"""
+    automaton = KeywordAutomaton()
+    for priority, (rule_id, keywords) in enumerate(rule_keywords.items()):
+        for keyword in keywords:
+            automaton.add(keyword, rule_id, priority)
+    automaton.build()
+    return automaton
+
+
+def pattern_error(pattern: str) -> Optional[str]:
+    """检查正则表达式是否有效，无效时返回错误信息"""
+    if not pattern:
+        return "正则表达式为空"
+    try:
+        re.compile(pattern, re.IGNORECASE)
+    except (re.error, RecursionError, OverflowError) as e:
+        return str(e)
+    return None
+
+
+class RuleMatcher:
+    """规则匹配器
+
+    字面量规则走关键词自动机快速路径；正则规则合并为一个按规则顺序排列的
+    前瞻分支模式 (?=.*?(?P<_rN>模式))|...，一次 match 即可得到顺序最靠前的正则规则。
+    两类结果按规则顺序比较，第一条命中的规则胜出。规则数据与匹配结构打包在同一个
+    对象里，整体替换时匹配线程不会看到不一致的状态
+    """
+
+    def __init__(self):
+        self.rules = {}  # {规则ID: 规则数据}
+        self.errors = []  # [(规则ID, 模式, 错误信息)]
+        self._priority = {}  # {规则ID: 规则顺序}
+        self._automaton = KeywordAutomaton()
+        self._patterns = []  # [(规则ID, 模式, 已编译模式)]
+        self._combined = None
+        self._group_rules = {}  # {合并模式中的组号: 规则ID}
+        self._first_regex_priority = None
+        self._stats = {
+            'literal': {'rules': 0, 'compile_ms': 0.0, 'matches': 0, 'hits': 0, 'match_seconds': 0.0},
+            'regex': {'rules': 0, 'compile_ms': 0.0, 'matches': 0, 'hits': 0, 'match_seconds': 0.0},
+        }
+
+    def add_literal(self, rule_id: Hashable, keywords: List[str], data: Any = None):
+        """添加字面量关键词规则（关键词应已转为小写）"""
+        started = time.perf_counter()
+        self._register(rule_id, data)
+        for keyword in keywords:
+            self._automaton.add(keyword, rule_id, self._priority[rule_id])
+        self._stats['literal']['rules'] += 1
+        self._stats['literal']['compile_ms'] += (time.perf_counter() - started) * 1000
+
+    def add_regex(self, rule_id: Hashable, pattern: str, data: Any = None) -> Optional[str]:
+        """
+        添加正则规则（忽略大小写匹配）
+
+        Returns:
+            模式无效时返回错误信息（规则不会被加入），否则返回 None
+        """
+        started = time.perf_counter()
+        error = pattern_error(pattern)
+        if error:
+            self.errors.append((rule_id, pattern, error))
+            return error
+
+        self._register(rule_id, data)
+        self._patterns.append((rule_id, pattern, re.compile(pattern, re.IGNORECASE)))
+        if self._first_regex_priority is None:
+            self._first_regex_priority = self._priority[rule_id]
+        self._stats['regex']['rules'] += 1
+        self._stats['regex']['compile_ms'] += (time.perf_counter() - started) * 1000
+        return None
+
+    def _register(self, rule_id: Hashable, data: Any):
+        if rule_id not in self._priority:
+            self._priority[rule_id] = len(self._priority)
+        self.rules[rule_id] = data
+
+    def build(self) -> 'RuleMatcher':
+        """构建自动机并合并正则模式"""
+        started = time.perf_counter()
+        self._automaton.build()
+        self._stats['literal']['compile_ms'] += (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        self._combined = None
+        self._group_rules = {}
+        if self._patterns and not any(_NUMERIC_BACKREF.search(p) for _, p, _ in self._patterns):
+            branches = []
+            group_index = 1
+            for i, (rule_id, pattern, compiled) in enumerate(self._patterns):
+                branches.append(f'(?=[\\s\\S]*?(?P<_r{i}>{pattern}))')
+                self._group_rules[group_index] = rule_id
+                group_index += 1 + compiled.groups
+            try:
+                self._combined = re.compile('(?:' + '|'.join(branches) + ')', re.IGNORECASE)
+            except (re.error, RecursionError, OverflowError):
+                # 组名冲突、内联全局标志等无法合并的情况，退回逐条匹配
+                self._combined = None
+                self._group_rules = {}
+        self._stats['regex']['compile_ms'] += (time.perf_counter() - started) * 1000
+        return self
+
+    def match(self, text: str) -> Optional[Tuple[Hashable, str]]:
+        """
+        匹配文本（字面量关键词需与小写文本比较）
+
+        Returns:
+            (规则ID, 命中的关键词或正则匹配文本)，未命中返回 None
+        """
+        best = None
+        best_priority = None
+
+        if len(self._automaton):
+            started = time.perf_counter()
+            hit = self._automaton.search(text)
+            literal_stats = self._stats['literal']
+            literal_stats['matches'] += 1
+            literal_stats['match_seconds'] += time.perf_counter() - started
+            if hit is not None:
+                literal_stats['hits'] += 1
+                best, best_priority = hit, self._priority[hit[0]]
+
+        # 只有当存在顺序更靠前的正则规则时才需要跑正则
+        if self._patterns and (best_priority is None or self._first_regex_priority < best_priority):
+            started = time.perf_counter()
+            hit = self._match_regex(text)
+            regex_stats = self._stats['regex']
+            regex_stats['matches'] += 1
+            regex_stats['match_seconds'] += time.perf_counter() - started
+            if hit is not None and (best_priority is None or self._priority[hit[0]] < best_priority):
+                regex_stats['hits'] += 1
+                best = hit
+        return best
+
+    def _match_regex(self, text: str) -> Optional[Tuple[Hashable, str]]:
+        if self._combined is not None:
+            m = self._combined.match(text)
+            if m is None:
+                return None
+            return self._group_rules[m.lastindex], m.group(m.lastindex)
+        for rule_id, _, compiled in self._patterns:
+            m = compiled.search(text)
+            if m is not None:
+                return rule_id, m.group(0)
+        return None
+
+    def get(self, rule_id: Hashable, default: Any = None) -> Any:
+        """获取规则数据"""
+        return self.rules.get(rule_id, default)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取各类规则的编译耗时与匹配耗时统计"""
+        stats = {'invalid_patterns': len(self.errors), 'regex_combined': self._combined is not None}
+        for kind, kind_stats in self._stats.items():
+            matches = kind_stats['matches']
+            stats[kind] = {
+                'rules': kind_stats['rules'],
+                'compile_ms': round(kind_stats['compile_ms'], 3),
+                'matches': matches,
+                'hits': kind_stats['hits'],
+                'avg_match_us': round(kind_stats['match_seconds'] / matches * 1e6, 2) if matches else 0.0,
+            }
+        return stats
+
+    def __len__(self):
+        return len(self.rules)
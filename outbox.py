@@ -0,0 +1,228 @@
+"""
+发送队列 - 检测与发送解耦
+职责：有界队列 + 少量发送工作线程；检测线程只负责投递任务，发送、等待限速和验证都在工作线程中完成；
+     任务按优先级出队（同优先级先进先出），本地限速只推迟任务、不计入失败次数，
+     停止时可优雅排空队列，并统计队列深度、排队等待时间和发送耗时
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RetryLater(Exception):
+    """处理函数抛出此异常表示本次发送失败、需在 delay 秒后重试（计入任务的处理次数）"""
+
+    def __init__(self, delay: float, reason: str = ''):
+        super().__init__(reason or f"{delay:.1f} 秒后重试")
+        self.delay = delay
+
+
+class OutboxJob:
+    """发送任务"""
+
+    __slots__ = ('kind', 'payload', 'priority', 'enqueued_at', 'attempts')
+
+    def __init__(self, kind: str, payload: Any, priority: int = 0):
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+def _percentile(samples, ratio: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Outbox:
+    """有界发送队列与工作线程池
+
+    handler(kind, payload) 返回 None 表示任务完成；返回正数表示任务尚未执行、需推迟该秒数
+    （例如被本地限速），任务会重新排队而不占用工作线程，推迟不计入处理次数；
+    抛出 RetryLater 表示发送失败需重试，计入处理次数，超过 max_attempts 后丢弃。
+    priority 数值越小越先处理，延迟重试的任务到期后按原优先级重新排队
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, Any], Optional[float]],
+        workers: int = 2,
+        maxsize: int = 500,
+        max_attempts: int = 20,
+        name: str = 'outbox',
+        sample_size: int = 500
+    ):
+        """
+        初始化发送队列
+
+        Args:
+            handler: 任务处理函数
+            workers: 工作线程数量
+            maxsize: 队列容量（待处理 + 延迟重试的任务总数）
+            max_attempts: 单个任务最多失败重试的处理次数（RetryLater），超过后丢弃
+            name: 线程名前缀
+            sample_size: 用于统计耗时的最近样本数
+        """
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        self.name = name
+        self._ready = []  # [(优先级, 序号, 任务)]
+        self._delayed = []  # [(到期时间, 序号, 任务)]
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._accepting = False
+        self._running = False
+        self._in_flight = 0
+        self._wait_samples = deque(maxlen=sample_size)
+        self._latency_samples = deque(maxlen=sample_size)
+        self._stats = {'submitted': 0, 'completed': 0, 'deferred': 0, 'retried': 0, 'failed': 0, 'dropped': 0, 'max_depth': 0}
+
+    def start(self):
+        """启动工作线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._accepting = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def is_running(self) -> bool:
+        """工作线程是否在运行"""
+        with self._cond:
+            return self._running
+
+    def submit(self, kind: str, payload: Any, priority: int = 0) -> bool:
+        """投递任务（priority 越小越先处理），队列已满或已停止接收时返回 False（不阻塞调用方）"""
+        with self._cond:
+            if not self._accepting or self._depth() >= self.maxsize:
+                self._stats['dropped'] += 1
+                return False
+            self._push_ready(OutboxJob(kind, payload, priority))
+            self._stats['submitted'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._depth())
+            self._cond.notify()
+            return True
+
+    def _push_ready(self, job: OutboxJob):
+        heapq.heappush(self._ready, (job.priority, next(self._sequence), job))
+
+    def _depth(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    def _next_job(self) -> Optional[OutboxJob]:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                # 把到期的延迟任务移回就绪队列
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._push_ready(heapq.heappop(self._delayed)[2])
+                if self._ready:
+                    self._in_flight += 1
+                    return heapq.heappop(self._ready)[2]
+                if not self._running:
+                    return None
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(timeout)
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            started = time.monotonic()
+            delay = None
+            outcome = 'completed'
+            try:
+                delay = self.handler(job.kind, job.payload)
+                if delay and delay > 0:
+                    outcome = 'deferred'
+            except RetryLater as e:
+                job.attempts += 1
+                delay = e.delay
+                if job.attempts < self.max_attempts:
+                    outcome = 'retried'
+                else:
+                    outcome = 'dropped'
+                    logger.warning(f"发送任务重试 {job.attempts} 次仍失败，已丢弃 ({job.kind}): {e}")
+            except Exception as e:
+                logger.error(f"发送任务处理异常 ({job.kind}): {e}")
+                outcome = 'failed'
+            finished = time.monotonic()
+
+            with self._cond:
+                self._in_flight -= 1
+                self._stats[outcome] += 1
+                if outcome in ('deferred', 'retried'):
+                    if outcome == 'deferred':
+                        self._stats['retried'] += 1  # retried 统计全部重新排队次数，deferred 为其中的限速推迟
+                    heapq.heappush(self._delayed, (finished + max(delay or 0.0, 0.0), next(self._sequence), job))
+                else:
+                    self._wait_samples.append(started - job.enqueued_at)
+                    self._latency_samples.append(finished - started)
+                self._cond.notify_all()
+
+    def stop(self, drain: bool = True, timeout: float = 10.0) -> int:
+        """
+        停止发送队列
+
+        Args:
+            drain: 是否先处理完队列中的任务
+            timeout: 排空等待的最长时间（秒）
+
+        Returns:
+            停止时被丢弃的任务数
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._accepting = False
+            if drain:
+                while (self._depth() or self._in_flight) and time.monotonic() < deadline:
+                    self._cond.wait(max(0.0, min(0.1, deadline - time.monotonic())))
+            discarded = self._depth()
+            self._ready.clear()
+            self._delayed = []
+            self._stats['dropped'] += discarded
+            self._running = False
+            self._cond.notify_all()
+
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()) if drain else 1.0)
+        self._threads = []
+        return discarded
+
+    def stats(self) -> Dict[str, float]:
+        """获取队列统计：深度、排队等待时间、发送耗时（秒）"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['depth'] = self._depth()
+            stats['delayed'] = len(self._delayed)
+            stats['depth_by_priority'] = dict(Counter(job.priority for _, _, job in self._ready))
+            stats['in_flight'] = self._in_flight
+            stats['workers'] = self.workers
+            waits = list(self._wait_samples)
+            latencies = list(self._latency_samples)
+        stats['wait_p50'] = _percentile(waits, 0.5)
+        stats['wait_p95'] = _percentile(waits, 0.95)
+        stats['wait_max'] = max(waits) if waits else 0.0
+        stats['latency_p50'] = _percentile(latencies, 0.5)
+        stats['latency_p95'] = _percentile(latencies, 0.95)
+        stats['latency_max'] = max(latencies) if latencies else 0.0
+        return stats
@@ -0,0 +1,151 @@
+"""
+轮询调度器 - 自适应轮询间隔
+职责：有新消息时按最短间隔快速轮询，空闲时按倍数退避到上限；
+     会话列表接口触发 -412 时放宽间隔并在冷却期内保持，新消息到达时立即回到最短间隔
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+
+class PollScheduler:
+    """自适应轮询间隔
+
+    - 有动态（on_activity）：间隔回到 min_interval，之后 idle_grace 秒内保持快速轮询
+    - 无动态（on_idle）：超过 idle_grace 后每轮乘以 backoff，直到 max_interval
+    - 触发 -412（on_rate_limited）：间隔至少为 throttle_interval（连续触发时翻倍），throttle_seconds 内不低于该值
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 0.05,
+        max_interval: float = 3.0,
+        backoff: float = 1.5,
+        idle_grace: float = 10.0,
+        throttle_interval: float = 5.0,
+        throttle_seconds: float = 60.0,
+        history_size: int = 50,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        初始化轮询调度器
+
+        Args:
+            min_interval: 最短轮询间隔（秒），有新消息时使用
+            max_interval: 空闲退避的间隔上限（秒）
+            backoff: 空闲时每轮间隔的放大倍数
+            idle_grace: 最近一次动态后保持最短间隔的时间（秒）
+            throttle_interval: 触发 -412 后的最短间隔（秒）
+            throttle_seconds: 触发 -412 后保持放宽间隔的时间（秒）
+            history_size: 保留的间隔变化记录条数
+            clock: 时钟函数（便于测试注入）
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.idle_grace = idle_grace
+        self.throttle_interval = throttle_interval
+        self.throttle_seconds = throttle_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._interval = min_interval
+        self._floor = 0.0  # 冷却期内的最短间隔
+        self._throttled_until = 0.0
+        self._last_activity = clock()
+        self._history = deque(maxlen=history_size)  # [(时间戳, 间隔, 原因)]
+        self._stats = {'polls': 0, 'active_polls': 0, 'idle_polls': 0, 'rate_limited': 0}
+
+    @property
+    def interval(self) -> float:
+        """当前轮询间隔（秒）"""
+        return self._interval
+
+    def configure(self, min_interval: float = None, max_interval: float = None, backoff: float = None, idle_grace: float = None):
+        """更新调度参数（当前间隔按新范围截断）"""
+        with self._lock:
+            if min_interval is not None:
+                self.min_interval = min_interval
+            if max_interval is not None:
+                self.max_interval = max_interval
+            self.max_interval = max(self.max_interval, self.min_interval)
+            if backoff is not None:
+                self.backoff = max(1.0, backoff)
+            if idle_grace is not None:
+                self.idle_grace = idle_grace
+            self._set_locked(min(max(self._interval, self.min_interval), self.max_interval), 'configure')
+
+    def on_activity(self):
+        """本轮发现新消息：回到最短间隔（冷却期内不低于冷却间隔）"""
+        with self._lock:
+            now = self._clock()
+            self._stats['polls'] += 1
+            self._stats['active_polls'] += 1
+            self._last_activity = now
+            self._set_locked(max(self.min_interval, self._floor_locked(now)), 'activity')
+
+    def on_idle(self):
+        """本轮没有新消息：超过宽限期后按倍数退避"""
+        with self._lock:
+            now = self._clock()
+            self._stats['polls'] += 1
+            self._stats['idle_polls'] += 1
+            floor = self._floor_locked(now)
+            if now - self._last_activity < self.idle_grace:
+                interval = max(self.min_interval, floor)
+            else:
+                interval = max(min(self._interval * self.backoff, self.max_interval), floor)
+            self._set_locked(interval, 'idle')
+
+    def on_rate_limited(self):
+        """会话列表接口触发 -412：放宽间隔并进入冷却期，冷却期内再次触发时间隔翻倍"""
+        with self._lock:
+            now = self._clock()
+            self._stats['polls'] += 1
+            self._stats['rate_limited'] += 1
+            if self._throttled_until > now:
+                self._floor = max(self._floor * 2, self.throttle_interval)
+            else:
+                self._floor = self.throttle_interval
+            self._throttled_until = now + self.throttle_seconds
+            self._set_locked(max(self._interval, self._floor), 'rate_limited')
+
+    def delay(self, elapsed: float = 0.0) -> float:
+        """本轮已耗时 elapsed 秒时还需等待的时间"""
+        return max(0.01, self._interval - elapsed)
+
+    def _floor_locked(self, now: float) -> float:
+        if self._throttled_until <= now:
+            self._floor = 0.0
+        return self._floor
+
+    def _set_locked(self, interval: float, reason: str):
+        interval = round(interval, 4)
+        if interval != self._interval:
+            self._interval = interval
+            self._history.append((round(time.time(), 3), interval, reason))
+
+    def reset(self):
+        """回到最短间隔并清除冷却状态"""
+        with self._lock:
+            self._floor = 0.0
+            self._throttled_until = 0.0
+            self._last_activity = self._clock()
+            self._set_locked(self.min_interval, 'reset')
+
+    def stats(self) -> Dict[str, Any]:
+        """获取轮询统计（含最近的间隔变化记录）"""
+        with self._lock:
+            now = self._clock()
+            stats = dict(self._stats)
+            stats['interval'] = self._interval
+            stats['min_interval'] = self.min_interval
+            stats['max_interval'] = self.max_interval
+            stats['throttled'] = self._throttled_until > now
+            stats['idle_seconds'] = round(now - self._last_activity, 1)
+            stats['history'] = [
+                {'at': at, 'interval': interval, 'reason': reason}
+                for at, interval, reason in self._history
+            ]
+            return stats
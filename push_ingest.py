@@ -0,0 +1,267 @@
+"""
+推送接入 - 私信通知长连接
+职责：与私信通知通道保持长连接，收到新消息通知时唤醒监控循环并只拉取有通知的会话；
+     连接断开时按退避重连，期间由监控循环回退到会话列表轮询。传输层可替换（测试中使用本地替身）
+
+通知帧格式为 JSON（见 parse_notice），B 站网页端私信广播通道使用二进制分包协议，不能直接接入，
+需要一个把新消息事件转换为 JSON 帧的中继服务。无法解码为 JSON 的帧按控制帧忽略，不触发轮询
+"""
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+try:
+    import websocket  # websocket-client，可选依赖
+    WEBSOCKET_AVAILABLE = True
+except ImportError:
+    websocket = None
+    WEBSOCKET_AVAILABLE = False
+
+# 无法识别会话的通知：唤醒后做一次完整轮询
+ANY_TALKER = '*'
+
+# 不代表新消息的控制帧
+_CONTROL_COMMANDS = {'heartbeat', 'heartbeat_reply', 'ping', 'pong', 'auth_reply'}
+
+
+def parse_notice(frame: Any) -> Set[Any]:
+    """
+    解析通知帧，返回有新消息的会话 ID 集合
+
+    支持 JSON 对象或对象列表，会话 ID 依次取 talker_id / sender_uid / uid（也会查找 data 字段）；
+    心跳等控制帧以及无法解码为 JSON 的帧（如二进制协议帧）返回空集合，避免每一帧都触发完整轮询；
+    没有会话 ID 的 JSON 通知返回 {ANY_TALKER}
+
+    Args:
+        frame: 传输层收到的原始帧（str 或 bytes）
+    """
+    if isinstance(frame, (bytes, bytearray)):
+        try:
+            frame = frame.decode('utf-8')
+        except UnicodeDecodeError:
+            return set()
+    try:
+        payload = json.loads(frame)
+    except (ValueError, TypeError):
+        return set()
+
+    notices = set()
+    for item in payload if isinstance(payload, list) else [payload]:
+        if not isinstance(item, dict):
+            continue
+        if str(item.get('cmd', '')).lower() in _CONTROL_COMMANDS:
+            continue
+        data = item.get('data') if isinstance(item.get('data'), dict) else {}
+        for source in (item, data):
+            talker_id = source.get('talker_id') or source.get('sender_uid') or source.get('uid')
+            if talker_id:
+                notices.add(talker_id)
+                break
+        else:
+            notices.add(ANY_TALKER)
+    return notices
+
+
+class WebSocketTransport:
+    """基于 websocket-client 的传输层"""
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, heartbeat_interval: float = 30.0,
+                 heartbeat_message: str = '{"cmd": "heartbeat"}', connect_timeout: float = 5.0):
+        """
+        Args:
+            url: 通知通道地址（ws:// 或 wss://）
+            headers: 连接时附带的请求头（如 Cookie）
+            heartbeat_interval: 心跳间隔（秒）
+            heartbeat_message: 心跳帧内容
+            connect_timeout: 连接超时（秒）
+        """
+        if not WEBSOCKET_AVAILABLE:
+            raise RuntimeError("推送接入需要安装 websocket-client: pip install websocket-client")
+        self.url = url
+        self.headers = headers or {}
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_message = heartbeat_message
+        self.connect_timeout = connect_timeout
+        self._conn = None
+        self._last_heartbeat = 0.0
+
+    def connect(self):
+        header = [f"{key}: {value}" for key, value in self.headers.items()]
+        self._conn = websocket.create_connection(self.url, header=header, timeout=self.connect_timeout)
+        self._last_heartbeat = time.monotonic()
+
+    def recv(self, timeout: float) -> Optional[Any]:
+        """读取一帧，超时返回 None，连接断开时抛出 ConnectionError"""
+        if time.monotonic() - self._last_heartbeat >= self.heartbeat_interval:
+            self._conn.send(self.heartbeat_message)
+            self._last_heartbeat = time.monotonic()
+        self._conn.settimeout(timeout)
+        try:
+            frame = self._conn.recv()
+        except websocket.WebSocketTimeoutException:
+            return None
+        except websocket.WebSocketConnectionClosedException as e:
+            raise ConnectionError(str(e))
+        if frame in ('', b''):
+            raise ConnectionError("连接已关闭")
+        return frame
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            finally:
+                self._conn = None
+
+
+class PushIngestor:
+    """推送接入：后台线程维持长连接，把通知汇总为待处理的会话 ID 集合
+
+    每次（重新）连接成功后都会加入一次 ANY_TALKER，让监控循环做一次完整轮询，补上断线期间的消息
+    """
+
+    def __init__(
+        self,
+        transport_factory: Callable[[], Any],
+        parse: Callable[[Any], Iterable[Any]] = parse_notice,
+        reconnect_base: float = 1.0,
+        reconnect_max: float = 30.0,
+        recv_timeout: float = 1.0,
+        name: str = 'push-ingest'
+    ):
+        """
+        初始化推送接入
+
+        Args:
+            transport_factory: 创建传输层对象的函数，对象需提供 connect() / recv(timeout) / close()，
+                               recv 超时返回 None、连接断开时抛出异常
+            parse: 通知帧解析函数，返回会话 ID 集合
+            reconnect_base: 首次重连等待时间（秒），连续失败时翻倍
+            reconnect_max: 重连等待时间上限（秒）
+            recv_timeout: 单次读取的超时时间（秒），也是响应停止请求的最长延迟
+            name: 线程名
+        """
+        self._transport_factory = transport_factory
+        self._parse = parse
+        self.reconnect_base = reconnect_base
+        self.reconnect_max = reconnect_max
+        self.recv_timeout = recv_timeout
+        self._name = name
+        self._cond = threading.Condition()
+        self._pending = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._transport = None
+        self._connected = False
+        self._stats = {'connects': 0, 'disconnects': 0, 'frames': 0, 'ignored_frames': 0, 'notices': 0, 'parse_errors': 0,
+                       'last_error': None}
+
+    @property
+    def connected(self) -> bool:
+        """长连接是否可用（不可用时监控循环应回退到轮询）"""
+        return self._connected
+
+    def start(self):
+        """启动后台连接线程（已启动时直接返回）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 3.0):
+        """停止后台线程并关闭连接"""
+        self._stop.set()
+        transport = self._transport
+        if transport is not None:
+            try:
+                transport.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        self._connected = False
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait(self, timeout: float) -> Set[Any]:
+        """
+        等待通知，返回并清空待处理的会话 ID 集合
+
+        Args:
+            timeout: 最长等待时间（秒），期间连接断开也会提前返回
+
+        Returns:
+            有新消息的会话 ID 集合（含 ANY_TALKER 时需做一次完整轮询），超时返回空集合
+        """
+        with self._cond:
+            if not self._pending and self._connected:
+                self._cond.wait(timeout)
+            pending, self._pending = self._pending, set()
+            return pending
+
+    def _notify(self, talker_ids: Iterable[Any]):
+        with self._cond:
+            before = len(self._pending)
+            self._pending.update(talker_ids)
+            self._stats['notices'] += len(self._pending) - before
+            self._cond.notify_all()
+
+    def _set_connected(self, connected: bool):
+        with self._cond:
+            self._connected = connected
+            self._cond.notify_all()
+
+    def _run(self):
+        delay = self.reconnect_base
+        while not self._stop.is_set():
+            try:
+                self._transport = self._transport_factory()
+                self._transport.connect()
+                self._stats['connects'] += 1
+                self._set_connected(True)
+                delay = self.reconnect_base
+                # 连接（重连）成功后补一次完整轮询
+                self._notify([ANY_TALKER])
+                while not self._stop.is_set():
+                    frame = self._transport.recv(self.recv_timeout)
+                    if frame is None:
+                        continue
+                    self._stats['frames'] += 1
+                    try:
+                        talker_ids = self._parse(frame)
+                    except Exception:
+                        self._stats['parse_errors'] += 1
+                        talker_ids = None
+                    if talker_ids:
+                        self._notify(talker_ids)
+                    else:
+                        self._stats['ignored_frames'] += 1
+            except Exception as e:
+                if not self._stop.is_set():
+                    self._stats['last_error'] = str(e)[:200]
+            finally:
+                if self._connected:
+                    self._stats['disconnects'] += 1
+                self._set_connected(False)
+                transport, self._transport = self._transport, None
+                if transport is not None:
+                    try:
+                        transport.close()
+                    except Exception:
+                        pass
+
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * 2, self.reconnect_max)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取推送接入统计"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['connected'] = self._connected
+            stats['pending'] = len(self._pending)
+            return stats
@@ -0,0 +1,231 @@
+"""
+发送限速器 - 令牌桶调度
+职责：统一控制私信发送频率（全局桶 + 每个接收者独立桶），触发 -412 时自适应冷却；
+     调用方拿到预约结果（立即可发送 / 需等待的秒数），限速器本身从不阻塞调用线程
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+
+class TokenBucket:
+    """令牌桶：以固定速率补充令牌，最多累积 capacity 个（突发容量）"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        """
+        Args:
+            rate: 每秒补充的令牌数，<= 0 表示不限速
+            capacity: 桶容量（允许的突发发送数）
+            now: 当前时间（单调时钟）
+        """
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated_at = now
+
+    def _refill(self, now: float):
+        if self.rate <= 0:
+            self.tokens = self.capacity
+        elif now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+    def time_until_available(self, now: float, tokens: float = 1.0) -> float:
+        """距离可取出 tokens 个令牌还需等待的秒数"""
+        self._refill(now)
+        if self.tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def consume(self, now: float, tokens: float = 1.0):
+        """取出令牌（调用前应确认 time_until_available 为 0）"""
+        self._refill(now)
+        self.tokens -= tokens
+
+    def is_full(self, now: float) -> bool:
+        """令牌桶是否已满（空闲状态，可安全回收）"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class SendReservation:
+    """发送预约结果"""
+
+    __slots__ = ('granted', 'eta', 'reason')
+
+    def __init__(self, granted: bool, eta: float = 0.0, reason: str = ''):
+        """
+        Args:
+            granted: 是否已取得发送许可（令牌已扣除）
+            eta: 未取得许可时，预计还需等待的秒数
+            reason: 受限原因：'cooldown' / 'global' / 'receiver'
+        """
+        self.granted = granted
+        self.eta = eta
+        self.reason = reason
+
+    def __bool__(self):
+        return self.granted
+
+    def __repr__(self):
+        return f"SendReservation(granted={self.granted}, eta={self.eta:.2f}, reason={self.reason!r})"
+
+
+class SendScheduler:
+    """私信发送调度器：全局 + 接收者两级令牌桶，-412 时指数退避冷却"""
+
+    def __init__(
+        self,
+        global_interval: float = 1.0,
+        global_burst: int = 1,
+        receiver_interval: float = 0.0,
+        receiver_burst: int = 1,
+        cooldown_base: float = 10.0,
+        cooldown_max: float = 300.0,
+        max_receivers: int = 10000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        初始化发送调度器
+
+        Args:
+            global_interval: 全局平均发送间隔（秒），<= 0 表示不限速
+            global_burst: 全局突发容量
+            receiver_interval: 同一接收者的平均发送间隔（秒），<= 0 表示不限速
+            receiver_burst: 同一接收者的突发容量
+            cooldown_base: 首次触发 -412 后的冷却时间（秒）
+            cooldown_max: 冷却时间上限（秒）
+            max_receivers: 最多保留的接收者令牌桶数量
+            clock: 时钟函数（便于测试注入）
+        """
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._receivers = OrderedDict()
+        self.max_receivers = max_receivers
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self._cooldown = 0.0
+        self._cooldown_until = 0.0
+        self._next_deferred = 0.0  # 下一个可分配给延后任务的全局发送时刻
+        self._stats = {'granted': 0, 'throttled': 0, 'rate_limited': 0, 'deferred': 0}
+        self.configure(global_interval, global_burst, receiver_interval, receiver_burst)
+
+    def configure(
+        self,
+        global_interval: float,
+        global_burst: int = 1,
+        receiver_interval: float = 0.0,
+        receiver_burst: int = 1
+    ):
+        """更新限速参数（保留冷却状态，重建令牌桶）"""
+        with self._lock:
+            now = self._clock()
+            self.global_interval = global_interval
+            self.global_burst = global_burst
+            self.receiver_interval = receiver_interval
+            self.receiver_burst = receiver_burst
+            self._global = TokenBucket(self._rate(global_interval), global_burst, now)
+            self._receivers.clear()
+
+    @staticmethod
+    def _rate(interval: float) -> float:
+        return 1.0 / interval if interval and interval > 0 else 0.0
+
+    def _receiver_bucket(self, receiver_id: Hashable, now: float) -> TokenBucket:
+        bucket = self._receivers.get(receiver_id)
+        if bucket is None:
+            bucket = TokenBucket(self._rate(self.receiver_interval), self.receiver_burst, now)
+            self._receivers[receiver_id] = bucket
+            # 超出上限时回收最久未使用的接收者桶
+            while len(self._receivers) > self.max_receivers:
+                self._receivers.popitem(last=False)
+        else:
+            self._receivers.move_to_end(receiver_id)
+        return bucket
+
+    def _wait_time(self, receiver_id: Optional[Hashable], now: float):
+        if now < self._cooldown_until:
+            return self._cooldown_until - now, 'cooldown'
+        wait = self._global.time_until_available(now)
+        reason = 'global'
+        if receiver_id is not None:
+            receiver_wait = self._receiver_bucket(receiver_id, now).time_until_available(now)
+            if receiver_wait > wait:
+                wait, reason = receiver_wait, 'receiver'
+        return wait, reason
+
+    def reserve(self, receiver_id: Optional[Hashable] = None) -> SendReservation:
+        """
+        尝试预约一次发送
+
+        Returns:
+            granted=True 时已扣除令牌，可立即发送；否则 eta 为建议的等待秒数
+        """
+        with self._lock:
+            now = self._clock()
+            wait, reason = self._wait_time(receiver_id, now)
+            if wait > 0:
+                self._stats['throttled'] += 1
+                return SendReservation(False, wait, reason)
+
+            self._global.consume(now)
+            if receiver_id is not None:
+                self._receiver_bucket(receiver_id, now).consume(now)
+            self._stats['granted'] += 1
+            return SendReservation(True)
+
+    def peek(self, receiver_id: Optional[Hashable] = None) -> float:
+        """查询距离可发送还需等待的秒数（不扣除令牌）"""
+        with self._lock:
+            return self._wait_time(receiver_id, self._clock())[0]
+
+    def defer(self, receiver_id: Optional[Hashable] = None) -> float:
+        """
+        为暂时无法发送的任务安排重试时间（不扣除令牌）
+
+        受全局限速或冷却影响的任务按全局发送间隔依次错开，避免大量任务同时醒来争抢同一个令牌；
+        只受接收者限速影响的任务直接按该接收者的等待时间重试
+
+        Returns:
+            距离重试还需等待的秒数
+        """
+        with self._lock:
+            now = self._clock()
+            wait, reason = self._wait_time(receiver_id, now)
+            self._stats['deferred'] += 1
+            if reason == 'receiver' or self.global_interval <= 0:
+                return wait
+            due = max(now + wait, self._next_deferred)
+            self._next_deferred = due + self.global_interval
+            return due - now
+
+    def on_rate_limited(self) -> float:
+        """记录一次 -412 风控响应，冷却时间指数增长，返回本次冷却秒数"""
+        with self._lock:
+            if self._cooldown <= 0:
+                self._cooldown = self.cooldown_base
+            else:
+                self._cooldown = min(self.cooldown_max, self._cooldown * 2)
+            self._cooldown_until = self._clock() + self._cooldown
+            self._stats['rate_limited'] += 1
+            return self._cooldown
+
+    def on_success(self):
+        """记录一次成功发送，逐步降低冷却等级"""
+        with self._lock:
+            if self._cooldown > 0:
+                self._cooldown = self._cooldown / 2 if self._cooldown / 2 >= self.cooldown_base else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """获取调度统计"""
+        with self._lock:
+            now = self._clock()
+            stats = dict(self._stats)
+            stats['cooldown'] = self._cooldown
+            stats['cooldown_remaining'] = max(0.0, self._cooldown_until - now)
+            stats['tracked_receivers'] = len(self._receivers)
+            return stats
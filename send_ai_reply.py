@@ -1,16 +1,45 @@
 #!/usr/bin/env python3
 """
 使用 AI 生成智能回复并发送给指定用户
+
+监控正在运行时，回复通过 /api/send-reply 投递到监控的发送队列，与监控共用同一套发送限速；
+监控未运行时才由本进程直接发送（此时令牌桶只在本进程内生效）
 """
 
 import json
 import sys
 import os
+import time
+import requests
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import BilibiliAPI, config, load_config
+from app import BilibiliAPI, config, load_config, configure_send_scheduler, SEND_THROTTLED
 from ai_adapter import AIReplyAdapter
 
+# 运行中的 BiliGo 服务地址（可用环境变量 BILIGO_URL 覆盖）
+BILIGO_URL = os.environ.get('BILIGO_URL', 'http://127.0.0.1:4999')
+
+
+def enqueue_via_app(user_id: int, content: str):
+    """
+    通过运行中的服务投递回复
+
+    Returns:
+        True 已投递到监控的发送队列；False 服务在运行但拒绝投递；None 服务或监控未运行
+    """
+    try:
+        response = requests.post(f"{BILIGO_URL}/api/send-reply",
+                                 json={'talker_id': user_id, 'message': content}, timeout=5)
+        data = response.json()
+    except (requests.RequestException, ValueError):
+        return None
+    if data.get('success'):
+        return True
+    if data.get('monitoring') is False:
+        return None
+    print(f"❌ 投递失败: {data.get('error', '未知错误')}")
+    return False
+
 
 def send_ai_reply_to_user(user_id: int, user_message: str):
     """
@@ -60,8 +89,14 @@ def send_ai_reply_to_user(user_id: int, user_message: str):
         print(ai_reply)
         print("-" * 60)
 
-        # 2. 发送回复给用户
-        print(f"\n⏳ 正在发送消息到 B 站...")
+        # 2. 发送回复给用户：监控运行中时交给监控的发送队列，共用同一套发送限速
+        queued = enqueue_via_app(user_id, ai_reply)
+        if queued is not None:
+            if queued:
+                print(f"✅ 已投递到监控的发送队列，发送结果见 BiliGo 日志")
+            return queued
+
+        print(f"\n⏳ 监控未运行，直接发送消息到 B 站...")
 
         api = BilibiliAPI(config['sessdata'], config['bili_jct'])
 
@@ -73,8 +108,15 @@ def send_ai_reply_to_user(user_id: int, user_message: str):
 
         print(f"✅ 登录状态有效 (UID: {my_uid})")
 
-        # 发送 AI 生成的回复
+        # 发送 AI 生成的回复（沿用配置中的发送限速参数，被限速时按预计时间等待后重试）
+        # 已知限制：直接发送时令牌桶只在本进程内生效；此路径只在监控未运行时使用
+        configure_send_scheduler()
         result = api.send_msg(user_id, msg_type=1, content=ai_reply)
+        while result is not None and result.get('code') == SEND_THROTTLED:
+            retry_after = result.get('retry_after', 1.0)
+            print(f"⏳ 发送限速中，{retry_after:.1f} 秒后重试")
+            time.sleep(retry_after)
+            result = api.send_msg(user_id, msg_type=1, content=ai_reply)
 
         if result is None:
             print("❌ 发送失败：网络错误")
@@ -0,0 +1,230 @@
+"""
+状态存储 - SQLite (WAL) 持久化会话水位与去重记录
+职责：持久化每个会话已处理到的消息时间（水位）、已处理消息 ID 和关注者相关集合，
+     写入先在内存中合并，按间隔批量提交；启动时一次性加载，重启后不会重放收件箱
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    talker_id PRIMARY KEY,
+    ts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dedupe (
+    key TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dedupe_seen_at ON dedupe (seen_at);
+CREATE TABLE IF NOT EXISTS members (
+    kind TEXT NOT NULL,
+    member NOT NULL,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, member)
+);
+"""
+
+
+class StateStore:
+    """基于 SQLite WAL 的运行状态存储
+
+    水位与去重记录按增量写入，关注者等小集合按快照整体替换；
+    所有修改先进入内存待写队列，由 flush / maybe_flush 在一个事务中批量提交。
+    WAL 模式下崩溃最多丢失最近一个刷新间隔内的修改
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 1.0,
+        dedupe_ttl: float = 900.0,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        初始化状态存储
+
+        Args:
+            path: 数据库文件路径（':memory:' 用于测试）
+            flush_interval: maybe_flush 的最小刷新间隔（秒）
+            dedupe_ttl: 去重记录保留时间（秒），超期记录在刷新时删除
+            clock: 墙钟时间函数（去重记录需跨进程比较，不能用 monotonic）
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.dedupe_ttl = dedupe_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pending_watermarks = {}
+        self._pending_dedupe = {}
+        self._pending_members = {}  # {kind: {member: value}} 整体替换
+        self._written_members = {}  # {kind: 上次写入的快照}，未变化时跳过
+        self._last_flush = 0.0
+        self._stats = {'flushes': 0, 'rows_written': 0, 'last_flush_ms': 0.0, 'load_ms': 0.0, 'errors': 0}
+
+    def open(self):
+        """打开数据库并建表（WAL 模式）"""
+        with self._lock:
+            if self._conn is not None:
+                return
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def close(self):
+        """提交未写入的修改并关闭数据库"""
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def load(self) -> Dict[str, Any]:
+        """
+        加载持久化状态
+
+        Returns:
+            {'watermarks': {talker_id: ts},
+             'dedupe': [(key, 已过去的秒数), ...]（按记录时间从早到晚），
+             'members': {kind: {member: value}}}
+        """
+        started = time.perf_counter()
+        with self._lock:
+            conn = self._conn
+            now = self._clock()
+            watermarks = dict(conn.execute('SELECT talker_id, ts FROM watermarks'))
+            dedupe = [
+                (key, now - seen_at)
+                for key, seen_at in conn.execute(
+                    'SELECT key, seen_at FROM dedupe WHERE seen_at > ? ORDER BY seen_at', (now - self.dedupe_ttl,)
+                )
+            ]
+            members = {}
+            for kind, member, value in conn.execute('SELECT kind, member, value FROM members'):
+                members.setdefault(kind, {})[member] = value
+            self._written_members = {kind: dict(values) for kind, values in members.items()}
+            self._stats['load_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return {'watermarks': watermarks, 'dedupe': dedupe, 'members': members}
+
+    def set_watermark(self, talker_id: Hashable, ts: int):
+        """记录会话已处理到的消息时间"""
+        with self._lock:
+            self._pending_watermarks[talker_id] = ts
+
+    def add_dedupe(self, key: str):
+        """记录一个已处理的消息 ID"""
+        with self._lock:
+            self._pending_dedupe[key] = self._clock()
+
+    def replace_members(self, kind: str, members: Any):
+        """
+        整体替换一个集合的快照
+
+        Args:
+            kind: 集合名称
+            members: 集合（值记为 0）或 {member: value} 字典
+        """
+        snapshot = dict(members) if isinstance(members, dict) else dict.fromkeys(members, 0)
+        with self._lock:
+            self._pending_members[kind] = snapshot
+
+    def pending_count(self) -> int:
+        """待写入的修改数量"""
+        with self._lock:
+            return len(self._pending_watermarks) + len(self._pending_dedupe) + len(self._pending_members)
+
+    def flush_due(self) -> bool:
+        """距上次刷新是否已超过刷新间隔"""
+        return self._clock() - self._last_flush >= self.flush_interval
+
+    def maybe_flush(self) -> int:
+        """距上次刷新超过间隔时批量写入，返回写入行数"""
+        if not self.flush_due():
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """在一个事务中写入所有待写修改，并删除超期的去重记录，返回写入行数"""
+        with self._lock:
+            now = self._clock()
+            self._last_flush = now
+            if self._conn is None:
+                return 0
+
+            watermarks = list(self._pending_watermarks.items())
+            dedupe = list(self._pending_dedupe.items())
+            members = {
+                kind: snapshot for kind, snapshot in self._pending_members.items()
+                if self._written_members.get(kind) != snapshot
+            }
+            self._pending_watermarks = {}
+            self._pending_dedupe = {}
+            self._pending_members = {}
+            if not watermarks and not dedupe and not members:
+                return 0
+
+            started = time.perf_counter()
+            rows = 0
+            try:
+                with self._conn:
+                    if watermarks:
+                        self._conn.executemany(
+                            'INSERT INTO watermarks (talker_id, ts) VALUES (?, ?) '
+                            'ON CONFLICT(talker_id) DO UPDATE SET ts = MAX(ts, excluded.ts)',
+                            watermarks
+                        )
+                        rows += len(watermarks)
+                    if dedupe:
+                        self._conn.executemany('INSERT OR REPLACE INTO dedupe (key, seen_at) VALUES (?, ?)', dedupe)
+                        self._conn.execute('DELETE FROM dedupe WHERE seen_at <= ?', (now - self.dedupe_ttl,))
+                        rows += len(dedupe)
+                    for kind, snapshot in members.items():
+                        self._conn.execute('DELETE FROM members WHERE kind = ?', (kind,))
+                        self._conn.executemany(
+                            'INSERT INTO members (kind, member, value) VALUES (?, ?, ?)',
+                            [(kind, member, value) for member, value in snapshot.items()]
+                        )
+                        rows += len(snapshot)
+            except sqlite3.Error:
+                # 写入失败时放回待写队列，下次刷新重试（新修改优先）
+                self._stats['errors'] += 1
+                for talker_id, ts in watermarks:
+                    self._pending_watermarks.setdefault(talker_id, ts)
+                for key, seen_at in dedupe:
+                    self._pending_dedupe.setdefault(key, seen_at)
+                for kind, snapshot in members.items():
+                    self._pending_members.setdefault(kind, snapshot)
+                raise
+
+            self._written_members.update(members)
+            self._stats['flushes'] += 1
+            self._stats['rows_written'] += rows
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            return rows
+
+    def clear(self):
+        """清空所有持久化状态和待写修改"""
+        with self._lock:
+            self._pending_watermarks = {}
+            self._pending_dedupe = {}
+            self._pending_members = {}
+            self._written_members = {}
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute('DELETE FROM watermarks')
+                    self._conn.execute('DELETE FROM dedupe')
+                    self._conn.execute('DELETE FROM members')
+
+    def stats(self) -> Dict[str, Any]:
+        """获取存储统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending_watermarks) + len(self._pending_dedupe) + len(self._pending_members)
+            stats['path'] = self.path
+            stats['open'] = self._conn is not None
+            return stats
@@ -236,5 +236,600 @@ class TestAIReplyAdapter:
         assert len(results) == 5
 
 
+def mock_chat_response(reply="缓存回复"):
+    """构造 RAG /chat 成功响应"""
+    response = Mock()
+    response.status_code = 200
+    response.json.return_value = {"success": True, "reply": reply}
+    return response
+
+
+class TestReplyCache:
+    """回复缓存测试套件"""
+
+    @pytest.fixture
+    def adapter(self):
+        from ai_adapter import AIReplyAdapter
+        return AIReplyAdapter(rag_service_url="http://127.0.0.1:8000", cache_ttl=60, cache_size=10)
+
+    def test_normalize_message(self):
+        """测试全半角、大小写、标点和 emoji 归一化"""
+        from ai_adapter import normalize_message
+        assert normalize_message("怎么买") == normalize_message("怎么买？")
+        assert normalize_message("怎么买!!🎉") == "怎么买"
+        assert normalize_message("ＶＩＰ 多少钱?") == "vip多少钱"
+        assert normalize_message("🎉🎉") == ""
+
+    def test_rephrased_question_hits_cache(self, adapter):
+        """测试同一问题的不同写法只请求一次 RAG 服务"""
+        with patch.object(adapter.session, 'post', return_value=mock_chat_response("点击链接购买")) as mock_post:
+            assert adapter.reply(message="怎么买", user_id="1", user_name="a") == "点击链接购买"
+            assert adapter.reply(message="怎么买？", user_id="2", user_name="b") == "点击链接购买"
+            assert mock_post.call_count == 1
+        stats = adapter.stats()['cache']
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+
+    def test_opt_out_and_scope(self, adapter):
+        """测试按请求跳过缓存以及按作用域区分缓存"""
+        with patch.object(adapter.session, 'post', return_value=mock_chat_response()) as mock_post:
+            adapter.reply(message="你好", user_id="1", user_name="a")
+            adapter.reply(message="你好", user_id="1", user_name="a", use_cache=False)
+            adapter.reply(message="你好", user_id="1", user_name="a", cache_scope="1")
+            adapter.reply(message="你好", user_id="1", user_name="a", cache_scope="1")
+            assert mock_post.call_count == 3
+
+    def test_failed_reply_not_cached(self, adapter):
+        """测试失败的回复不写入缓存"""
+        with patch.object(adapter.session, 'post') as mock_post:
+            mock_post.return_value.status_code = 500
+            assert adapter.reply(message="test", user_id="1", user_name="a") is None
+            mock_post.return_value = mock_chat_response("ok")
+            assert adapter.reply(message="test", user_id="1", user_name="a") == "ok"
+            assert mock_post.call_count == 2
+
+    def test_ttl_and_lru_bounds(self):
+        """测试缓存过期与容量淘汰"""
+        from ai_adapter import ReplyCache
+        now = [0.0]
+        cache = ReplyCache(ttl=10, capacity=2, clock=lambda: now[0])
+        cache.put('a', '1')
+        cache.put('b', '2')
+        assert cache.get('a') == '1'
+        cache.put('c', '3')
+        # 'b' 最久未使用，被淘汰
+        assert cache.get('b') is None
+        now[0] = 11
+        assert cache.get('a') is None
+        stats = cache.stats()
+        assert stats['evicted'] == 1
+        assert stats['expired'] == 1
+
+    def test_cache_disabled(self):
+        """测试容量为 0 时禁用缓存"""
+        from ai_adapter import AIReplyAdapter
+        adapter = AIReplyAdapter(cache_size=0)
+        with patch.object(adapter.session, 'post', return_value=mock_chat_response()) as mock_post:
+            adapter.reply(message="hi", user_id="1", user_name="a")
+            adapter.reply(message="hi", user_id="1", user_name="a")
+            assert mock_post.call_count == 2
+
+
+class TestConversationContext:
+    """对话上下文环形缓冲区测试套件"""
+
+    class Clock:
+        def __init__(self):
+            self.now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    def test_ring_keeps_latest_turns_in_order(self):
+        """测试每个用户只保留最近几轮，按时间顺序返回"""
+        from ai_adapter import ConversationContext
+        context = ConversationContext(turns=3)
+        for i in range(5):
+            context.add(1, 'user', f"消息{i}", timestamp=i)
+        assert [turn['content'] for turn in context.recent(1)] == ["消息2", "消息3", "消息4"]
+        assert [turn['content'] for turn in context.recent("1", limit=2)] == ["消息3", "消息4"]
+        assert context.recent(2) == []
+
+    def test_lru_and_idle_eviction(self):
+        """测试超过用户数上限淘汰最久未活跃的用户，空闲超时的用户被丢弃"""
+        from ai_adapter import ConversationContext
+        clock = self.Clock()
+        context = ConversationContext(turns=2, max_talkers=2, idle_ttl=100, clock=clock)
+        context.add(1, 'user', "a")
+        context.add(2, 'user', "b")
+        context.add(1, 'assistant', "c")
+        context.add(3, 'user', "d")
+        assert context.recent(2) == []
+        assert len(context) == 2
+
+        clock.now = 150
+        assert context.recent(1) == []
+        context.add(4, 'user', "e")
+        assert len(context) == 1
+        stats = context.stats()
+        assert stats['evicted'] == 1 and stats['expired'] == 2
+
+    def test_long_and_empty_content(self):
+        """测试超长内容被截断，空内容被忽略"""
+        from ai_adapter import ConversationContext
+        context = ConversationContext(max_chars=5)
+        context.add(1, 'user', "  ")
+        context.add(1, 'user', "一二三四五六七")
+        assert [turn['content'] for turn in context.recent(1)] == ["一二三四五"]
+
+    def test_history_sent_with_request(self):
+        """测试请求携带最近对话，当前消息不重复出现在 history 中"""
+        from ai_adapter import AIReplyAdapter
+        adapter = AIReplyAdapter(rag_service_url="http://127.0.0.1:8000", cache_size=0, context_turns=4)
+        adapter.remember("1", 'user', "有优惠吗")
+        adapter.remember("1", 'assistant', "新人九折")
+        adapter.remember("1", 'user', "怎么领")
+        with patch.object(adapter.session, 'post', return_value=mock_chat_response("点这里")) as mock_post:
+            adapter.reply(message="怎么领", user_id="1", user_name="a")
+            adapter.reply(message="你好", user_id="2", user_name="b")
+        first, second = [call.kwargs['json'] for call in mock_post.call_args_list]
+        assert first['history'] == [
+            {'role': 'user', 'content': "有优惠吗"},
+            {'role': 'assistant', 'content': "新人九折"}
+        ]
+        assert 'history' not in second
+
+    def test_history_scopes_cache_to_user(self):
+        """测试带上下文的回复只在该用户范围内缓存，不会发给其他用户；无上下文的用户仍共用缓存"""
+        from ai_adapter import AIReplyAdapter
+        adapter = AIReplyAdapter(rag_service_url="http://127.0.0.1:8000", context_turns=4)
+        adapter.remember("1", 'user', "我买了会员")
+        replies = [mock_chat_response("会员可以九折"), mock_chat_response("通用回复")]
+        with patch.object(adapter.session, 'post', side_effect=replies) as mock_post:
+            assert adapter.reply(message="有优惠吗", user_id="1", user_name="a") == "会员可以九折"
+            assert adapter.reply(message="有优惠吗", user_id="2", user_name="b") == "通用回复"
+            assert adapter.reply(message="有优惠吗", user_id="3", user_name="c") == "通用回复"
+            assert adapter.reply(message="有优惠吗", user_id="1", user_name="a") == "会员可以九折"
+        assert mock_post.call_count == 2
+
+    def test_context_disabled(self):
+        """测试 context_turns 为 0 时不记录也不发送上下文"""
+        from ai_adapter import AIReplyAdapter
+        adapter = AIReplyAdapter(rag_service_url="http://127.0.0.1:8000", cache_size=0, context_turns=0)
+        adapter.remember("1", 'user', "你好")
+        assert adapter.context is None
+        assert adapter.recent_turns("1") == []
+
+
+class TestRequestCoalescing:
+    """进行中请求合并测试套件"""
+
+    def slow_post(self, release, reply="共享回复"):
+        def post(*args, **kwargs):
+            release.wait(2)
+            return mock_chat_response(reply)
+        return post
+
+    def wait_for(self, predicate):
+        import time
+        deadline = time.time() + 2
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.005)
+        assert predicate()
+
+    def test_concurrent_identical_questions_share_one_call(self):
+        """测试并发的相同问题只发起一次上游调用"""
+        import concurrent.futures
+        import threading
+        from ai_adapter import AIReplyAdapter
+        adapter = AIReplyAdapter(cache_size=0)
+        release = threading.Event()
+
+        with patch.object(adapter.session, 'post', side_effect=self.slow_post(release)) as mock_post:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+                futures = [
+                    executor.submit(adapter.reply, message="怎么买" + "？" * i, user_id=str(i), user_name="u")
+                    for i in range(5)
+                ]
+                self.wait_for(lambda: adapter.inflight.stats()['shared'] == 4)
+                release.set()
+                results = [f.result(timeout=2) for f in futures]
+
+            assert mock_post.call_count == 1
+        assert results == ["共享回复"] * 5
+        stats = adapter.stats()['coalescing']
+        assert stats['calls'] == 1
+        assert stats['shared'] == 4
+        assert stats['in_flight'] == 0
+
+    def test_per_user_scope_and_opt_out_not_coalesced(self):
+        """测试按用户作用域或关闭合并的请求各自调用上游"""
+        import concurrent.futures
+        import threading
+        from ai_adapter import AIReplyAdapter
+        adapter = AIReplyAdapter(cache_size=0)
+        release = threading.Event()
+
+        with patch.object(adapter.session, 'post', side_effect=self.slow_post(release)) as mock_post:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+                futures = [
+                    executor.submit(adapter.reply, message="上次说的呢", user_id="1", user_name="u", cache_scope="1"),
+                    executor.submit(adapter.reply, message="上次说的呢", user_id="2", user_name="u", cache_scope="2"),
+                    executor.submit(adapter.reply, message="上次说的呢", user_id="3", user_name="u", coalesce=False),
+                ]
+                self.wait_for(lambda: mock_post.call_count == 3)
+                release.set()
+                [f.result(timeout=2) for f in futures]
+
+        assert adapter.stats()['coalescing']['shared'] == 0
+
+    def test_leader_error_shared_with_waiters(self):
+        """测试上游调用异常同样传给所有等待者"""
+        import threading
+        from ai_adapter import SingleFlight
+        flight = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def leader_call():
+            release.wait(2)
+            raise RuntimeError('boom')
+
+        def run():
+            try:
+                flight.do('k', leader_call)
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.wait_for(lambda: flight.stats()['shared'] == 2)
+        release.set()
+        for thread in threads:
+            thread.join(2)
+        assert len(errors) == 3
+
+
+class TestCircuitBreaker:
+    """熔断器测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        now = [0.0]
+        clock = lambda: now[0]
+        clock.now = now
+        return clock
+
+    def test_opens_on_error_rate_and_rejects(self, clock):
+        """测试错误率超过阈值后打开熔断并立即拒绝调用"""
+        from ai_adapter import CircuitBreaker
+        breaker = CircuitBreaker(error_rate=0.5, min_calls=4, open_seconds=30, clock=clock)
+        for ok in (True, False, True):
+            assert breaker.allow()
+            breaker.record(ok, 0.1)
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.allow()
+        breaker.record(False, 0.1)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.allow() is False
+        stats = breaker.stats()
+        assert stats['opened'] == 1
+        assert stats['rejected'] == 1
+        assert stats['error_rate'] == 0.5
+
+    def test_half_open_trial_closes_or_reopens(self, clock):
+        """测试打开时间届满后半开，试探成功关闭、失败重新打开"""
+        from ai_adapter import CircuitBreaker
+        breaker = CircuitBreaker(min_calls=1, open_seconds=10, clock=clock)
+        breaker.record(False, 0.1)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        clock.now[0] = 10
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow() is True
+        # 半开状态同时只放行一次试探
+        assert breaker.allow() is False
+        breaker.record(False, 0.1)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        clock.now[0] = 20
+        assert breaker.allow() is True
+        breaker.record(True, 0.1)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_release_does_not_record_or_close(self, clock):
+        """测试归还未使用的许可不计入统计，半开状态下释放试探名额但不关闭熔断"""
+        from ai_adapter import CircuitBreaker
+        breaker = CircuitBreaker(min_calls=1, open_seconds=10, clock=clock)
+        breaker.record(False, 0.1)
+        clock.now[0] = 10
+        assert breaker.allow() is True
+        breaker.release()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow() is True
+        assert breaker.stats()['window_calls'] == 1
+
+    def test_slow_calls_count_as_failures(self, clock):
+        """测试超过慢调用阈值的调用计为失败"""
+        from ai_adapter import CircuitBreaker
+        breaker = CircuitBreaker(min_calls=2, slow_call_seconds=1.0, clock=clock)
+        breaker.record(True, 5.0)
+        breaker.record(True, 5.0)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.stats()['latency_p50'] == 5.0
+
+    def test_background_probe_moves_to_half_open(self):
+        """测试打开期间后台探测成功后进入半开状态"""
+        import time
+        from ai_adapter import CircuitBreaker
+        probes = iter([False, True])
+        breaker = CircuitBreaker(min_calls=1, open_seconds=3600, probe=lambda: next(probes), probe_interval=0.01)
+        breaker.record(False, 0.1)
+        deadline = time.time() + 2
+        while breaker.state == CircuitBreaker.OPEN and time.time() < deadline:
+            time.sleep(0.01)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        stats = breaker.stats()
+        assert stats['probes'] == 2
+        assert stats['probe_failures'] == 1
+
+    def test_adapter_skips_rag_while_open(self):
+        """测试 RAG 故障时熔断打开，后续调用不再等待上游"""
+        from ai_adapter import AIReplyAdapter, CircuitBreaker
+        breaker = CircuitBreaker(min_calls=2, open_seconds=3600)
+        adapter = AIReplyAdapter(cache_size=0, breaker=breaker)
+        with patch.object(adapter.session, 'post', side_effect=requests.ConnectionError()) as mock_post:
+            assert adapter.reply(message="a", user_id="1", user_name="u") is None
+            assert adapter.reply(message="b", user_id="1", user_name="u") is None
+            assert mock_post.call_count == 2
+            assert adapter.reply(message="c", user_id="1", user_name="u") is None
+            assert mock_post.call_count == 2
+        with patch.object(adapter.session, 'get') as mock_get:
+            assert adapter.is_available() is False
+            mock_get.assert_not_called()
+        assert adapter.stats()['breaker']['state'] == 'open'
+
+    def test_business_failure_not_counted(self):
+        """测试业务失败（success=False）不触发熔断"""
+        from ai_adapter import AIReplyAdapter, CircuitBreaker
+        adapter = AIReplyAdapter(cache_size=0, breaker=CircuitBreaker(min_calls=1))
+        with patch.object(adapter.session, 'post') as mock_post:
+            mock_post.return_value.status_code = 200
+            mock_post.return_value.json.return_value = {"success": False}
+            adapter.reply(message="a", user_id="1", user_name="u")
+        assert adapter.breaker.state == CircuitBreaker.CLOSED
+
+    def test_health_result_cached(self):
+        """测试健康检查结果在有效期内复用"""
+        from ai_adapter import AIReplyAdapter
+        adapter = AIReplyAdapter(health_ttl=60)
+        with patch.object(adapter.session, 'get') as mock_get:
+            mock_get.return_value.status_code = 200
+            assert adapter.is_available() is True
+            assert adapter.is_available() is True
+            assert mock_get.call_count == 1
+
+
+class StubRAGServer:
+    """本地 RAG 桩服务（/chat、/chat/batch 与 /health），可配置延迟、状态码与是否提供批量接口"""
+
+    def __init__(self, reply="stub", delay=0.0, status=200, batch=False):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.reply = reply
+        self.delay = delay
+        self.status = status
+        self.batch = batch
+        self.requests = 0
+        self.batches = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                body = {"status": "ok"}
+                if stub.batch:
+                    body["features"] = ["chat_batch"]
+                self._send(stub.status, body)
+
+            def do_POST(self):
+                import time
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                time.sleep(stub.delay)
+                if self.path == '/chat/batch':
+                    if not stub.batch:
+                        self._send(404, {"detail": "Not Found"})
+                        return
+                    messages = [item["message"] for item in body["requests"]]
+                    stub.batches.append(messages)
+                    results = [{"success": True, "reply": f"{stub.reply}:{message}"} for message in messages]
+                    self._send(stub.status, {"success": True, "results": results})
+                    return
+                stub.requests += 1
+                self._send(stub.status, {"success": True, "reply": stub.reply})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_servers():
+    """创建本地桩服务的工厂，测试结束时关闭全部桩服务"""
+    created = []
+
+    def make(**kwargs):
+        server = StubRAGServer(**kwargs)
+        created.append(server)
+        return server
+
+    yield make
+    for server in created:
+        server.close()
+
+
+def make_adapter(urls, **kwargs):
+    """创建指向桩服务的适配器（默认关闭缓存，熔断器不会在测试中打开）"""
+    from ai_adapter import AIReplyAdapter, CircuitBreaker
+    kwargs.setdefault('breaker', CircuitBreaker(min_calls=1000))
+    kwargs.setdefault('cache_size', 0)
+    return AIReplyAdapter(rag_service_url=urls, timeout=2, **kwargs)
+
+
+class TestBackendPool:
+    """多副本负载均衡测试套件（本地桩服务）"""
+
+    def ask(self, adapter, i):
+        return adapter.reply(message=f"问题{i}", user_id=str(i), user_name="u")
+
+    def test_accepts_list_and_comma_separated_urls(self, stub_servers):
+        """测试副本地址支持列表和逗号分隔字符串"""
+        a, b = stub_servers(reply="a"), stub_servers(reply="b")
+        adapter = make_adapter(f"{a.url}, {b.url}/")
+        assert [backend.url for backend in adapter.pool.backends] == [a.url, b.url]
+        assert adapter.rag_service_url == a.url
+        assert self.ask(adapter, 0) in ("a", "b")
+
+    def test_prefers_faster_replica(self, stub_servers):
+        """测试按 EWMA 延迟偏向更快的副本"""
+        fast, slow = stub_servers(reply="fast"), stub_servers(reply="slow", delay=0.05)
+        adapter = make_adapter([fast.url, slow.url])
+        for i in range(20):
+            self.ask(adapter, i)
+        assert fast.requests > slow.requests
+        stats = {backend['url']: backend for backend in adapter.stats()['backends']}
+        assert stats[fast.url]['ewma_ms'] < stats[slow.url]['ewma_ms']
+        assert stats[fast.url]['in_flight'] == 0
+
+    def test_fails_over_to_healthy_replica(self, stub_servers):
+        """测试副本故障时切换到其他副本，并暂时摘除故障副本"""
+        broken, healthy = stub_servers(status=500), stub_servers(reply="ok")
+        adapter = make_adapter([broken.url, healthy.url])
+        replies = [self.ask(adapter, i) for i in range(10)]
+        assert replies == ["ok"] * 10
+        stats = {backend['url']: backend for backend in adapter.stats()['backends']}
+        assert stats[broken.url]['errors'] == broken.requests
+        # 连续失败 3 次后被摘除，不再收到请求
+        assert broken.requests <= 3
+        assert stats[broken.url]['ejected'] is True
+
+    def test_all_replicas_down(self, stub_servers):
+        """测试全部副本故障时返回 None"""
+        a, b = stub_servers(status=503), stub_servers(status=503)
+        adapter = make_adapter([a.url, b.url])
+        assert self.ask(adapter, 0) is None
+        assert a.requests == 1 and b.requests == 1
+        assert adapter.breaker.stats()['error_rate'] == 1.0
+
+    def test_hedges_slow_request_to_second_replica(self, stub_servers):
+        """测试首个请求超过阈值时对冲到另一个副本并采用先返回的结果"""
+        import time
+        slow, fast = stub_servers(reply="slow", delay=0.5), stub_servers(reply="fast")
+        adapter = make_adapter([slow.url, fast.url], hedge=True, hedge_after=0.05)
+        # 固定先选中慢副本
+        adapter.pool.backends[1].ewma = 10.0
+        started = time.monotonic()
+        assert self.ask(adapter, 0) == "fast"
+        assert time.monotonic() - started < 0.4
+        stats = {backend['url']: backend for backend in adapter.stats()['backends']}
+        assert stats[fast.url]['hedged'] == 1
+        assert stats[fast.url]['hedge_wins'] == 1
+
+
+class TestBatchReplies:
+    """批量回复测试套件（本地桩服务）"""
+
+    def items(self, count):
+        return [{"message": f"问题{i}", "user_id": str(i), "user_name": "u"} for i in range(count)]
+
+    def test_reply_many_uses_batch_endpoint(self, stub_servers):
+        """测试副本提供批量接口时按批大小分批发送，结果按顺序对应"""
+        stub = stub_servers(reply="b", batch=True)
+        adapter = make_adapter(stub.url, batch_size=3)
+        replies = adapter.reply_many(self.items(5))
+        assert replies == [f"b:问题{i}" for i in range(5)]
+        assert stub.batches == [["问题0", "问题1", "问题2"], ["问题3", "问题4"]]
+        assert stub.requests == 0
+        backend = adapter.stats()['backends'][0]
+        assert backend['supports_batch'] is True
+        assert backend['batches'] == 2
+        assert backend['in_flight'] == 0
+
+    def test_reply_many_falls_back_to_single_calls(self, stub_servers):
+        """测试副本不支持批量接口时并行发送单条请求"""
+        stub = stub_servers(reply="single")
+        adapter = make_adapter(stub.url, batch_size=4)
+        assert adapter.reply_many(self.items(3)) == ["single"] * 3
+        assert stub.requests == 3
+        assert stub.batches == []
+        backend = adapter.stats()['backends'][0]
+        assert backend['supports_batch'] is False
+        assert backend['in_flight'] == 0
+        # 未发出的批量请求不计入熔断统计，只记录实际发出的单条请求
+        assert adapter.breaker.stats()['window_calls'] == 3
+
+    def test_reply_many_uses_cache_and_skips_empty(self, stub_servers):
+        """测试已缓存和空消息不进入批次"""
+        stub = stub_servers(reply="b", batch=True)
+        from ai_adapter import normalize_message
+        adapter = make_adapter(stub.url, cache_size=100)
+        adapter.cache.put((None, normalize_message("问题0")), "cached")
+        items = self.items(3) + [{"message": "  ", "user_id": "9", "user_name": "u"}]
+        assert adapter.reply_many(items) == ["cached", "b:问题1", "b:问题2", None]
+        assert stub.batches == [["问题1", "问题2"]]
+        # 批量结果写入缓存
+        assert adapter.reply_many(self.items(3)) == ["cached", "b:问题1", "b:问题2"]
+        assert len(stub.batches) == 1
+
+    def test_reply_many_scopes_cache_to_user_history(self, stub_servers):
+        """测试批量回复中依据对话上下文生成的回复只缓存给该用户，不会发给其他用户"""
+        stub = stub_servers(reply="b", batch=True)
+        adapter = make_adapter(stub.url, cache_size=100)
+        items = [
+            {"message": "有优惠吗", "user_id": "1", "user_name": "u", "history": [{"role": "user", "content": "我是年度会员"}]},
+            {"message": "有优惠吗", "user_id": "2", "user_name": "u", "history": [{"role": "user", "content": "我是新用户"}]},
+        ]
+        assert adapter.reply_many(items) == ["b:有优惠吗"] * 2
+        assert stub.batches == [["有优惠吗", "有优惠吗"]]
+
+        # 同一用户带上下文再次提问命中自己的缓存；没有上下文的用户不会拿到带上下文的回复
+        assert adapter.reply_many(items[:1]) == ["b:有优惠吗"]
+        assert len(stub.batches) == 1
+        adapter.reply_many([{"message": "有优惠吗", "user_id": "3", "user_name": "u", "history": []}] * 2)
+        assert len(stub.batches) == 2
+
+    def test_concurrent_replies_are_micro_batched(self, stub_servers):
+        """测试开启攒批后并发的单条请求合并为一个批次"""
+        from concurrent.futures import ThreadPoolExecutor
+        stub = stub_servers(reply="b", batch=True)
+        adapter = make_adapter(stub.url, batch_size=4, batch_linger=0.2)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            replies = list(executor.map(
+                lambda i: adapter.reply(message=f"问题{i}", user_id=str(i), user_name="u"), range(4)
+            ))
+        assert replies == [f"b:问题{i}" for i in range(4)]
+        assert len(stub.batches) == 1
+        assert sorted(stub.batches[0]) == [f"问题{i}" for i in range(4)]
+        assert adapter.stats()['batcher']['max_batch_seen'] == 4
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,130 @@
+"""
+AI 回复流水线测试用例
+测试异步生成、截止时间降级、等待数上限和异常处理
+"""
+
+import threading
+
+import pytest
+
+from ai_pipeline import AIReplyPipeline
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAIReplyPipeline:
+    """AIReplyPipeline 测试套件"""
+
+    @pytest.fixture
+    def results(self):
+        return []
+
+    def make_pipeline(self, generate, results, **kwargs):
+        done = threading.Event()
+
+        def on_result(payload, reply, error):
+            results.append((payload, reply, error))
+            done.set()
+
+        pipeline = AIReplyPipeline(generate, on_result, **kwargs)
+        pipeline.start()
+        pipeline.done = done
+        return pipeline
+
+    def test_submit_returns_immediately_and_delivers_result(self, results):
+        """测试提交后立即返回，生成完成时回调结果"""
+        release = threading.Event()
+
+        def generate(payload):
+            release.wait(2)
+            return f"回复:{payload}"
+
+        pipeline = self.make_pipeline(generate, results)
+        future = pipeline.submit('你好')
+        assert future is not None and not future.done()
+        assert pipeline.pending_count() == 1
+
+        release.set()
+        assert pipeline.done.wait(2)
+        assert results == [('你好', '回复:你好', None)]
+        stats = pipeline.stats()
+        assert stats['completed'] == 1
+        assert stats['pending'] == 0
+        pipeline.shutdown(wait=True)
+
+    def test_expired_request_claimed_once_and_late_result_dropped(self, results):
+        """测试超过截止时间的请求交给调用方降级，迟到的结果被丢弃"""
+        clock = FakeClock()
+        release = threading.Event()
+        finished = threading.Event()
+
+        def generate(payload):
+            release.wait(2)
+            finished.set()
+            return 'late'
+
+        pipeline = self.make_pipeline(generate, results, deadline=5.0, clock=clock)
+        future = pipeline.submit('slow')
+        assert pipeline.expire() == []
+
+        clock.now = 6.0
+        assert pipeline.expire() == ['slow']
+        assert pipeline.expire() == []
+
+        release.set()
+        future.result(timeout=2)
+        assert finished.wait(2)
+        pipeline.shutdown(wait=True)
+        assert results == []
+        stats = pipeline.stats()
+        assert stats['timed_out'] == 1
+        assert stats['late'] == 1
+
+    def test_per_request_deadline(self, results):
+        """测试单个请求可指定截止时间"""
+        clock = FakeClock()
+        release = threading.Event()
+        pipeline = self.make_pipeline(lambda payload: release.wait(2), results, deadline=100.0, clock=clock)
+        pipeline.submit('a', deadline=1.0)
+        pipeline.submit('b')
+        clock.now = 2.0
+        assert pipeline.expire() == ['a']
+        release.set()
+        pipeline.shutdown(wait=True)
+
+    def test_rejects_when_full_or_stopped(self, results):
+        """测试等待数已满或未启动时拒绝提交"""
+        release = threading.Event()
+        pipeline = self.make_pipeline(lambda payload: release.wait(2), results, max_pending=1)
+        assert pipeline.submit('a') is not None
+        assert pipeline.submit('b') is None
+        release.set()
+        assert pipeline.shutdown(wait=True) <= 1
+        assert pipeline.submit('c') is None
+        assert pipeline.stats()['rejected'] == 2
+
+    def test_generation_error_reported(self, results):
+        """测试生成异常通过回调上报"""
+        def generate(payload):
+            raise ValueError('boom')
+
+        pipeline = self.make_pipeline(generate, results)
+        pipeline.submit('x')
+        assert pipeline.done.wait(2)
+        payload, reply, error = results[0]
+        assert payload == 'x' and reply is None
+        assert isinstance(error, ValueError)
+        assert pipeline.stats()['errors'] == 1
+        pipeline.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
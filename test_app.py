@@ -0,0 +1,321 @@
+"""
+应用层测试用例
+测试 AI 回复生成时对话上下文不会通过缓存或请求合并泄露给其他用户，连发模式按消息序号识别新消息、关注者集合的并发更新，回复图片只在变化时预上传，以及监控停止后不再投递发送任务、停止后台线程，以及手动回复经发送队列投递
+"""
+
+import json
+import os
+import threading
+
+from unittest.mock import Mock, patch
+
+import pytest
+
+import app
+from ai_adapter import AIReplyAdapter
+
+
+def mock_chat_response(reply):
+    """构造 RAG /chat 成功响应"""
+    response = Mock()
+    response.status_code = 200
+    response.json.return_value = {"success": True, "reply": reply}
+    return response
+
+
+class TestGenerateAIReply:
+    """generate_ai_reply 测试套件"""
+
+    @pytest.fixture
+    def adapter(self, monkeypatch):
+        adapter = AIReplyAdapter(rag_service_url="http://127.0.0.1:8000", context_turns=6)
+        monkeypatch.setattr(app, 'ai_agent', adapter)
+        return adapter
+
+    def request(self, talker_id, message):
+        return {'talker_id': talker_id, 'message': message, 'timestamp': 0}
+
+    def test_context_reply_not_shared_across_users(self, adapter):
+        """测试依据用户 A 对话上下文生成的回复不会被缓存后发给用户 B"""
+        app.remember_turn(1001, 'user', "我昨天买了年度会员")
+        app.remember_turn(1001, 'assistant', "感谢支持")
+        replies = [mock_chat_response("年度会员可以再享九折"), mock_chat_response("新用户首单九五折")]
+        with patch.object(adapter.session, 'post', side_effect=replies) as mock_post:
+            assert app.generate_ai_reply(self.request(1001, "有优惠吗")) == "年度会员可以再享九折"
+            assert app.generate_ai_reply(self.request(2002, "有优惠吗")) == "新用户首单九五折"
+        first, second = [call.kwargs['json'] for call in mock_post.call_args_list]
+        assert len(first['history']) == 2
+        assert 'history' not in second
+
+    def test_replies_without_context_still_cached(self, adapter):
+        """测试没有对话上下文的用户之间仍共用回复缓存"""
+        with patch.object(adapter.session, 'post', return_value=mock_chat_response("在的")) as mock_post:
+            assert app.generate_ai_reply(self.request(3003, "在吗")) == "在的"
+            assert app.generate_ai_reply(self.request(4004, "在吗？")) == "在的"
+        assert mock_post.call_count == 1
+
+
+class FakeMessageAPI:
+    """按序号返回会话消息的 API 替身"""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.fetches = []
+
+    def get_messages_after(self, talker_id, begin_seqno=None, size=20):
+        self.fetches.append(begin_seqno)
+        return [msg for msg in self.messages if not begin_seqno or msg['msg_seqno'] > begin_seqno]
+
+
+def text_msg(seqno, timestamp, text, sender_uid=5005):
+    return {'msg_seqno': seqno, 'timestamp': timestamp, 'sender_uid': sender_uid, 'msg_type': 1,
+            'content': json.dumps({'content': text})}
+
+
+class TestBurstMode:
+    """连发模式测试套件"""
+
+    MY_UID = 1
+
+    @pytest.fixture(autouse=True)
+    def burst_config(self, monkeypatch):
+        monkeypatch.setitem(app.config, 'burst_mode_enabled', True)
+        monkeypatch.setitem(app.config, 'only_reply_new_messages', False)
+        monkeypatch.setitem(app.config, 'default_reply_enabled', True)
+        monkeypatch.setitem(app.config, 'default_reply_type', 'text')
+        monkeypatch.setitem(app.config, 'default_reply_message', '收到')
+        monkeypatch.setattr(app, 'ai_agent', None)
+        monkeypatch.setattr(app, 'state_store', None)
+        monkeypatch.setattr(app, 'last_message_times', {})
+        monkeypatch.setattr(app, 'last_message_seqnos', {})
+
+    def test_same_second_message_is_processed(self):
+        """测试与已处理消息同一秒发送、序号更新的消息不会被跳过"""
+        talker_id = 5005
+        first = text_msg(100, 1700000000, "第一条-同秒测试")
+        api = FakeMessageAPI([first])
+        session = {'talker_id': talker_id, 'unread_count': 1, 'last_msg': first}
+        assert len(app.process_single_session(api, self.MY_UID, session)) == 1
+        assert app.last_message_seqnos[talker_id] == 100
+
+        second = text_msg(101, 1700000000, "第二条-同秒测试")
+        api.messages.append(second)
+        session = {'talker_id': talker_id, 'unread_count': 1, 'last_msg': second}
+        results = app.process_single_session(api, self.MY_UID, session)
+        assert len(results) == 1
+        assert results[0]['message'] == "第二条-同秒测试"
+        assert app.last_message_seqnos[talker_id] == 101
+
+        # 已处理的序号不再重复处理
+        assert app.process_single_session(api, self.MY_UID, session) == []
+
+    def test_same_second_burst_fetched_after_seqno(self):
+        """测试同一秒连发的多条消息按序号水位拉取并合并处理"""
+        talker_id = 6006
+        app.record_watermark(talker_id, 1700000000, 200)
+        messages = [text_msg(201, 1700000000, "连发一"), text_msg(202, 1700000000, "连发二")]
+        api = FakeMessageAPI(messages)
+        session = {'talker_id': talker_id, 'unread_count': 2, 'last_msg': messages[-1]}
+        results = app.process_single_session(api, self.MY_UID, session)
+        assert api.fetches == [200]
+        assert len(results) == 1
+        assert results[0]['message'] == "连发一\n连发二"
+
+
+class FakeFollowerAPI:
+    """返回最近关注者快照的 API 替身，第二次请求（批量核对）时调用 on_verify"""
+
+    def __init__(self, snapshots, on_verify=None):
+        self.snapshots = list(snapshots)
+        self.on_verify = on_verify
+        self.limits = []
+
+    def get_recent_followers(self, limit=20):
+        self.limits.append(limit)
+        if len(self.limits) == 2 and self.on_verify:
+            self.on_verify()
+        return [{'mid': mid, 'mtime': mtime} for mid, mtime in self.snapshots.pop(0)]
+
+
+class TestFollowerState:
+    """关注者集合并发更新测试套件"""
+
+    @pytest.fixture(autouse=True)
+    def follower_state(self, monkeypatch):
+        monkeypatch.setitem(app.config, 'follow_reply_enabled', False)
+        monkeypatch.setitem(app.config, 'unfollow_reply_enabled', True)
+        monkeypatch.setitem(app.config, 'follow_snapshot_size', 2)
+        monkeypatch.setitem(app.config, 'follow_verify_size', 50)
+        monkeypatch.setattr(app, 'followers_cache', {1, 2, 3})
+        monkeypatch.setattr(app, 'welcome_sent_cache', {1})
+        monkeypatch.setattr(app, 'unfollowers_cache', set())
+        monkeypatch.setattr(app, 'follow_history', {1: 100, 2: 200, 3: 300})
+        monkeypatch.setattr(app, 'follower_reconciler', None)
+        self.sent = []
+        monkeypatch.setattr(app, 'enqueue_send', lambda kind, payload: self.sent.append((kind, payload['mid'])) or True)
+
+    def test_reconciled_removal_during_verification_is_kept(self):
+        """测试批量核对请求期间全量对账确认的取消关注不会被覆盖，也不会重复发送告别消息"""
+        api = FakeFollowerAPI(
+            [[(4, 400), (3, 300)], [(4, 400), (3, 300), (2, 200)]],
+            on_verify=lambda: app.handle_reconciled_followers([], [1])
+        )
+        current, recent = app.fetch_follower_snapshot(api, 2, {'requests': 0})
+        result = app.diff_follower_snapshot(api, current, recent, 2, 1000, {'requests': 1})
+
+        assert api.limits == [2, 50]
+        assert result['unfollowers'] == []
+        assert self.sent == [('goodbye', 1)]
+        assert app.unfollowers_cache == {1}
+        assert app.welcome_sent_cache == set()
+        assert app.followers_cache == {3, 4}
+
+    def test_flush_state_copies_under_lock(self, monkeypatch):
+        """测试保存状态时复制集合，写入期间其他线程修改集合不影响本次快照"""
+        written = {}
+
+        class FakeStore:
+            def replace_members(self, name, members):
+                written[name] = members
+                app.handle_reconciled_followers([], [3])
+
+            def flush(self):
+                pass
+
+        monkeypatch.setattr(app, 'state_store', FakeStore())
+        app.flush_state(force=True)
+        assert written['followers'] == {1, 2, 3}
+        assert written['followers'] is not app.followers_cache
+        assert 3 not in app.followers_cache
+
+
+class TestUploadWarmup:
+    """回复图片预上传测试套件"""
+
+    @pytest.fixture
+    def warm_calls(self, monkeypatch, tmp_path):
+        self.image = tmp_path / 'reply.png'
+        self.image.write_bytes(b'image')
+        monkeypatch.setitem(app.config, 'upload_warmup_enabled', True)
+        monkeypatch.setitem(app.config, 'sessdata', 'sess')
+        monkeypatch.setitem(app.config, 'bili_jct', 'csrf')
+        for prefix in ('default_reply', 'follow_reply', 'unfollow_reply'):
+            monkeypatch.setitem(app.config, f'{prefix}_type', 'text')
+        monkeypatch.setattr(app, 'rules', [{'reply_type': 'image', 'reply_image': str(self.image)}])
+        monkeypatch.setattr(app, 'upload_warmup_thread', None)
+        monkeypatch.setattr(app, 'upload_warmup_signature', None)
+        calls = []
+        cache = Mock()
+        cache.warm.side_effect = lambda images, upload, workers: calls.append(images) or None
+        monkeypatch.setattr(app, 'get_upload_cache', lambda: cache)
+        return calls
+
+    def warm(self):
+        thread = app.start_upload_warmup()
+        if thread is not None:
+            thread.join(2)
+        return thread is not None
+
+    def test_warmup_only_when_images_change(self, warm_calls, tmp_path):
+        """测试重复预编译不重复预热，图片修改或新增图片规则后才重新预热"""
+        assert self.warm()
+        assert not self.warm()
+        assert warm_calls == [[str(self.image)]]
+
+        self.image.write_bytes(b'changed image')
+        os.utime(self.image, ns=(1, 1))
+        assert self.warm()
+
+        other = tmp_path / 'other.png'
+        other.write_bytes(b'other')
+        app.rules.append({'reply_type': 'image', 'reply_image': str(other)})
+        assert self.warm()
+        assert not self.warm()
+        assert len(warm_calls) == 3
+
+
+class TestEnqueueSend:
+    """发送任务投递测试套件"""
+
+    def test_drops_job_when_outbox_stopped(self, monkeypatch):
+        """测试监控停止后投递的任务被丢弃，不会重新启动发送线程"""
+        monkeypatch.setattr(app, 'outbox', None)
+        assert app.enqueue_send('goodbye', {'mid': 42}) is False
+        assert app.outbox is None
+
+        stopped = app.Outbox(lambda kind, payload: None, workers=1)
+        stopped.start()
+        stopped.stop(drain=True, timeout=1)
+        monkeypatch.setattr(app, 'outbox', stopped)
+        assert app.enqueue_send('reply', {'talker_id': 7}) is False
+        assert app.outbox is stopped
+
+
+class TestMonitorTeardown:
+    """监控退出时停止后台线程测试套件"""
+
+    def test_monitor_exit_stops_workers(self, monkeypatch):
+        """测试监控线程非 /api/stop 退出（如认证失效）时同样停止后台线程"""
+        class FailingAPI:
+            def __init__(self, sessdata, bili_jct):
+                pass
+
+            def get_my_uid(self):
+                app.monitoring = False  # 发送线程遇到认证失效时置为 False
+                raise RuntimeError("auth failed")
+
+        stops = []
+        monkeypatch.setitem(app.config, 'sessdata', 'sess')
+        monkeypatch.setitem(app.config, 'bili_jct', 'csrf')
+        monkeypatch.setattr(app, 'BilibiliAPI', FailingAPI)
+        monkeypatch.setattr(app, 'stop_monitor_workers', lambda: stops.append(True))
+        monkeypatch.setattr(app, 'monitor_thread', None)
+        monkeypatch.setattr(app, 'monitoring', True)
+        app.monitor_messages()
+        assert stops == [True]
+
+    def test_stale_monitor_thread_does_not_stop_new_workers(self, monkeypatch):
+        """测试重新启动后迟退出的旧监控线程不会停止新监控的后台线程"""
+        stops = []
+        monkeypatch.setitem(app.config, 'sessdata', 'sess')
+        monkeypatch.setitem(app.config, 'bili_jct', 'csrf')
+        monkeypatch.setattr(app, 'stop_monitor_workers', lambda: stops.append(True))
+        monkeypatch.setattr(app, 'monitor_thread', threading.Thread(target=lambda: None))
+        monkeypatch.setattr(app, 'monitoring', False)
+        app.monitor_messages()
+        assert stops == []
+
+    def test_follower_sync_exits_when_monitoring_stops(self, monkeypatch):
+        """测试监控已停止时关注者检测线程退出循环"""
+        monkeypatch.setattr(app, 'monitoring', False)
+        monkeypatch.setitem(app.config, 'follow_reply_enabled', True)
+        monkeypatch.setattr(app, 'check_followers_changes', Mock(side_effect=AssertionError("不应再检测")))
+        app.follower_sync_stop.clear()
+        thread = threading.Thread(target=app.run_follower_sync)
+        thread.start()
+        thread.join(1)
+        assert not thread.is_alive()
+
+
+class TestSendManualReply:
+    """手动回复投递接口测试套件"""
+
+    def test_manual_reply_goes_through_outbox(self, monkeypatch):
+        """测试手动回复投递到监控的发送队列，与监控共用发送限速"""
+        client = app.app.test_client()
+        monkeypatch.setattr(app, 'outbox', None)
+        response = client.post('/api/send-reply', json={'talker_id': 42, 'message': "你好"})
+        assert response.get_json() == {'success': False, 'error': '监控未运行', 'monitoring': False}
+
+        jobs = []
+        queue = app.Outbox(lambda kind, payload: jobs.append((kind, payload)), workers=1)
+        queue.start()
+        monkeypatch.setattr(app, 'outbox', queue)
+        assert client.post('/api/send-reply', json={'talker_id': 42, 'message': " "}).get_json()['success'] is False
+        assert client.post('/api/send-reply', json={'talker_id': 42, 'message': "你好"}).get_json()['success'] is True
+        queue.stop(drain=True, timeout=2)
+        assert jobs == [('reply', {'talker_id': 42, 'rule': {'title': '手动发送', 'reply': "你好", 'reply_type': 'text'}})]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,99 @@
+"""
+消息去重存储测试用例
+测试去重、TTL 过期、容量淘汰和统计
+"""
+
+import pytest
+
+from dedupe_store import DedupeStore
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDedupeStore:
+    """DedupeStore 测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    def test_add_reports_duplicates(self, clock):
+        """测试重复键被识别"""
+        store = DedupeStore(ttl=10, capacity=10, clock=clock)
+        assert store.add('a') is True
+        assert store.add('a') is False
+        assert 'a' in store
+        assert 'b' not in store
+        stats = store.stats()
+        assert stats['inserts'] == 1
+        assert stats['duplicates'] == 1
+
+    def test_entries_expire_after_ttl(self, clock):
+        """测试条目超过 TTL 后过期并可重新记录"""
+        store = DedupeStore(ttl=10, capacity=10, clock=clock)
+        store.add('a')
+        clock.now = 5
+        store.add('b')
+        clock.now = 10
+        assert 'a' not in store
+        assert store.expire() == 1
+        assert len(store) == 1
+        assert store.add('a') is True
+        clock.now = 15
+        # 插入时顺带清理队头的过期条目
+        store.add('c')
+        assert 'b' not in store
+        assert store.stats()['expired'] == 2
+
+    def test_capacity_evicts_oldest(self, clock):
+        """测试超出容量时淘汰最早插入的条目"""
+        store = DedupeStore(ttl=100, capacity=3, clock=clock)
+        for key in 'abcde':
+            store.add(key)
+        assert len(store) == 3
+        assert 'a' not in store and 'b' not in store
+        assert 'e' in store
+        assert store.stats()['evicted'] == 2
+
+    def test_duplicate_hit_does_not_reorder(self, clock):
+        """测试重复命中不调整位置，淘汰按插入顺序先进先出"""
+        store = DedupeStore(ttl=100, capacity=2, clock=clock)
+        store.add('a')
+        store.add('b')
+        assert store.add('a') is False
+        store.add('c')
+        assert 'a' not in store and 'b' in store and 'c' in store
+
+    def test_configure_shrinks_capacity_and_ttl(self, clock):
+        """测试调整容量与 TTL"""
+        store = DedupeStore(ttl=100, capacity=10, clock=clock)
+        for key in 'abcd':
+            store.add(key)
+        store.configure(ttl=5, capacity=2)
+        assert len(store) == 2
+        clock.now = 6
+        store.add('x')
+        clock.now = 12
+        # 新条目已过期，即使旧条目仍在队头也能重新记录
+        assert 'x' not in store
+        assert store.add('x') is True
+
+    def test_clear(self, clock):
+        """测试清空"""
+        store = DedupeStore(clock=clock)
+        store.add('a')
+        store.clear()
+        assert len(store) == 0
+        assert store.add('a') is True
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,149 @@
+"""
+送达验证测试用例
+测试快照批量确认、超时定向核对和抽样
+"""
+
+import pytest
+
+from delivery_verifier import DeliveryVerifier
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeliveryVerifier:
+    """DeliveryVerifier 测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def verifier(self, clock):
+        return DeliveryVerifier(deadline=5.0, clock=clock)
+
+    def test_confirm_from_session_snapshot(self, verifier):
+        """测试会话列表快照中出现 msg_key 即确认送达"""
+        verifier.track('k1', 100, 'hello')
+        verifier.track('k2', 200, 'world')
+        sessions = [
+            {'talker_id': 100, 'last_msg': {'msg_key': 'k1'}},
+            {'talker_id': 300, 'last_msg': {'msg_key': 'other'}},
+        ]
+        assert verifier.confirm_from_sessions(sessions) == 1
+        stats = verifier.stats()
+        assert stats['confirmed_snapshot'] == 1
+        assert stats['pending'] == 1
+
+    def test_consecutive_sends_confirmed_by_last_key(self, verifier):
+        """测试连发两条消息时，快照中出现后一条即同时确认前一条"""
+        verifier.track('text', 100, '文字')
+        verifier.track('image', 100, '[图片]')
+        verifier.track('other', 200, '其他会话')
+        assert verifier.confirm_from_sessions([{'talker_id': 100, 'last_msg': {'msg_key': 'image'}}]) == 2
+        assert verifier.stats()['pending'] == 1
+
+    def test_newer_reply_confirms_pending(self, clock):
+        """测试对方在下次快照前回复（last_msg 时间不早于发送时间）时确认该会话的待确认消息"""
+        wall = iter([1000.5, 1000.9, 1000.9])
+        verifier = DeliveryVerifier(clock=clock, wall_clock=lambda: next(wall))
+        verifier.track('k1', 100)
+        verifier.track('k2', 100)
+        verifier.track('k3', 200)
+        sessions = [
+            {'talker_id': 100, 'last_msg': {'msg_key': 'reply', 'timestamp': 1000}},
+            {'talker_id': 200, 'last_msg': {'msg_key': 'old', 'timestamp': 999}},
+        ]
+        assert verifier.confirm_from_sessions(sessions) == 2
+        assert verifier.stats()['pending'] == 1
+
+    def test_expired_grouped_by_talker_once(self, verifier, clock):
+        """测试超时未确认的消息按会话分组，且只取出一次"""
+        verifier.track('k1', 100)
+        verifier.track('k2', 100)
+        verifier.track('k3', 200)
+        assert verifier.collect_expired() == {}
+
+        clock.now = 6.0
+        expired = verifier.collect_expired()
+        assert sorted(expired[100]) == ['k1', 'k2']
+        assert expired[200] == ['k3']
+        assert verifier.collect_expired() == {}
+
+    def test_confirm_from_messages(self, verifier, clock):
+        """测试定向拉取结果核对送达"""
+        verifier.track('k1', 100, 'a')
+        verifier.track('k2', 100, 'b')
+        clock.now = 6.0
+        keys = verifier.collect_expired()[100]
+
+        confirmed, failed = verifier.confirm_from_messages(100, keys, [{'msg_key': 'k1'}, {'msg_key': 'x'}])
+        assert [p.msg_key for p in confirmed] == ['k1']
+        assert [p.content for p in failed] == ['b']
+        stats = verifier.stats()
+        assert stats['confirmed_fetch'] == 1
+        assert stats['failed'] == 1
+        assert stats['fetches'] == 1
+        assert stats['pending'] == 0
+
+    def test_fetch_failure_requeues(self, verifier, clock):
+        """测试定向拉取失败时不判定未送达，重新等待下次核对，超过三倍期限后不再跟踪"""
+        verifier.track('k1', 100)
+        clock.now = 6.0
+        assert verifier.collect_expired() == {100: ['k1']}
+        assert verifier.confirm_from_messages(100, ['k1'], None) == ([], [])
+        assert verifier.stats()['pending'] == 1
+        assert verifier.collect_expired() == {}
+
+        clock.now = 11.0
+        assert verifier.collect_expired() == {100: ['k1']}
+        clock.now = 16.0
+        assert verifier.confirm_from_messages(100, ['k1'], None) == ([], [])
+        stats = verifier.stats()
+        assert stats['pending'] == 0
+        assert stats['failed'] == 0
+        assert stats['unverifiable'] == 1
+        assert stats['fetch_errors'] == 2
+
+    def test_lost_fetch_job_times_out(self, verifier, clock):
+        """测试定向核对任务丢失时超期判定失败"""
+        verifier.track('k1', 100)
+        clock.now = 6.0
+        verifier.collect_expired()
+        clock.now = 16.0
+        verifier.collect_expired()
+        stats = verifier.stats()
+        assert stats['failed'] == 1
+        assert stats['pending'] == 0
+
+    def test_sampling_and_missing_key(self, clock):
+        """测试抽样跳过和缺少 msg_key 的情况"""
+        values = iter([0.1, 0.9])
+        verifier = DeliveryVerifier(sample_rate=0.5, clock=clock, rand=lambda: next(values))
+        assert verifier.track('k1', 1) is True
+        assert verifier.track('k2', 1) is False
+        assert verifier.track(None, 1) is False
+        stats = verifier.stats()
+        assert stats['tracked'] == 1
+        assert stats['sampled_out'] == 1
+        assert stats['untracked'] == 1
+
+    def test_pending_is_bounded(self, clock):
+        """测试待确认记录数量受上限约束"""
+        verifier = DeliveryVerifier(max_pending=2, clock=clock)
+        for i in range(5):
+            verifier.track(f'k{i}', i)
+        stats = verifier.stats()
+        assert stats['pending'] == 2
+        assert stats['evicted'] == 3
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,184 @@
+"""
+关注者存储测试用例
+测试有序整数集合差集、分页对账、取消关注确认、请求预算与续传
+"""
+
+from array import array
+
+import pytest
+
+from follower_store import FollowerReconciler, FollowerSet, diff_sorted, sorted_unique
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeFollowers:
+    """按关注时间倒序分页返回的关注者列表"""
+
+    def __init__(self, mids):
+        self.mids = list(mids)  # 最新关注的在前
+        self.calls = []
+        self.fail_pages = set()
+
+    def __call__(self, page, page_size):
+        self.calls.append(page)
+        if page in self.fail_pages:
+            return None
+        start = (page - 1) * page_size
+        return self.mids[start:start + page_size]
+
+
+class TestFollowerSet:
+    """FollowerSet 与有序数组工具测试套件"""
+
+    def test_sorted_unique_and_contains(self):
+        """测试排序去重与二分查找成员"""
+        followers = FollowerSet.from_iterable([5, 3, 5, 1, 2 ** 40])
+        assert list(followers) == [1, 3, 5, 2 ** 40]
+        assert 3 in followers and 2 ** 40 in followers
+        assert 4 not in followers and -1 not in followers
+        assert followers.nbytes == 32
+
+    def test_diff_sorted(self):
+        """测试有序数组差集"""
+        added, removed = diff_sorted(sorted_unique([1, 2, 3, 7]), sorted_unique([2, 3, 4, 8, 9]))
+        assert list(added) == [4, 8, 9]
+        assert list(removed) == [1, 7]
+        added, removed = diff_sorted(array('Q'), sorted_unique([1]))
+        assert list(added) == [1] and list(removed) == []
+
+    def test_compact_memory(self):
+        """测试 10 万关注者只占用约 800KB"""
+        followers = FollowerSet.from_iterable(range(1, 100001))
+        assert followers.nbytes == 800000
+
+
+class TestFollowerReconciler:
+    """FollowerReconciler 测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    def crawl(self, reconciler):
+        """不受预算限制地完成一轮拉取"""
+        for _ in range(1000):
+            result = reconciler.step()
+            if result is not None:
+                return result
+        raise AssertionError("拉取未完成")
+
+    def make(self, source, clock, **kwargs):
+        kwargs.setdefault('page_size', 10)
+        kwargs.setdefault('requests_per_minute', 0)
+        return FollowerReconciler(source, clock=clock, **kwargs)
+
+    def test_first_crawl_builds_baseline(self, clock):
+        """测试首轮只建立基线，按页拉取直到不足一页"""
+        source = FakeFollowers(range(1000, 975, -1))
+        reconciler = self.make(source, clock)
+        assert self.crawl(reconciler) == {'added': [], 'removed': []}
+        assert source.calls == [1, 2, 3]
+        assert len(reconciler.snapshot) == 25
+
+    def test_removal_confirmed_after_two_crawls(self, clock):
+        """测试取消关注需连续两轮缺失才确认，重新出现的用户不误报"""
+        source = FakeFollowers(range(100, 70, -1))
+        reconciler = self.make(source, clock)
+        self.crawl(reconciler)
+
+        source.mids = [mid for mid in source.mids if mid not in (80, 90)] + [5]
+        assert self.crawl(reconciler) == {'added': [5], 'removed': []}
+        assert reconciler.stats()['pending_removals'] == 2
+        assert 80 in reconciler.snapshot
+
+        # 90 在下一轮重新出现（上一轮只是分页边界漏掉）
+        source.mids.append(90)
+        assert self.crawl(reconciler) == {'added': [], 'removed': [80]}
+        assert 80 not in reconciler.snapshot and 90 in reconciler.snapshot
+        assert reconciler.stats()['pending_removals'] == 0
+
+    def test_immediate_removal_without_confirmation(self, clock):
+        """测试关闭二次确认时本轮缺失即确认"""
+        source = FakeFollowers(range(1, 16))
+        reconciler = self.make(source, clock, confirm_removals=False)
+        self.crawl(reconciler)
+        source.mids.remove(3)
+        assert self.crawl(reconciler) == {'added': [], 'removed': [3]}
+
+    def test_capped_crawl_reports_additions_only(self, clock):
+        """测试达到页数上限截断的一轮只报告新增，不把未拉取到的用户当作取消关注"""
+        source = FakeFollowers(range(100, 50, -1))
+        reconciler = self.make(source, clock, max_pages=2)
+        assert self.crawl(reconciler) == {'added': [], 'removed': []}
+        assert source.calls == [1, 2]
+        assert len(reconciler.snapshot) == 20
+
+        source.mids = [101, 102] + [mid for mid in source.mids if mid != 95]
+        assert self.crawl(reconciler) == {'added': [101, 102], 'removed': []}
+        assert self.crawl(reconciler) == {'added': [], 'removed': []}
+        assert 95 in reconciler.snapshot and 81 in reconciler.snapshot
+        stats = reconciler.stats()
+        assert stats['removed'] == 0 and stats['pending_removals'] == 0
+        assert stats['capped'] == 3
+
+    def test_request_budget(self, clock):
+        """测试每分钟请求预算"""
+        source = FakeFollowers(range(1, 100))
+        reconciler = self.make(source, clock, requests_per_minute=6)
+        reconciler.step()
+        assert reconciler.step() is None
+        assert source.calls == [1]
+        assert reconciler.time_until_next() == pytest.approx(10.0)
+        clock.now = 10.0
+        reconciler.step()
+        assert source.calls == [1, 2]
+
+    def test_repeated_errors_abort_crawl(self, clock):
+        """测试同一页连续失败后放弃本轮，从第一页重新开始"""
+        source = FakeFollowers(range(1, 40))
+        source.fail_pages = {2}
+        reconciler = self.make(source, clock, max_errors=2)
+        for _ in range(3):
+            reconciler.step()
+        assert source.calls == [1, 2, 2]
+        assert reconciler.stats()['aborted'] == 1
+        assert reconciler.stats()['crawl_page'] == 1
+        assert reconciler.snapshot is None
+
+    def test_resume_from_disk(self, clock, tmp_path):
+        """测试重启后从持久化的集合与游标继续"""
+        path = str(tmp_path / 'followers.bin')
+        source = FakeFollowers(range(1, 36))
+        reconciler = self.make(source, clock, path=path, persist_every=1)
+        self.crawl(reconciler)
+        reconciler.step()
+        reconciler.step()
+
+        restored = self.make(source, clock, path=path)
+        assert restored.load()
+        assert list(restored.snapshot) == list(range(1, 36))
+        assert restored.stats()['crawl_page'] == 3
+        source.calls.clear()
+        assert self.crawl(restored) == {'added': [], 'removed': []}
+        assert source.calls == [3, 4]
+
+    def test_load_missing_or_invalid_file(self, clock, tmp_path):
+        """测试文件不存在或格式不符时不恢复"""
+        path = tmp_path / 'followers.bin'
+        reconciler = self.make(FakeFollowers([]), clock, path=str(path))
+        assert reconciler.load() is False
+        path.write_bytes(b'garbage')
+        assert reconciler.load() is False
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
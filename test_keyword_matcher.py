@@ -0,0 +1,154 @@
+"""
+关键词匹配器测试用例
+测试 Aho-Corasick 自动机与原逐条规则匹配的语义一致性
+"""
+
+import random
+
+import pytest
+
+from keyword_matcher import KeywordAutomaton, RuleMatcher, build_keyword_automaton, pattern_error
+
+
+def legacy_match(rule_keywords, message):
+    """原 check_keywords_fast 的逐条规则匹配逻辑"""
+    for rule_id, keywords in rule_keywords.items():
+        for keyword in sorted(keywords, key=len, reverse=True):
+            if keyword and keyword in message:
+                return rule_id, keyword
+    return None
+
+
+class TestKeywordAutomaton:
+    """KeywordAutomaton 测试套件"""
+
+    def test_first_rule_in_order_wins(self):
+        """测试按规则顺序第一条命中的规则胜出"""
+        automaton = build_keyword_automaton({
+            3: ['价格'],
+            1: ['怎么买', '购买'],
+        })
+        # 规则 1 的关键词出现得更早，但规则 3 排在前面
+        assert automaton.search('怎么买，价格多少') == (3, '价格')
+        assert automaton.search('怎么买') == (1, '怎么买')
+
+    def test_longest_keyword_preferred_within_rule(self):
+        """测试同一规则内优先报告最长关键词"""
+        automaton = build_keyword_automaton({0: ['买', '怎么买']})
+        assert automaton.search('请问怎么买') == (0, '怎么买')
+
+    def test_overlapping_and_suffix_keywords(self):
+        """测试重叠关键词与后缀关键词"""
+        automaton = build_keyword_automaton({0: ['he', 'she', 'his', 'hers']})
+        assert automaton.search('ushers') == (0, 'hers')
+        automaton = build_keyword_automaton({0: ['abcd'], 1: ['bc']})
+        assert automaton.search('xabcx') == (1, 'bc')
+
+    def test_no_match(self):
+        """测试未命中返回 None"""
+        automaton = build_keyword_automaton({0: ['hello']})
+        assert automaton.search('world') is None
+        assert KeywordAutomaton().search('anything') is None
+
+    def test_empty_keywords_ignored(self):
+        """测试空关键词被忽略"""
+        automaton = build_keyword_automaton({0: ['', 'a'], 1: []})
+        assert len(automaton) == 1
+        assert automaton.search('bbb') is None
+
+    def test_matches_legacy_semantics_randomized(self):
+        """测试随机规则集下与原匹配逻辑结果一致"""
+        rng = random.Random(42)
+        alphabet = 'abc买价格'
+        for _ in range(200):
+            rule_keywords = {}
+            for rule_id in rng.sample(range(50), rng.randint(1, 8)):
+                rule_keywords[rule_id] = [
+                    ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+                    for _ in range(rng.randint(1, 4))
+                ]
+            automaton = build_keyword_automaton(rule_keywords)
+            for _ in range(20):
+                message = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+                expected = legacy_match(rule_keywords, message)
+                result = automaton.search(message)
+                assert (result[0] if result else None) == (expected[0] if expected else None)
+                if expected:
+                    # 同一规则内报告的关键词长度与原逻辑一致（最长优先）
+                    assert len(result[1]) == len(expected[1])
+
+
+class TestRuleMatcher:
+    """RuleMatcher 测试套件"""
+
+    def test_regex_rule_reports_which_rule_fired(self):
+        """测试合并正则一次匹配即可知道命中的规则"""
+        matcher = RuleMatcher()
+        matcher.add_regex('price', r'多少(钱|元)', {'title': '价格'})
+        matcher.add_regex('phone', r'1[3-9]\d{9}', {'title': '手机号'})
+        matcher.build()
+        assert matcher.stats()['regex_combined'] is True
+        assert matcher.match('我的号码 13812345678') == ('phone', '13812345678')
+        assert matcher.match('这个多少钱') == ('price', '多少钱')
+        assert matcher.get('price') == {'title': '价格'}
+        assert matcher.match('你好') is None
+
+    def test_rule_order_across_literal_and_regex(self):
+        """测试字面量规则与正则规则按规则顺序决出胜者"""
+        matcher = RuleMatcher()
+        matcher.add_literal(0, ['价格'])
+        matcher.add_regex(1, r'怎么.买')
+        matcher.add_literal(2, ['买'])
+        matcher.build()
+        assert matcher.match('价格，怎么去买') == (0, '价格')
+        assert matcher.match('怎么去买') == (1, '怎么去买')
+        assert matcher.match('买') == (2, '买')
+
+    def test_regex_is_case_insensitive(self):
+        """测试正则规则忽略大小写（模式本身不做小写转换）"""
+        matcher = RuleMatcher()
+        matcher.add_regex(0, r'VIP\d+')
+        matcher.build()
+        assert matcher.match('开通vip3') == (0, 'vip3')
+
+    def test_invalid_pattern_reported_and_skipped(self):
+        """测试无效正则在加入时报告且不参与匹配"""
+        matcher = RuleMatcher()
+        assert matcher.add_regex(0, r'(未闭合') is not None
+        assert matcher.add_regex(1, '') is not None
+        matcher.add_literal(2, ['你好'])
+        matcher.build()
+        assert [rule_id for rule_id, _, _ in matcher.errors] == [0, 1]
+        assert matcher.stats()['invalid_patterns'] == 2
+        assert matcher.match('你好') == (2, '你好')
+        assert pattern_error(r'a+') is None
+
+    def test_uncombinable_patterns_fall_back(self):
+        """测试含数字反向引用的模式退回逐条匹配，结果不变"""
+        matcher = RuleMatcher()
+        matcher.add_regex(0, r'(哈)\1\1')
+        matcher.add_regex(1, r'嘿')
+        matcher.build()
+        assert matcher.stats()['regex_combined'] is False
+        assert matcher.match('嘿 哈哈哈') == (0, '哈哈哈')
+        assert matcher.match('嘿 哈哈') == (1, '嘿')
+
+    def test_stats_per_rule_type(self):
+        """测试按规则类型统计编译与匹配耗时"""
+        matcher = RuleMatcher()
+        matcher.add_literal(0, ['a'])
+        matcher.add_regex(1, r'b+')
+        matcher.build()
+        matcher.match('bbb')
+        matcher.match('a')
+        stats = matcher.stats()
+        assert stats['literal']['rules'] == 1
+        assert stats['regex']['rules'] == 1
+        assert stats['literal']['matches'] == 2
+        # 字面量规则 0 已命中时无需再跑正则
+        assert stats['regex']['matches'] == 1
+        assert stats['regex']['hits'] == 1
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
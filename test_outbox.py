@@ -0,0 +1,206 @@
+"""
+发送队列测试用例
+测试异步投递、限速重试、有界容量和停止时排空
+"""
+
+import threading
+import time
+
+import pytest
+
+from outbox import Outbox, RetryLater
+
+
+class TestOutbox:
+    """Outbox 测试套件"""
+
+    def test_submit_does_not_block_on_slow_handler(self):
+        """测试投递不受发送耗时影响"""
+        release = threading.Event()
+        handled = []
+
+        def handler(kind, payload):
+            release.wait(1)
+            handled.append(payload)
+
+        outbox = Outbox(handler, workers=1, maxsize=10)
+        outbox.start()
+        started = time.monotonic()
+        for i in range(5):
+            assert outbox.submit('reply', i)
+        assert time.monotonic() - started < 0.1
+
+        release.set()
+        assert outbox.stop(drain=True, timeout=2) == 0
+        assert handled == [0, 1, 2, 3, 4]
+
+    def test_retry_after_requeues_job(self):
+        """测试处理函数返回等待时间时任务延迟重试"""
+        attempts = []
+
+        def handler(kind, payload):
+            attempts.append(time.monotonic())
+            if len(attempts) < 3:
+                return 0.05
+            return None
+
+        outbox = Outbox(handler, workers=1)
+        outbox.start()
+        outbox.submit('reply', 'x')
+        outbox.stop(drain=True, timeout=2)
+
+        assert len(attempts) == 3
+        assert attempts[2] - attempts[0] >= 0.1
+        stats = outbox.stats()
+        assert stats['retried'] == 2
+        assert stats['completed'] == 1
+
+    def test_deferral_is_not_counted_as_attempt(self):
+        """测试本地限速推迟不计入处理次数，突发任务只会变慢而不会被丢弃"""
+        calls = {}
+
+        def handler(kind, payload):
+            calls[payload] = calls.get(payload, 0) + 1
+            if calls[payload] <= 5:
+                return 0.001
+            return None
+
+        outbox = Outbox(handler, workers=2, max_attempts=2)
+        outbox.start()
+        for i in range(10):
+            outbox.submit('reply', i)
+        outbox.stop(drain=True, timeout=5)
+
+        stats = outbox.stats()
+        assert stats['completed'] == 10
+        assert stats['dropped'] == 0
+        assert stats['deferred'] == 50
+
+    def test_retry_later_counts_attempts(self):
+        """测试发送失败重试计入处理次数，超过上限后丢弃"""
+        calls = []
+
+        def handler(kind, payload):
+            calls.append(payload)
+            raise RetryLater(0.001, "rate limited")
+
+        outbox = Outbox(handler, workers=1, max_attempts=3)
+        outbox.start()
+        outbox.submit('reply', 'x')
+        outbox.stop(drain=True, timeout=2)
+
+        assert len(calls) == 3
+        stats = outbox.stats()
+        assert stats['retried'] == 2
+        assert stats['dropped'] == 1
+
+    def test_delayed_job_does_not_hold_worker(self):
+        """测试延迟重试的任务不占用工作线程"""
+        order = []
+
+        def handler(kind, payload):
+            if payload == 'slow' and 'slow-throttled' not in order:
+                order.append('slow-throttled')
+                return 0.2
+            order.append(payload)
+            return None
+
+        outbox = Outbox(handler, workers=1)
+        outbox.start()
+        outbox.submit('reply', 'slow')
+        outbox.submit('reply', 'fast')
+        outbox.stop(drain=True, timeout=2)
+
+        assert order == ['slow-throttled', 'fast', 'slow']
+
+    def test_bounded_queue_rejects_when_full(self):
+        """测试队列已满时拒绝投递"""
+        release = threading.Event()
+
+        def handler(kind, payload):
+            release.wait(1)
+
+        outbox = Outbox(handler, workers=1, maxsize=2)
+        outbox.start()
+        results = [outbox.submit('reply', i) for i in range(5)]
+        assert results.count(True) <= 3
+        assert results[-1] is False
+        assert outbox.stats()['dropped'] >= 2
+        release.set()
+        outbox.stop(drain=True, timeout=2)
+
+    def test_priority_order(self):
+        """测试高优先级任务先出队，同优先级保持先进先出"""
+        release = threading.Event()
+        handled = []
+
+        def handler(kind, payload):
+            release.wait(1)
+            handled.append(payload)
+
+        outbox = Outbox(handler, workers=1)
+        outbox.start()
+        outbox.submit('welcome', 'blocker', priority=2)
+        time.sleep(0.05)
+        outbox.submit('welcome', 'w1', priority=2)
+        outbox.submit('goodbye', 'g1', priority=2)
+        outbox.submit('reply', 'r1')
+        outbox.submit('reply', 'r2')
+        assert outbox.stats()['depth_by_priority'] == {0: 2, 2: 2}
+
+        release.set()
+        outbox.stop(drain=True, timeout=2)
+        assert handled == ['blocker', 'r1', 'r2', 'w1', 'g1']
+
+    def test_stop_without_drain_discards_pending(self):
+        """测试不排空停止时丢弃未处理任务"""
+        release = threading.Event()
+
+        def handler(kind, payload):
+            release.wait(0.5)
+
+        outbox = Outbox(handler, workers=1)
+        outbox.start()
+        for i in range(4):
+            outbox.submit('reply', i)
+        time.sleep(0.05)
+        discarded = outbox.stop(drain=False)
+        release.set()
+        assert discarded == 3
+        assert not outbox.submit('reply', 'late')
+
+    def test_handler_exception_is_counted(self):
+        """测试处理异常不会终止工作线程"""
+        handled = []
+
+        def handler(kind, payload):
+            if payload == 'bad':
+                raise RuntimeError('boom')
+            handled.append(payload)
+
+        outbox = Outbox(handler, workers=1)
+        outbox.start()
+        outbox.submit('reply', 'bad')
+        outbox.submit('reply', 'good')
+        outbox.stop(drain=True, timeout=2)
+
+        assert handled == ['good']
+        assert outbox.stats()['failed'] == 1
+
+    def test_stats_report_wait_and_latency(self):
+        """测试统计队列等待时间和发送耗时"""
+        outbox = Outbox(lambda kind, payload: time.sleep(0.02), workers=1)
+        outbox.start()
+        for i in range(3):
+            outbox.submit('reply', i)
+        outbox.stop(drain=True, timeout=2)
+
+        stats = outbox.stats()
+        assert stats['depth'] == 0
+        assert stats['max_depth'] >= 1
+        assert stats['latency_p50'] >= 0.02
+        assert stats['wait_max'] >= 0.02
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,114 @@
+"""
+轮询调度器测试用例
+测试空闲退避、新消息回到最短间隔、-412 冷却和间隔变化记录
+"""
+
+import pytest
+
+from poll_scheduler import PollScheduler
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPollScheduler:
+    """PollScheduler 测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    def make_scheduler(self, clock, **kwargs):
+        kwargs.setdefault('min_interval', 0.05)
+        kwargs.setdefault('max_interval', 2.0)
+        kwargs.setdefault('backoff', 2.0)
+        kwargs.setdefault('idle_grace', 10.0)
+        return PollScheduler(clock=clock, **kwargs)
+
+    def test_idle_backoff_after_grace(self, clock):
+        """测试宽限期内保持最短间隔，之后按倍数退避到上限"""
+        scheduler = self.make_scheduler(clock)
+        scheduler.on_idle()
+        assert scheduler.interval == 0.05
+
+        clock.now = 11.0
+        intervals = []
+        for _ in range(8):
+            scheduler.on_idle()
+            intervals.append(scheduler.interval)
+        assert intervals[:3] == [0.1, 0.2, 0.4]
+        assert intervals[-1] == 2.0
+
+    def test_activity_snaps_back(self, clock):
+        """测试新消息到达时立即回到最短间隔"""
+        scheduler = self.make_scheduler(clock)
+        clock.now = 20.0
+        for _ in range(5):
+            scheduler.on_idle()
+        assert scheduler.interval > 1.0
+        scheduler.on_activity()
+        assert scheduler.interval == 0.05
+        # 活跃后重新进入宽限期
+        clock.now = 25.0
+        scheduler.on_idle()
+        assert scheduler.interval == 0.05
+
+    def test_rate_limited_widens_and_recovers(self, clock):
+        """测试 -412 后冷却期内间隔不低于冷却间隔，连续触发翻倍，冷却结束后恢复"""
+        scheduler = self.make_scheduler(clock, throttle_interval=5.0, throttle_seconds=60.0)
+        scheduler.on_rate_limited()
+        assert scheduler.interval == 5.0
+        scheduler.on_activity()
+        assert scheduler.interval == 5.0
+
+        clock.now = 10.0
+        scheduler.on_rate_limited()
+        assert scheduler.interval == 10.0
+        assert scheduler.stats()['throttled'] is True
+
+        clock.now = 80.0
+        scheduler.on_activity()
+        assert scheduler.interval == 0.05
+        assert scheduler.stats()['throttled'] is False
+
+    def test_delay_subtracts_elapsed(self, clock):
+        """测试等待时间扣除本轮耗时，且不低于 10ms"""
+        scheduler = self.make_scheduler(clock, min_interval=0.5)
+        assert scheduler.delay(0.2) == pytest.approx(0.3)
+        assert scheduler.delay(1.0) == 0.01
+
+    def test_history_and_stats(self, clock):
+        """测试只记录间隔变化，统计各类轮询次数"""
+        scheduler = self.make_scheduler(clock, history_size=3)
+        scheduler.on_activity()
+        clock.now = 11.0
+        for _ in range(5):
+            scheduler.on_idle()
+        stats = scheduler.stats()
+        assert stats['polls'] == 6
+        assert stats['active_polls'] == 1 and stats['idle_polls'] == 5
+        assert [entry['interval'] for entry in stats['history']] == [0.4, 0.8, 1.6]
+        assert all(entry['reason'] == 'idle' for entry in stats['history'])
+
+    def test_configure_clamps_interval(self, clock):
+        """测试更新参数后当前间隔截断到新范围"""
+        scheduler = self.make_scheduler(clock)
+        clock.now = 11.0
+        for _ in range(10):
+            scheduler.on_idle()
+        scheduler.configure(max_interval=0.5)
+        assert scheduler.interval == 0.5
+        scheduler.configure(min_interval=1.0)
+        assert scheduler.interval == 1.0
+        assert scheduler.max_interval == 1.0
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,166 @@
+"""
+推送接入测试用例
+测试通知解析、通知唤醒、断线重连与回退（使用本地传输层替身，不连接网络）
+"""
+
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+from push_ingest import ANY_TALKER, PushIngestor, parse_notice
+
+
+class StubTransport:
+    """本地传输层替身：测试通过 push() 推送帧，通过 drop() 模拟断线"""
+
+    _CLOSED = object()
+
+    def __init__(self, fail_connect=False):
+        self.frames = queue.Queue()
+        self.fail_connect = fail_connect
+        self.connected = threading.Event()
+        self.closed = False
+
+    def connect(self):
+        if self.fail_connect:
+            raise ConnectionError("refused")
+        self.connected.set()
+
+    def recv(self, timeout):
+        try:
+            frame = self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if frame is self._CLOSED:
+            raise ConnectionError("closed")
+        return frame
+
+    def close(self):
+        self.closed = True
+
+    def push(self, payload):
+        self.frames.put(payload if isinstance(payload, (str, bytes)) else json.dumps(payload))
+
+    def drop(self):
+        self.frames.put(self._CLOSED)
+
+
+class TestParseNotice:
+    """通知解析测试套件"""
+
+    def test_talker_ids_from_various_fields(self):
+        """测试从 talker_id / sender_uid / data 中识别会话"""
+        assert parse_notice('{"cmd": "new_msg", "talker_id": 1}') == {1}
+        assert parse_notice(b'{"sender_uid": 2}') == {2}
+        assert parse_notice('[{"data": {"uid": 3}}, {"talker_id": 4}]') == {3, 4}
+
+    def test_control_and_unknown_frames(self):
+        """测试心跳帧和无法解码的二进制帧被忽略，没有会话 ID 的 JSON 通知触发完整轮询"""
+        assert parse_notice('{"cmd": "heartbeat"}') == set()
+        assert parse_notice('{"cmd": "session_update"}') == {ANY_TALKER}
+        assert parse_notice(b'\x00\x10binary') == set()
+        assert parse_notice(b'\xff\xfe') == set()
+        assert parse_notice('not json') == set()
+
+
+class TestPushIngestor:
+    """PushIngestor 测试套件"""
+
+    @pytest.fixture
+    def transports(self):
+        return []
+
+    @pytest.fixture
+    def ingestor(self, transports):
+        def factory():
+            transport = StubTransport()
+            transports.append(transport)
+            return transport
+
+        ingestor = PushIngestor(factory, reconnect_base=0.01, reconnect_max=0.05, recv_timeout=0.02)
+        ingestor.start()
+        yield ingestor
+        ingestor.stop()
+
+    def wait_connected(self, ingestor, transports, count=1):
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            if len(transports) >= count and ingestor.connected:
+                return
+            time.sleep(0.005)
+        raise AssertionError("连接未建立")
+
+    def test_connect_triggers_full_poll(self, ingestor, transports):
+        """测试连接成功后先要求一次完整轮询"""
+        self.wait_connected(ingestor, transports)
+        assert ingestor.wait(timeout=1) == {ANY_TALKER}
+
+    def test_notice_wakes_waiter_quickly(self, ingestor, transports):
+        """测试通知到达时立即唤醒等待方，多条通知合并为会话集合"""
+        self.wait_connected(ingestor, transports)
+        ingestor.wait(timeout=1)
+
+        result = {}
+
+        def waiter():
+            started = time.monotonic()
+            result['notices'] = ingestor.wait(timeout=2)
+            result['latency'] = time.monotonic() - started
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        transports[0].push({"cmd": "new_msg", "talker_id": 42})
+        thread.join(2)
+        assert result['notices'] == {42}
+        assert result['latency'] < 0.5
+
+        transports[0].push({"talker_id": 1})
+        transports[0].push({"talker_id": 1})
+        transports[0].push({"talker_id": 2})
+        time.sleep(0.1)
+        assert ingestor.wait(timeout=0) == {1, 2}
+        assert ingestor.stats()['frames'] == 4
+
+    def test_binary_frames_do_not_trigger_poll(self, ingestor, transports):
+        """测试二进制协议帧和心跳帧不触发轮询"""
+        self.wait_connected(ingestor, transports)
+        ingestor.wait(timeout=1)
+        transports[0].push(b'\x00\x00\x00\x1a\x00\x10\x00\x01\x00\x00\x00\x03')
+        transports[0].push({"cmd": "heartbeat"})
+        time.sleep(0.1)
+        assert ingestor.wait(timeout=0) == set()
+        stats = ingestor.stats()
+        assert stats['frames'] == 2
+        assert stats['ignored_frames'] == 2
+
+    def test_reconnects_after_drop(self, ingestor, transports):
+        """测试断线后标记不可用并重连，重连后再次要求完整轮询"""
+        self.wait_connected(ingestor, transports)
+        ingestor.wait(timeout=1)
+        transports[0].drop()
+        self.wait_connected(ingestor, transports, count=2)
+        assert transports[0].closed
+        assert ingestor.wait(timeout=1) == {ANY_TALKER}
+        stats = ingestor.stats()
+        assert stats['connects'] == 2
+        assert stats['disconnects'] == 1
+        assert stats['last_error'] == 'closed'
+
+    def test_wait_returns_immediately_when_disconnected(self):
+        """测试连接不可用时 wait 不阻塞，监控循环回退到轮询"""
+        ingestor = PushIngestor(lambda: StubTransport(fail_connect=True), reconnect_base=0.01, reconnect_max=0.02)
+        ingestor.start()
+        started = time.monotonic()
+        assert ingestor.wait(timeout=1) == set()
+        assert time.monotonic() - started < 0.5
+        assert ingestor.connected is False
+        ingestor.stop()
+        assert ingestor.stats()['connects'] == 0
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
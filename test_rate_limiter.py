@@ -0,0 +1,149 @@
+"""
+发送限速器测试用例
+测试令牌桶、接收者限速和 -412 自适应冷却
+"""
+
+import pytest
+
+from rate_limiter import SendScheduler, TokenBucket
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket:
+    """TokenBucket 测试套件"""
+
+    def test_burst_then_refill(self):
+        """测试突发容量耗尽后按速率补充"""
+        bucket = TokenBucket(rate=2.0, capacity=3, now=0.0)
+        for _ in range(3):
+            assert bucket.time_until_available(0.0) == 0
+            bucket.consume(0.0)
+        assert bucket.time_until_available(0.0) == pytest.approx(0.5)
+        assert bucket.time_until_available(0.5) == 0
+
+    def test_zero_rate_is_unlimited(self):
+        """测试速率为 0 时不限速"""
+        bucket = TokenBucket(rate=0, capacity=1, now=0.0)
+        for _ in range(10):
+            assert bucket.time_until_available(0.0) == 0
+            bucket.consume(0.0)
+
+
+class TestSendScheduler:
+    """SendScheduler 测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def scheduler(self, clock):
+        return SendScheduler(global_interval=1.0, global_burst=2, receiver_interval=5.0,
+                             cooldown_base=10.0, cooldown_max=40.0, clock=clock)
+
+    def test_reserve_returns_eta_instead_of_blocking(self, scheduler, clock):
+        """测试全局令牌耗尽后返回等待时间"""
+        assert scheduler.reserve(1)
+        assert scheduler.reserve(2)
+        reservation = scheduler.reserve(3)
+        assert not reservation
+        assert reservation.reason == 'global'
+        assert reservation.eta == pytest.approx(1.0)
+        clock.advance(1.0)
+        assert scheduler.reserve(3)
+
+    def test_per_receiver_bucket(self, scheduler, clock):
+        """测试同一接收者受独立间隔限制"""
+        assert scheduler.reserve(1)
+        reservation = scheduler.reserve(1)
+        assert not reservation
+        assert reservation.reason == 'receiver'
+        assert reservation.eta == pytest.approx(5.0)
+        # 其他接收者不受影响
+        assert scheduler.reserve(2)
+
+    def test_throttled_reserve_does_not_consume(self, scheduler, clock):
+        """测试被拒绝的预约不扣除全局令牌"""
+        assert scheduler.reserve(1)
+        assert not scheduler.reserve(1)
+        assert not scheduler.reserve(1)
+        assert scheduler.reserve(2)
+
+    def test_peek_does_not_consume(self, scheduler):
+        """测试 peek 不扣除令牌"""
+        assert scheduler.peek(1) == 0
+        assert scheduler.peek(1) == 0
+        assert scheduler.reserve(1)
+
+    def test_defer_spreads_throttled_jobs(self, scheduler, clock):
+        """测试被全局限速的任务重试时间依次错开，不会同时醒来"""
+        assert scheduler.reserve(1)
+        assert scheduler.reserve(2)
+        delays = [scheduler.defer(receiver_id) for receiver_id in range(3, 7)]
+        assert delays == pytest.approx([1.0, 2.0, 3.0, 4.0])
+        # 只受接收者限速的任务不占用全局排位
+        clock.advance(1.0)
+        assert scheduler.reserve(3)
+        assert scheduler.defer(3) == pytest.approx(5.0)
+        assert scheduler.stats()['deferred'] == 5
+
+    def test_defer_does_not_book_past_slots(self, scheduler, clock):
+        """测试排位过期后按当前等待时间重新计算"""
+        scheduler.reserve(1)
+        scheduler.reserve(2)
+        scheduler.defer(3)
+        scheduler.defer(4)
+        clock.advance(60.0)
+        assert scheduler.defer(5) == 0.0
+
+    def test_rate_limited_cooldown_grows_and_decays(self, scheduler, clock):
+        """测试 -412 冷却指数增长并在成功后回落"""
+        assert scheduler.on_rate_limited() == 10.0
+        reservation = scheduler.reserve(1)
+        assert not reservation
+        assert reservation.reason == 'cooldown'
+        assert reservation.eta == pytest.approx(10.0)
+
+        assert scheduler.on_rate_limited() == 20.0
+        assert scheduler.on_rate_limited() == 40.0
+        assert scheduler.on_rate_limited() == 40.0
+
+        clock.advance(40.0)
+        assert scheduler.reserve(1)
+        scheduler.on_success()
+        assert scheduler.stats()['cooldown'] == 20.0
+        scheduler.on_success()
+        scheduler.on_success()
+        assert scheduler.stats()['cooldown'] == 0.0
+
+    def test_receiver_buckets_are_bounded(self, clock):
+        """测试接收者令牌桶数量受上限约束"""
+        scheduler = SendScheduler(global_interval=0, receiver_interval=1.0, max_receivers=3, clock=clock)
+        for receiver_id in range(10):
+            assert scheduler.reserve(receiver_id)
+        assert scheduler.stats()['tracked_receivers'] == 3
+
+    def test_stats(self, scheduler):
+        """测试统计计数"""
+        scheduler.reserve(1)
+        scheduler.reserve(1)
+        stats = scheduler.stats()
+        assert stats['granted'] == 1
+        assert stats['throttled'] == 1
+        assert stats['rate_limited'] == 0
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
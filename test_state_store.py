@@ -0,0 +1,147 @@
+"""
+状态存储测试用例
+测试批量写入、重启后加载、去重记录过期和集合快照
+"""
+
+import pytest
+
+from dedupe_store import DedupeStore
+from state_store import StateStore
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestStateStore:
+    """StateStore 测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        return str(tmp_path / 'state.db')
+
+    def reopen(self, db_path, clock):
+        store = StateStore(db_path, dedupe_ttl=60, clock=clock)
+        store.open()
+        return store
+
+    def test_state_survives_restart(self, db_path, clock):
+        """测试写入的状态在重新打开后可以加载"""
+        store = self.reopen(db_path, clock)
+        store.set_watermark(100, 1700000000)
+        store.set_watermark(200, 1700000005)
+        store.add_dedupe('100_1700000000_abc')
+        store.replace_members('followers', {1, 2, 3})
+        store.replace_members('follow_history', {1: 1700000000})
+        assert store.flush() == 7
+        store.close()
+
+        state = self.reopen(db_path, clock).load()
+        assert state['watermarks'] == {100: 1700000000, 200: 1700000005}
+        assert [key for key, _ in state['dedupe']] == ['100_1700000000_abc']
+        assert set(state['members']['followers']) == {1, 2, 3}
+        assert state['members']['follow_history'] == {1: 1700000000}
+
+    def test_writes_are_batched_until_flush(self, db_path, clock):
+        """测试修改在刷新前只保存在内存中，同一会话只写最新水位"""
+        store = self.reopen(db_path, clock)
+        for ts in range(10):
+            store.set_watermark(100, ts)
+        assert store.pending_count() == 1
+        assert self.reopen(db_path, clock).load()['watermarks'] == {}
+
+        store.flush()
+        assert store.stats()['flushes'] == 1
+        assert self.reopen(db_path, clock).load()['watermarks'] == {100: 9}
+
+    def test_watermark_never_moves_backwards(self, db_path, clock):
+        """测试持久化水位只增不减"""
+        store = self.reopen(db_path, clock)
+        store.set_watermark(100, 50)
+        store.flush()
+        store.set_watermark(100, 40)
+        store.flush()
+        assert store.load()['watermarks'] == {100: 50}
+
+    def test_maybe_flush_respects_interval(self, db_path, clock):
+        """测试按间隔刷新"""
+        store = StateStore(db_path, flush_interval=5, clock=clock)
+        store.open()
+        store.set_watermark(1, 1)
+        assert store.maybe_flush() == 1
+        store.set_watermark(1, 2)
+        clock.now += 1
+        assert store.maybe_flush() == 0
+        clock.now += 5
+        assert store.maybe_flush() == 1
+
+    def test_expired_dedupe_keys_not_loaded(self, db_path, clock):
+        """测试超过 TTL 的去重记录在加载时被忽略、在刷新时被删除"""
+        store = self.reopen(db_path, clock)
+        store.add_dedupe('old')
+        store.flush()
+        clock.now += 30
+        store.add_dedupe('new')
+        store.flush()
+        clock.now += 40
+
+        state = store.load()
+        assert [key for key, _ in state['dedupe']] == ['new']
+        assert state['dedupe'][0][1] == pytest.approx(40)
+
+        store.add_dedupe('newer')
+        store.flush()
+        rows = store._conn.execute('SELECT key FROM dedupe ORDER BY seen_at').fetchall()
+        assert [row[0] for row in rows] == ['new', 'newer']
+
+    def test_unchanged_member_snapshot_skipped(self, db_path, clock):
+        """测试集合快照未变化时不重复写入"""
+        store = self.reopen(db_path, clock)
+        store.replace_members('followers', {1, 2})
+        assert store.flush() == 2
+        store.replace_members('followers', {2, 1})
+        assert store.flush() == 0
+        store.replace_members('followers', {2})
+        assert store.flush() == 1
+        assert set(store.load()['members']['followers']) == {2}
+
+    def test_clear(self, db_path, clock):
+        """测试清空持久化状态"""
+        store = self.reopen(db_path, clock)
+        store.set_watermark(1, 1)
+        store.add_dedupe('k')
+        store.flush()
+        store.clear()
+        state = store.load()
+        assert state == {'watermarks': {}, 'dedupe': [], 'members': {}}
+
+    def test_restore_into_dedupe_store(self, db_path, clock):
+        """测试加载的去重记录按剩余 TTL 恢复到 DedupeStore"""
+        store = self.reopen(db_path, clock)
+        store.add_dedupe('a')
+        store.flush()
+        clock.now += 50
+        state = store.load()
+
+        dedupe_clock = FakeClock(0.0)
+        dedupe = DedupeStore(ttl=60, clock=dedupe_clock)
+        for key, age in state['dedupe']:
+            assert dedupe.restore(key, age)
+        assert dedupe.add('a') is False
+        dedupe_clock.now = 11
+        assert 'a' not in dedupe
+        assert dedupe.stats()['restored'] == 1
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
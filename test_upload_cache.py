@@ -0,0 +1,227 @@
+"""
+上传缓存测试用例
+测试按内容寻址、文件变化检测、过期与复核、并发上传合并、预热和持久化
+"""
+
+import os
+import struct
+import threading
+import time
+
+import pytest
+
+from upload_cache import UploadCache, read_image_size
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeUploader:
+    """记录上传次数的上传函数替身"""
+
+    def __init__(self, delay=0.0):
+        self.calls = []
+        self.delay = delay
+        self.fail = False
+
+    def __call__(self, image_path):
+        self.calls.append(image_path)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            return None
+        return {'image_url': f"https://i0.hdslb.com/bfs/{len(self.calls)}.png", 'image_width': 0, 'image_height': 0}
+
+
+def make_png(width, height, extra=b''):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sII', 13, b'IHDR', width, height) + b'\x08\x06\x00\x00\x00' + extra
+
+
+class TestReadImageSize:
+    """图片尺寸解析测试套件"""
+
+    def test_png_gif_jpeg(self):
+        """测试解析常见图片格式的尺寸"""
+        assert read_image_size(make_png(640, 480)) == (640, 480)
+        assert read_image_size(b'GIF89a' + struct.pack('<HH', 32, 16)) == (32, 16)
+        jpeg = (b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 4) + b'\x00\x00'
+                + b'\xff\xc0' + struct.pack('>HBHH', 11, 8, 300, 400) + b'\x03')
+        assert read_image_size(jpeg) == (400, 300)
+        assert read_image_size(b'not an image') == (0, 0)
+
+
+class TestUploadCache:
+    """UploadCache 测试套件"""
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def image(self, tmp_path):
+        path = tmp_path / 'reply.png'
+        path.write_bytes(make_png(64, 32, b'pixels'))
+        return str(path)
+
+    def test_repeat_send_uploads_once(self, clock, image):
+        """测试同一图片重复发送只上传一次，并补全本地解析的尺寸"""
+        cache = UploadCache(clock=clock)
+        uploader = FakeUploader()
+        first = cache.get_or_upload(image, uploader)
+        second = cache.get_or_upload(image, uploader)
+        assert len(uploader.calls) == 1
+        assert first['image_url'] == second['image_url']
+        assert (second['image_width'], second['image_height']) == (64, 32)
+        stats = cache.stats()
+        assert stats['uploads'] == 1 and stats['hits'] == 1 and stats['hashes'] == 1
+
+    def test_same_content_different_path_shares_entry(self, clock, image, tmp_path):
+        """测试内容相同的不同文件共用缓存条目"""
+        copy = tmp_path / 'copy.png'
+        copy.write_bytes(open(image, 'rb').read())
+        cache = UploadCache(clock=clock)
+        uploader = FakeUploader()
+        cache.get_or_upload(image, uploader)
+        cache.get_or_upload(str(copy), uploader)
+        assert len(uploader.calls) == 1
+
+    def test_modified_file_is_reuploaded(self, clock, image):
+        """测试文件内容变化后重新上传"""
+        cache = UploadCache(clock=clock)
+        uploader = FakeUploader()
+        cache.get_or_upload(image, uploader)
+        with open(image, 'wb') as f:
+            f.write(make_png(10, 10, b'changed content'))
+        os.utime(image, ns=(1, 1))
+        cache.get_or_upload(image, uploader)
+        assert len(uploader.calls) == 2
+        assert cache.stats()['hashes'] == 2
+
+    def test_expiry(self, clock, image):
+        """测试条目过期后重新上传"""
+        cache = UploadCache(ttl=100, clock=clock)
+        uploader = FakeUploader()
+        cache.get_or_upload(image, uploader)
+        clock.now += 100
+        cache.get_or_upload(image, uploader)
+        assert len(uploader.calls) == 2
+        assert cache.stats()['expired'] == 1
+
+    def test_revalidation(self, clock, image):
+        """测试超过复核间隔时复核地址，失效则重新上传，无法判断时保留条目"""
+        results = []
+        cache = UploadCache(revalidate_after=10, validate=lambda url: results.pop(0), clock=clock)
+        uploader = FakeUploader()
+        cache.get_or_upload(image, uploader)
+
+        clock.now += 5
+        assert cache.get(image) is not None  # 未到复核时间，不复核
+
+        results[:] = [None]
+        clock.now += 10
+        assert cache.get(image) is not None
+        results[:] = [False]
+        assert cache.get(image) is None
+        cache.get_or_upload(image, uploader)
+        assert len(uploader.calls) == 2
+        stats = cache.stats()
+        assert stats['revalidations'] == 2 and stats['revalidation_failures'] == 1
+
+    def test_failed_upload_is_not_cached(self, clock, image):
+        """测试上传失败时不缓存，下次重试上传"""
+        cache = UploadCache(clock=clock)
+        uploader = FakeUploader()
+        uploader.fail = True
+        assert cache.get_or_upload(image, uploader) is None
+        uploader.fail = False
+        assert cache.get_or_upload(image, uploader) is not None
+        assert len(uploader.calls) == 2
+        assert cache.stats()['upload_failures'] == 1
+
+    def test_concurrent_sends_upload_once(self, clock, image):
+        """测试同一图片并发发送时只上传一次"""
+        cache = UploadCache(clock=clock)
+        uploader = FakeUploader(delay=0.05)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_upload(image, uploader)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(2)
+        assert len(uploader.calls) == 1
+        assert len({result['image_url'] for result in results}) == 1
+
+    def test_invalidate_and_eviction(self, clock, image, tmp_path):
+        """测试删除条目与超出容量时淘汰最久未使用的条目"""
+        cache = UploadCache(max_entries=1, clock=clock)
+        uploader = FakeUploader()
+        cache.get_or_upload(image, uploader)
+        assert cache.invalidate(image)
+        assert not cache.invalidate(image)
+
+        other = tmp_path / 'other.png'
+        other.write_bytes(make_png(1, 1))
+        cache.get_or_upload(image, uploader)
+        cache.get_or_upload(str(other), uploader)
+        assert cache.stats()['entries'] == 1
+        assert cache.get(image) is None
+
+    def test_warm_uploads_concurrently(self, clock, tmp_path):
+        """测试预热并发上传、跳过已缓存图片并记录失败"""
+        images = []
+        for i in range(4):
+            path = tmp_path / f'{i}.png'
+            path.write_bytes(make_png(i + 1, i + 1))
+            images.append(str(path))
+        cache = UploadCache(clock=clock)
+        uploader = FakeUploader(delay=0.1)
+        cache.get_or_upload(images[0], uploader)
+
+        started = time.monotonic()
+        result = cache.warm(images + [images[1], str(tmp_path / 'missing.png')], uploader, workers=3)
+        assert time.monotonic() - started < 0.3
+        assert len(uploader.calls) == 4
+        assert (result['total'], result['cached'], result['uploaded'], result['failed']) == (5, 1, 3, 1)
+        assert result['failures'][0]['error'] == "文件不存在"
+        assert cache.stats()['warmup']['running'] is False
+
+        uploader.calls.clear()
+        result = cache.warm(images, uploader)
+        assert result['cached'] == 4 and uploader.calls == []
+
+    def test_warm_records_upload_errors(self, clock, image):
+        """测试上传失败或异常时记录到预热失败列表"""
+        def broken(path):
+            raise RuntimeError("boom")
+
+        cache = UploadCache(clock=clock)
+        result = cache.warm([image], broken)
+        assert result['failed'] == 1
+        assert result['failures'] == [{'path': os.path.abspath(image), 'error': 'boom'}]
+
+    def test_persistence(self, clock, image, tmp_path):
+        """测试重启后从磁盘恢复，跳过已过期的条目"""
+        path = str(tmp_path / 'uploads.json')
+        cache = UploadCache(path=path, ttl=100, clock=clock)
+        uploader = FakeUploader()
+        cached = cache.get_or_upload(image, uploader)
+
+        restored = UploadCache(path=path, ttl=100, clock=clock)
+        assert restored.load() == 1
+        assert restored.get_or_upload(image, uploader)['image_url'] == cached['image_url']
+        assert len(uploader.calls) == 1
+
+        clock.now += 100
+        assert UploadCache(path=path, ttl=100, clock=clock).load() == 0
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
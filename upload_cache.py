@@ -0,0 +1,347 @@
+"""
+上传缓存 - 按图片内容寻址的上传结果缓存
+职责：以文件内容哈希为键缓存已上传图片的 URL 与尺寸并持久化到磁盘，重复发送同一图片时跳过上传；
+     用 (路径, mtime, 大小) 快速判断文件是否变化，变化时才重新计算哈希；
+     缓存条目按有效期过期，超过复核间隔的条目在使用前复核 URL 是否仍可访问；
+     支持用有界线程池并发预上传一组图片（预热），并记录预热进度与失败原因
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+_VERSION = 1
+_CHUNK_SIZE = 1024 * 1024
+_MAX_WARMUP_FAILURES = 20  # 统计中保留的预热失败记录数
+
+
+def read_image_size(head: bytes) -> Tuple[int, int]:
+    """从文件头解析 PNG / GIF / JPEG 图片尺寸，无法识别时返回 (0, 0)"""
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and len(head) >= 24:
+        return struct.unpack('>II', head[16:24])
+    if head[:6] in (b'GIF87a', b'GIF89a') and len(head) >= 10:
+        return struct.unpack('<HH', head[6:10])
+    if head[:2] == b'\xff\xd8':
+        index = 2
+        while index + 9 <= len(head):
+            if head[index] != 0xFF:
+                index += 1
+                continue
+            marker = head[index + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                index += 1 if marker == 0xFF else 2
+                continue
+            length = struct.unpack('>H', head[index + 2:index + 4])[0]
+            # SOF 段（排除 DHT / JPG / DAC）中记录高、宽
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', head[index + 5:index + 9])
+                return width, height
+            index += 2 + length
+    return 0, 0
+
+
+class UploadCache:
+    """图片上传结果缓存
+
+    条目格式 {'image_url', 'image_width', 'image_height', 'image_size', 'uploaded_at', 'validated_at'}，
+    与 BilibiliAPI.upload_image 的返回值兼容
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 7 * 86400,
+        revalidate_after: float = 86400,
+        max_entries: int = 500,
+        validate: Optional[Callable[[str], Optional[bool]]] = None,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        初始化上传缓存
+
+        Args:
+            path: 持久化文件路径，None 表示只缓存在内存中
+            ttl: 条目有效期（秒），超过后重新上传，0 表示不过期
+            revalidate_after: 距上次上传或复核多少秒后使用前复核 URL，0 表示不复核
+            max_entries: 最多保留的条目数（超出时淘汰最久未使用的条目）
+            validate: 复核函数 validate(url)，返回 True 可用 / False 已失效 / None 无法判断（保留条目）
+            clock: 时钟函数（便于测试注入）
+        """
+        self.path = path
+        self.ttl = ttl
+        self.revalidate_after = revalidate_after
+        self.max_entries = max(1, max_entries)
+        self._validate = validate
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}  # {内容哈希: 条目}
+        self._fingerprints = {}  # {绝对路径: (mtime_ns, 大小, 内容哈希, (宽, 高))}
+        self._key_locks = {}  # {内容哈希: 上传锁}，同一图片并发发送时只上传一次
+        self._stats = {'hits': 0, 'misses': 0, 'uploads': 0, 'upload_failures': 0, 'hashes': 0,
+                       'expired': 0, 'revalidations': 0, 'revalidation_failures': 0, 'invalidations': 0}
+        self._warmup = {'running': False, 'runs': 0, 'total': 0, 'done': 0, 'cached': 0, 'uploaded': 0,
+                        'failed': 0, 'failures': [], 'seconds': 0.0}
+
+    def configure(self, ttl: float = None, revalidate_after: float = None, max_entries: int = None):
+        """更新有效期与容量参数"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if revalidate_after is not None:
+                self.revalidate_after = revalidate_after
+            if max_entries is not None:
+                self.max_entries = max(1, max_entries)
+                self._evict_locked()
+
+    def fingerprint(self, image_path: str) -> Optional[Tuple[str, Tuple[int, int]]]:
+        """
+        计算图片内容哈希（文件未变化时直接复用上次结果）
+
+        Returns:
+            (内容哈希, (宽, 高))，文件不存在时返回 None
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = os.path.abspath(image_path)
+        with self._lock:
+            cached = self._fingerprints.get(key)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2], cached[3]
+
+        digest = hashlib.sha256()
+        head = b''
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+                if not head:
+                    head = chunk[:65536]
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        dimensions = read_image_size(head)
+        with self._lock:
+            self._stats['hashes'] += 1
+            self._fingerprints[key] = (stat.st_mtime_ns, stat.st_size, content_hash, dimensions)
+        return content_hash, dimensions
+
+    def get(self, image_path: str) -> Optional[Dict[str, Any]]:
+        """查找图片的上传结果，未缓存、已过期或复核失败时返回 None"""
+        fingerprint = self.fingerprint(image_path)
+        if fingerprint is None:
+            return None
+        return self._lookup(fingerprint[0])
+
+    def _lookup(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if self.ttl and now - entry['uploaded_at'] >= self.ttl:
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                del self._entries[content_hash]
+                return None
+            needs_check = bool(self._validate and self.revalidate_after
+                               and now - entry['validated_at'] >= self.revalidate_after)
+
+        if needs_check:
+            try:
+                valid = self._validate(entry['image_url'])
+            except Exception:
+                valid = None
+            with self._lock:
+                self._stats['revalidations'] += 1
+                if valid is False:
+                    self._stats['revalidation_failures'] += 1
+                    self._stats['misses'] += 1
+                    self._entries.pop(content_hash, None)
+                    self._save_locked()
+                    return None
+                if valid:
+                    entry['validated_at'] = now
+
+        with self._lock:
+            self._stats['hits'] += 1
+            # 移到末尾，淘汰时保留最近使用的条目
+            self._entries.pop(content_hash, None)
+            self._entries[content_hash] = entry
+            return dict(entry)
+
+    def put(self, image_path: str, info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """缓存图片的上传结果（上传接口未返回尺寸时使用本地解析的尺寸），返回缓存条目"""
+        fingerprint = self.fingerprint(image_path)
+        if fingerprint is None or not info or not info.get('image_url'):
+            return None
+        return self._store(fingerprint, os.path.getsize(image_path), info)
+
+    def _store(self, fingerprint, file_size: int, info: Dict[str, Any]) -> Dict[str, Any]:
+        content_hash, (width, height) = fingerprint
+        now = self._clock()
+        entry = {
+            'image_url': info['image_url'],
+            'image_width': info.get('image_width') or width,
+            'image_height': info.get('image_height') or height,
+            'image_size': info.get('image_size') or file_size,
+            'uploaded_at': now,
+            'validated_at': now
+        }
+        with self._lock:
+            self._entries.pop(content_hash, None)
+            self._entries[content_hash] = entry
+            self._evict_locked()
+            self._save_locked()
+            return dict(entry)
+
+    def get_or_upload(self, image_path: str, upload: Callable[[str], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        返回图片的上传结果，未缓存时调用 upload(image_path) 上传并缓存
+
+        同一内容的图片并发请求时只上传一次，其余调用等待并复用结果
+
+        Returns:
+            上传结果，文件不存在或上传失败时返回 None
+        """
+        fingerprint = self.fingerprint(image_path)
+        if fingerprint is None:
+            return upload(image_path)
+        content_hash = fingerprint[0]
+        cached = self._lookup(content_hash)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(content_hash, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(content_hash)
+            if entry is not None:
+                # 等待期间其他线程已完成上传
+                return dict(entry)
+            try:
+                info = upload(image_path)
+                with self._lock:
+                    self._stats['uploads' if info else 'upload_failures'] += 1
+                if not info or not info.get('image_url'):
+                    return info or None
+                return self._store(fingerprint, os.path.getsize(image_path), info)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(content_hash, None)
+
+    def warm(self, image_paths: Iterable[str], upload: Callable[[str], Optional[Dict[str, Any]]],
+             workers: int = 3) -> Optional[Dict[str, Any]]:
+        """
+        并发预上传一组图片，已缓存的图片跳过（阻塞直到全部完成）
+
+        Args:
+            image_paths: 图片路径（重复路径只处理一次）
+            upload: 上传函数 upload(image_path)，会在多个线程中同时调用
+            workers: 最多同时上传的数量
+
+        Returns:
+            本次预热统计，已有预热在进行时返回 None
+        """
+        paths = list(dict.fromkeys(os.path.abspath(path) for path in image_paths if path))
+        with self._lock:
+            if self._warmup['running']:
+                return None
+            self._warmup.update(running=True, total=len(paths), done=0, cached=0, uploaded=0, failed=0, failures=[])
+            self._warmup['runs'] += 1
+        started = time.monotonic()
+
+        def warm_one(path):
+            if not os.path.exists(path):
+                self._record_warmup(path, 'failed', "文件不存在")
+                return
+            try:
+                if self.get(path) is not None:
+                    self._record_warmup(path, 'cached')
+                elif self.get_or_upload(path, upload):
+                    self._record_warmup(path, 'uploaded')
+                else:
+                    self._record_warmup(path, 'failed', "上传失败")
+            except Exception as e:
+                self._record_warmup(path, 'failed', str(e)[:200])
+
+        try:
+            if paths:
+                with ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths))),
+                                        thread_name_prefix='upload-warmup') as executor:
+                    list(executor.map(warm_one, paths))
+        finally:
+            with self._lock:
+                self._warmup['running'] = False
+                self._warmup['seconds'] = round(time.monotonic() - started, 2)
+                result = dict(self._warmup, failures=list(self._warmup['failures']))
+        return result
+
+    def _record_warmup(self, path: str, outcome: str, error: str = None):
+        with self._lock:
+            self._warmup['done'] += 1
+            self._warmup[outcome] += 1
+            if error and len(self._warmup['failures']) < _MAX_WARMUP_FAILURES:
+                self._warmup['failures'].append({'path': path, 'error': error})
+
+    def invalidate(self, image_path: str) -> bool:
+        """删除图片的缓存条目（例如发送时服务端拒绝了缓存的 URL），返回是否存在"""
+        fingerprint = self.fingerprint(image_path)
+        if fingerprint is None:
+            return False
+        with self._lock:
+            if self._entries.pop(fingerprint[0], None) is None:
+                return False
+            self._stats['invalidations'] += 1
+            self._save_locked()
+            return True
+
+    def _evict_locked(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+
+    def _save_locked(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': _VERSION, 'entries': self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def save(self):
+        """立即持久化缓存条目"""
+        with self._lock:
+            self._save_locked()
+
+    def load(self) -> int:
+        """从持久化文件恢复缓存条目（跳过已过期的条目），返回恢复的条目数"""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get('version') != _VERSION:
+            return 0
+        now = self._clock()
+        entries = {
+            content_hash: entry for content_hash, entry in (data.get('entries') or {}).items()
+            if isinstance(entry, dict) and entry.get('image_url')
+            and not (self.ttl and now - entry.get('uploaded_at', 0) >= self.ttl)
+        }
+        with self._lock:
+            self._entries = entries
+            self._evict_locked()
+            return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['tracked_files'] = len(self._fingerprints)
+            stats['warmup'] = dict(self._warmup, failures=list(self._warmup['failures']))
+            return stats